@@ -0,0 +1,38 @@
+"""jobs: leasing columns for the durable queue
+
+Revision ID: 0002_jobs_leasing
+Revises: 0001_init_schema
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_jobs_leasing"
+down_revision = "0001_init_schema"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "jobs",
+        sa.Column("run_after", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+    )
+    op.add_column("jobs", sa.Column("locked_until", sa.DateTime(timezone=True), nullable=True))
+    op.add_column("jobs", sa.Column("locked_by", sa.String(length=64), nullable=True))
+
+    # выборка кандидатов на lease: только живые задачи очереди, по времени готовности
+    op.create_index(
+        "ix_jobs_queue_ready",
+        "jobs",
+        ["queue", "run_after", "id"],
+        postgresql_where=sa.text("status IN ('new', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_queue_ready", table_name="jobs")
+    op.drop_column("jobs", "locked_by")
+    op.drop_column("jobs", "locked_until")
+    op.drop_column("jobs", "run_after")
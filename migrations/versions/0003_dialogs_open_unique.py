@@ -0,0 +1,43 @@
+"""dialogs: at most one open dialog per client
+
+Revision ID: 0003_dialogs_open_unique
+Revises: 0002_jobs_leasing
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003_dialogs_open_unique"
+down_revision = "0002_jobs_leasing"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # дубли открытых диалогов (гонки старого resolve-or-create): оставляем самый свежий, остальные закрываем
+    op.execute(
+        """
+        UPDATE dialogs d
+        SET status = 'closed', updated_at = now()
+        FROM (
+            SELECT id,
+                   row_number() OVER (PARTITION BY client_id ORDER BY created_at DESC, id DESC) AS rn
+            FROM dialogs
+            WHERE status = 'open' AND is_enabled
+        ) dup
+        WHERE d.id = dup.id AND dup.rn > 1
+        """
+    )
+
+    op.create_index(
+        "uq_dialogs_client_open",
+        "dialogs",
+        ["client_id"],
+        unique=True,
+        postgresql_where=sa.text("status = 'open' AND is_enabled"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_dialogs_client_open", table_name="dialogs")
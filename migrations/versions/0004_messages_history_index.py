@@ -0,0 +1,29 @@
+"""messages: partial index for history loading
+
+Revision ID: 0004_messages_history_index
+Revises: 0003_dialogs_open_unique
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_messages_history_index"
+down_revision = "0003_dialogs_open_unique"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # load_history: равенство по (dialog_id, resource_id, session_id) + порядок (created_at, id) DESC
+    # -> Index Scan + Limit без Sort; удалённые сообщения в индекс не попадают
+    op.create_index(
+        "ix_messages_history",
+        "messages",
+        ["dialog_id", "resource_id", "session_id", sa.text("created_at DESC"), sa.text("id DESC")],
+        postgresql_where=sa.text("is_deleted = false"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_history", table_name="messages")
@@ -0,0 +1,164 @@
+"""messages/events: monthly range partitions by created_at + per-company retention
+
+Revision ID: 0005_partition_messages_events
+Revises: 0004_messages_history_index
+Create Date: 2026-10-16
+"""
+
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005_partition_messages_events"
+down_revision = "0004_messages_history_index"
+branch_labels = None
+depends_on = None
+
+# сколько будущих месяцев создать сразу; дальше — python -m scripts.maintain_partitions
+MONTHS_AHEAD = 3
+
+MESSAGES_COLUMNS = """
+    id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+    dialog_id integer NOT NULL,
+    direction varchar(8) NOT NULL,
+    text text,
+    resource_id integer,
+    session_id integer,
+    meta jsonb NOT NULL DEFAULT '{}'::jsonb,
+    is_deleted boolean NOT NULL DEFAULT false,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+"""
+
+EVENTS_COLUMNS = """
+    id integer NOT NULL DEFAULT nextval('events_id_seq'),
+    company_id integer NOT NULL,
+    level varchar(16) NOT NULL DEFAULT 'info',
+    kind varchar(64) NOT NULL,
+    message text,
+    resource_id integer,
+    session_id integer,
+    dialog_id integer,
+    message_id integer,
+    meta jsonb NOT NULL DEFAULT '{}'::jsonb,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now()
+"""
+
+MESSAGES_FKS = [
+    ("messages_dialog_id_fkey", "dialog_id", "dialogs", "CASCADE"),
+    ("messages_resource_id_fkey", "resource_id", "resources", "SET NULL"),
+    ("messages_session_id_fkey", "session_id", "sessions", "SET NULL"),
+]
+
+# events.message_id -> messages.id больше не FK: у секционированной messages нет UNIQUE(id)
+EVENTS_FKS = [
+    ("events_company_id_fkey", "company_id", "companies", "CASCADE"),
+    ("events_resource_id_fkey", "resource_id", "resources", "SET NULL"),
+    ("events_session_id_fkey", "session_id", "sessions", "SET NULL"),
+    ("events_dialog_id_fkey", "dialog_id", "dialogs", "SET NULL"),
+]
+
+MESSAGES_INDEXES = [
+    ("ix_messages_dialog_id", ["dialog_id"], None),
+    ("ix_messages_resource_id", ["resource_id"], None),
+    ("ix_messages_session_id", ["session_id"], None),
+    ("ix_messages_dialog_created", ["dialog_id", "created_at"], None),
+    (
+        "ix_messages_history",
+        ["dialog_id", "resource_id", "session_id", sa.text("created_at DESC"), sa.text("id DESC")],
+        sa.text("is_deleted = false"),
+    ),
+]
+
+EVENTS_INDEXES = [
+    ("ix_events_company_id", ["company_id"], None),
+    ("ix_events_kind", ["kind"], None),
+    ("ix_events_resource_id", ["resource_id"], None),
+    ("ix_events_session_id", ["session_id"], None),
+    ("ix_events_dialog_id", ["dialog_id"], None),
+    ("ix_events_message_id", ["message_id"], None),
+    ("ix_events_company_created", ["company_id", "created_at"], None),
+]
+
+
+def _month_start(dt: datetime) -> datetime:
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(dt: datetime, n: int) -> datetime:
+    y, m = divmod(dt.year * 12 + dt.month - 1 + n, 12)
+    return datetime(y, m + 1, 1, tzinfo=timezone.utc)
+
+
+def _rebuild(table: str, columns: str, fks, indexes, *, partitioned: bool) -> None:
+    """
+    Пересоздаёт таблицу (секционированной или обычной) с переносом данных.
+    Таблица на время миграции под ACCESS EXCLUSIVE — запускать при остановленных api/worker.
+    """
+    bind = op.get_bind()
+    old = f"{table}_old"
+
+    op.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE")
+
+    if partitioned:
+        op.execute(f"CREATE TABLE {table} ({columns}) PARTITION BY RANGE (created_at)")
+
+        first = bind.execute(sa.text(f"SELECT min(created_at) FROM {old}")).scalar()
+        now = datetime.now(timezone.utc)
+        month = _month_start(first.astimezone(timezone.utc) if first else now)
+        last = _add_months(_month_start(now), MONTHS_AHEAD)
+        while month <= last:
+            upper = _add_months(month, 1)
+            op.execute(
+                f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+            month = upper
+        # страховка, если обслуживание не запускали: строка не потеряется, scripts.maintain_partitions её перенесёт
+        op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        pk = "id, created_at"
+    else:
+        op.execute(f"CREATE TABLE {table} ({columns})")
+        pk = "id"
+
+    names = ", ".join(line.split()[0] for line in columns.strip().split(",\n"))
+    op.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {old}")
+    op.execute(f"DROP TABLE {old}")
+
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({pk})")
+    for name, column, ref, ondelete in fks:
+        op.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+            f"REFERENCES {ref} (id) ON DELETE {ondelete}"
+        )
+    for name, cols, where in indexes:
+        op.create_index(name, table, cols, postgresql_where=where)
+
+
+def upgrade() -> None:
+    # срок хранения истории компании в месяцах; NULL — значение по умолчанию из MESSAGES_RETENTION_MONTHS
+    op.add_column("companies", sa.Column("retention_months", sa.Integer(), nullable=True))
+
+    op.drop_constraint("events_message_id_fkey", "events", type_="foreignkey")
+    _rebuild("events", EVENTS_COLUMNS, EVENTS_FKS, EVENTS_INDEXES, partitioned=True)
+    _rebuild("messages", MESSAGES_COLUMNS, MESSAGES_FKS, MESSAGES_INDEXES, partitioned=True)
+
+
+def downgrade() -> None:
+    # отсоединённые (detach) секции в обратный перенос не попадают
+    _rebuild("messages", MESSAGES_COLUMNS, MESSAGES_FKS, MESSAGES_INDEXES, partitioned=False)
+    _rebuild("events", EVENTS_COLUMNS, EVENTS_FKS, EVENTS_INDEXES, partitioned=False)
+    # ссылки на сообщения, удалённые вместе с секциями, обнуляем, иначе FK не создать
+    op.execute(
+        "UPDATE events e SET message_id = NULL "
+        "WHERE message_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.id = e.message_id)"
+    )
+    op.create_foreign_key(
+        "events_message_id_fkey", "events", "messages", ["message_id"], ["id"], ondelete="SET NULL"
+    )
+
+    op.drop_column("companies", "retention_months")
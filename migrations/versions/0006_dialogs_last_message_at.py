@@ -0,0 +1,75 @@
+"""dialogs: last_message_at (maintained by trigger) for keyset listing by activity
+
+Revision ID: 0006_dialogs_last_message_at
+Revises: 0005_partition_messages_events
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006_dialogs_last_message_at"
+down_revision = "0005_partition_messages_events"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "dialogs",
+        sa.Column("last_message_at", sa.DateTime(timezone=True), server_default=sa.text("now()"), nullable=False),
+    )
+    op.execute(
+        """
+        UPDATE dialogs d
+        SET last_message_at = coalesce(
+            (SELECT max(m.created_at) FROM messages m WHERE m.dialog_id = d.id),
+            d.created_at
+        )
+        """
+    )
+
+    # список диалогов компании по активности: keyset (last_message_at, id) DESC без Sort
+    op.create_index(
+        "ix_dialogs_company_activity",
+        "dialogs",
+        ["company_id", sa.text("last_message_at DESC"), sa.text("id DESC")],
+    )
+
+    # statement-level: пачка BatchWriter (один multi-row INSERT) -> один UPDATE по затронутым диалогам;
+    # строки dialogs блокируются по возрастанию id — параллельные пачки не ловят deadlock
+    op.execute(
+        """
+        CREATE FUNCTION dialogs_touch_last_message() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM 1 FROM dialogs
+            WHERE id IN (SELECT DISTINCT dialog_id FROM new_messages)
+            ORDER BY id
+            FOR UPDATE;
+
+            UPDATE dialogs d
+            SET last_message_at = n.last_at
+            FROM (SELECT dialog_id, max(created_at) AS last_at FROM new_messages GROUP BY dialog_id) n
+            WHERE d.id = n.dialog_id AND d.last_message_at < n.last_at;
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER trg_messages_dialog_activity
+        AFTER INSERT ON messages
+        REFERENCING NEW TABLE AS new_messages
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION dialogs_touch_last_message()
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_messages_dialog_activity ON messages")
+    op.execute("DROP FUNCTION IF EXISTS dialogs_touch_last_message()")
+    op.drop_index("ix_dialogs_company_activity", table_name="dialogs")
+    op.drop_column("dialogs", "last_message_at")
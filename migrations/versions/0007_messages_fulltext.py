@@ -0,0 +1,41 @@
+"""messages: generated tsvector (russian + english) + partial GIN index for full-text search
+
+Revision ID: 0007_messages_fulltext
+Revises: 0006_dialogs_last_message_at
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007_messages_fulltext"
+down_revision = "0006_dialogs_last_message_at"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # STORED: вектор считается один раз при INSERT/UPDATE text, поиск его не пересчитывает.
+    # Обе конфигурации: русская стемминг-форма + английская (переписка смешанная).
+    # На секционированной messages колонка и индекс создаются во всех секциях (таблица переписывается).
+    op.execute(
+        """
+        ALTER TABLE messages ADD COLUMN text_tsv tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('russian'::regconfig, coalesce(text, ''))
+            || to_tsvector('english'::regconfig, coalesce(text, ''))
+        ) STORED
+        """
+    )
+    op.create_index(
+        "ix_messages_text_tsv",
+        "messages",
+        ["text_tsv"],
+        postgresql_using="gin",
+        postgresql_where=sa.text("is_deleted = false"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_messages_text_tsv", table_name="messages")
+    op.drop_column("messages", "text_tsv")
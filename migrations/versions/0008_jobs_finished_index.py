@@ -0,0 +1,28 @@
+"""jobs: partial index for purging finished (done / failed) jobs
+
+Revision ID: 0008_jobs_finished_index
+Revises: 0007_messages_fulltext
+Create Date: 2026-10-16
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008_jobs_finished_index"
+down_revision = "0007_messages_fulltext"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # purge_finished_jobs: завершённые задачи старше срока хранения, от старых к новым, без Seq Scan живой очереди
+    op.create_index(
+        "ix_jobs_finished",
+        "jobs",
+        ["updated_at", "id"],
+        postgresql_where=sa.text("status IN ('done', 'failed')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_jobs_finished", table_name="jobs")
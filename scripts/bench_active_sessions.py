@@ -0,0 +1,134 @@
+"""
+PATH: scripts/bench_active_sessions.py
+PURPOSE: Бенчмарк fetch_active_tg_sessions: время и число SQL-запросов на 10 .. 10 000 сессий.
+
+Запуск (нужна рабочая БД с миграциями, те же DB_* env, что у воркера):
+    python -m scripts.bench_active_sessions
+    python -m scripts.bench_active_sessions --sizes 10,100,1000,10000 --prompts 5
+
+Данные создаются во временной компании и удаляются в конце (ON DELETE CASCADE).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import delete, event, insert
+
+from src.models import Company, Resource, ResourceSettings, Session, SessionSettings
+from src.storage.db import get_engine, get_sessionmaker
+from src.worker import fetch_active_tg_sessions
+
+
+async def _seed(company_id: int, n_sessions: int, n_prompts: int) -> None:
+    async with get_sessionmaker()() as db:
+        prompt_ids = (
+            await db.execute(
+                insert(Resource).returning(Resource.id),
+                [
+                    {"company_id": company_id, "kind": "prompt", "code": f"bench-p-{uuid.uuid4()}"}
+                    for _ in range(n_prompts)
+                ],
+            )
+        ).scalars().all()
+        await db.execute(
+            insert(ResourceSettings),
+            [{"resource_id": pid, "data": {"history_pairs": 10}} for pid in prompt_ids],
+        )
+
+        tg_ids = (
+            await db.execute(
+                insert(Resource).returning(Resource.id),
+                [
+                    {"company_id": company_id, "kind": "telegram", "code": f"bench-tg-{uuid.uuid4()}"}
+                    for _ in range(n_sessions)
+                ],
+            )
+        ).scalars().all()
+        await db.execute(
+            insert(ResourceSettings),
+            [
+                {
+                    "resource_id": rid,
+                    "data": {
+                        "api_id": 1,
+                        "api_hash": "bench",
+                        "prompt_resource_id": prompt_ids[i % len(prompt_ids)],
+                    },
+                }
+                for i, rid in enumerate(tg_ids)
+            ],
+        )
+
+        session_ids = (
+            await db.execute(
+                insert(Session).returning(Session.id),
+                [{"resource_id": rid, "code": "default"} for rid in tg_ids],
+            )
+        ).scalars().all()
+        await db.execute(
+            insert(SessionSettings),
+            [
+                {"session_id": sid, "data": {"is_activated": True, "session_string": "bench"}}
+                for sid in session_ids
+            ],
+        )
+        await db.commit()
+
+
+async def _run(sizes: list[int], n_prompts: int, repeats: int) -> None:
+    queries = 0
+
+    def _count(*_args, **_kwargs) -> None:
+        nonlocal queries
+        queries += 1
+
+    sync_engine = get_engine().sync_engine
+
+    print(f"{'sessions':>10} {'queries':>8} {'best_ms':>10} {'avg_ms':>10}")
+    for size in sizes:
+        async with get_sessionmaker()() as db:
+            company = Company(name=f"bench-{uuid.uuid4()}", is_enabled=True)
+            db.add(company)
+            await db.commit()
+            company_id = int(company.id)
+
+        try:
+            await _seed(company_id, size, n_prompts)
+
+            timings: list[float] = []
+            event.listen(sync_engine, "before_cursor_execute", _count)
+            try:
+                for _ in range(repeats):
+                    queries = 0
+                    t0 = time.perf_counter()
+                    await fetch_active_tg_sessions()
+                    timings.append((time.perf_counter() - t0) * 1000)
+            finally:
+                event.remove(sync_engine, "before_cursor_execute", _count)
+
+            print(f"{size:>10} {queries:>8} {min(timings):>10.1f} {sum(timings) / len(timings):>10.1f}")
+        finally:
+            async with get_sessionmaker()() as db:
+                await db.execute(delete(Company).where(Company.id == company_id))
+                await db.commit()
+
+    await get_engine().dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--prompts", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    asyncio.run(_run(sizes, max(1, args.prompts), max(1, args.repeats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+PATH: scripts/bench_search.py
+PURPOSE: Бенчмарк полнотекстового поиска (storage.search) на синтетическом корпусе до 10M сообщений:
+         латентность первой и глубоких страниц (keyset) для частых, редких и фразовых запросов.
+
+Запуск (нужна БД с миграциями, те же DB_* env, что у воркера; 10M строк — это несколько ГБ и десятки минут):
+    python -m scripts.bench_search                                  # 10M строк, потом удалить
+    python -m scripts.bench_search --rows 1000000 --keep            # оставить корпус
+    python -m scripts.bench_search --company-id 123 --explain       # повторный прогон по оставленному корпусу
+
+Корпус создаётся во временной компании генерацией на стороне Postgres (INSERT ... SELECT generate_series),
+пачками по --chunk строк; в конце компания удаляется (ON DELETE CASCADE), если не задан --keep.
+Тексты — 6..15 слов: часть из словаря ниже (по ним и ищем), остальное — редкие токены tokNNNNN.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+from sqlalchemy import delete, insert, text
+from sqlalchemy.dialects import postgresql
+
+from src.models import Company
+from src.storage.db import get_engine, get_sessionmaker
+from src.storage.search import search_messages, search_messages_stmt
+
+WORDS = [
+    "доставка", "груз", "склад", "таможня", "оформление", "оплата", "счёт", "договор", "контейнер", "фура",
+    "маршрут", "водитель", "погрузка", "выгрузка", "страховка", "тариф", "расчёт", "накладная", "паллета",
+    "китай", "москва", "сроки", "задержка", "трекинг", "менеджер", "скидка", "вес", "объём", "упаковка",
+    "shipping", "cargo", "invoice", "warehouse", "customs", "container", "truck", "delivery", "payment",
+    "tracking", "pallet", "freight", "insurance", "quote", "order", "status", "delay", "price",
+]
+
+QUERIES = [
+    "доставка",                  # частое слово
+    "таможенное оформление",     # два слова, морфология (оформление/оформления)
+    '"оплата счёта"',            # фраза
+    "shipping -delay",           # английский + исключение
+    "tok4242",                   # редкий токен
+]
+
+
+async def _seed(rows: int, dialogs: int, chunk: int, days: int) -> int:
+    sm = get_sessionmaker()
+    async with sm() as db:
+        company_id = (
+            await db.execute(
+                insert(Company).values(name=f"bench-search-{uuid.uuid4().hex[:8]}").returning(Company.id)
+            )
+        ).scalar_one()
+        await db.execute(
+            text(
+                "INSERT INTO clients (company_id, code) "
+                "SELECT :c, 'bench-' || g FROM generate_series(1, :n) AS g"
+            ),
+            {"c": company_id, "n": dialogs},
+        )
+        await db.execute(
+            text(
+                "INSERT INTO dialogs (company_id, client_id, status) "
+                "SELECT company_id, id, 'open' FROM clients WHERE company_id = :c"
+            ),
+            {"c": company_id},
+        )
+        await db.commit()
+
+    seed_sql = text(
+        """
+        INSERT INTO messages (dialog_id, direction, text, created_at)
+        SELECT
+            d.ids[1 + (g % cardinality(d.ids))],
+            CASE WHEN g % 2 = 0 THEN 'in' ELSE 'out' END,
+            (
+                SELECT string_agg(
+                    CASE WHEN random() < 0.6
+                         THEN (CAST(:words AS text[]))[1 + floor(random() * cardinality(CAST(:words AS text[])))::int]
+                         ELSE 'tok' || floor(random() * 50000)::int
+                    END,
+                    ' '
+                )
+                FROM generate_series(1, 6 + (g % 10)) AS k
+            ),
+            now() - random() * make_interval(days => :days)
+        FROM generate_series(CAST(:lo AS bigint), CAST(:hi AS bigint)) AS g,
+             (SELECT array_agg(id) AS ids FROM dialogs WHERE company_id = :c) AS d
+        """
+    )
+
+    done = 0
+    t0 = time.perf_counter()
+    while done < rows:
+        n = min(chunk, rows - done)
+        async with sm() as db:
+            await db.execute(seed_sql, {"words": WORDS, "days": days, "lo": done + 1, "hi": done + n, "c": company_id})
+            await db.commit()
+        done += n
+        print(f"seed: {done}/{rows} rows ({time.perf_counter() - t0:.0f}s)")
+
+    async with get_engine().connect() as conn:
+        await conn.execute(text("ANALYZE messages"))
+        await conn.execute(text("ANALYZE dialogs"))
+    return int(company_id)
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+
+async def _bench(company_id: int, pages: int, limit: int, repeat: int, explain: bool) -> None:
+    sm = get_sessionmaker()
+    print(f"\n{'query':<26} {'page':>4} {'rows':>5} {'p50 ms':>8} {'p95 ms':>8}")
+    for q in QUERIES:
+        timings: dict[int, list[float]] = {}
+        counts: dict[int, int] = {}
+        for _ in range(max(1, repeat)):
+            cursor = None
+            async with sm() as db:
+                for page in range(1, pages + 1):
+                    t0 = time.perf_counter()
+                    items, cursor = await search_messages(db, company_id=company_id, query=q, limit=limit, cursor=cursor)
+                    timings.setdefault(page, []).append((time.perf_counter() - t0) * 1000)
+                    counts[page] = len(items)
+                    if not cursor:
+                        break
+        for page, values in sorted(timings.items()):
+            print(f"{q:<26} {page:>4} {counts[page]:>5} {statistics.median(values):>8.1f} {_pct(values, 0.95):>8.1f}")
+
+        if explain:
+            stmt = search_messages_stmt(company_id=company_id, query=q, limit=limit)
+            sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+            async with sm() as db:
+                raw = (await db.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"))).scalar_one()
+            data = raw if isinstance(raw, list) else json.loads(raw)
+            print(json.dumps(data[0]["Plan"], indent=2, ensure_ascii=False, default=str))
+
+
+async def _run(args: argparse.Namespace) -> None:
+    company_id = args.company_id
+    created = False
+    if not company_id:
+        company_id = await _seed(args.rows, args.dialogs, args.chunk, args.days)
+        created = True
+
+    try:
+        await _bench(company_id, args.pages, args.limit, args.repeat, args.explain)
+    finally:
+        if created and not args.keep:
+            print(f"\ncleanup: company_id={company_id} (cascade delete, may take a while)")
+            async with get_sessionmaker()() as db:
+                await db.execute(delete(Company).where(Company.id == company_id))
+                await db.commit()
+        elif created:
+            print(f"\nkept: --company-id {company_id}")
+        await get_engine().dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--dialogs", type=int, default=20_000)
+    parser.add_argument("--chunk", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=25)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--company-id", type=int, default=None)
+    parser.add_argument("--keep", action="store_true")
+    parser.add_argument("--explain", action="store_true")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
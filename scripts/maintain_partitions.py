@@ -0,0 +1,92 @@
+"""
+PATH: scripts/maintain_partitions.py
+PURPOSE: Обслуживание помесячных секций messages / events (миграция 0005):
+         - создаёт секции на PARTITIONS_AHEAD_MONTHS вперёд (и переносит строки, попавшие в DEFAULT);
+         - удаляет (или отсоединяет) секции, вышедшие за срок хранения всех компаний.
+
+Запуск (раз в сутки по cron; те же DB_* env, что у воркера):
+    python -m scripts.maintain_partitions
+    python -m scripts.maintain_partitions --dry-run
+    python -m scripts.maintain_partitions --detach          # оставить старые секции таблицами для архива
+    python -m scripts.maintain_partitions --purge           # + DELETE строк компаний с коротким сроком
+
+Срок хранения: companies.retention_months, для NULL — MESSAGES_RETENTION_MONTHS (0 — хранить всё).
+Секция общая для всех компаний, поэтому DROP/DETACH — только когда срок вышел у всех;
+строки компании с более коротким сроком из оставшихся секций удаляет --purge (по одной секции).
+Каждая таблица — отдельная транзакция с lock_timeout (PARTITION_LOCK_TIMEOUT).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+
+from src.storage.db import get_engine
+from src.storage.partitions import (
+    PARTITIONED_TABLES,
+    PARTITIONS_AHEAD_MONTHS,
+    drop_expired_partitions,
+    ensure_partitions,
+    purge_company_rows,
+    retention_cutoffs,
+    set_lock_timeout,
+    table_cutoff,
+)
+
+
+async def _run(ahead: int, detach: bool, purge: bool, dry_run: bool) -> int:
+    engine = get_engine()
+    prefix = "[dry-run] " if dry_run else ""
+    failed = 0
+
+    async with engine.connect() as conn:
+        cutoffs = await retention_cutoffs(conn)
+    cutoff = table_cutoff(cutoffs)
+    print(f"[partitions] companies={len(cutoffs)} table_cutoff={cutoff.date() if cutoff else None}")
+
+    for table in PARTITIONED_TABLES:
+        try:
+            async with engine.begin() as conn:
+                await set_lock_timeout(conn)
+                created = await ensure_partitions(conn, table, months_ahead=ahead, dry_run=dry_run)
+                removed = await drop_expired_partitions(conn, table, cutoff=cutoff, detach=detach, dry_run=dry_run)
+            action = "detached" if detach else "dropped"
+            print(f"{prefix}[partitions] {table}: created={created} {action}={removed}")
+        except Exception as e:
+            failed += 1
+            print(f"[partitions] {table} error: {e.__class__.__name__}: {e}")
+            continue
+
+        if not purge:
+            continue
+        for company_id, company_cutoff in sorted(cutoffs.items()):
+            if company_cutoff is None or (cutoff is not None and company_cutoff <= cutoff):
+                continue
+            try:
+                async with engine.begin() as conn:
+                    n = await purge_company_rows(
+                        conn, table, company_id=company_id, cutoff=company_cutoff, dry_run=dry_run
+                    )
+                if n:
+                    print(f"{prefix}[partitions] {table}: company_id={company_id} purged={n}")
+            except Exception as e:
+                failed += 1
+                print(f"[partitions] {table} purge company_id={company_id} error: {e.__class__.__name__}: {e}")
+
+    await engine.dispose()
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ahead", type=int, default=PARTITIONS_AHEAD_MONTHS)
+    parser.add_argument("--detach", action="store_true")
+    parser.add_argument("--purge", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(_run(max(0, args.ahead), args.detach, args.purge, args.dry_run)))
+
+
+if __name__ == "__main__":
+    main()
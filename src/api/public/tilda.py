@@ -2,30 +2,32 @@
 PATH: src/api/public/tilda.py
 PURPOSE:
 - POST /public/tilda/chat: validates widget_token, resolves resource/client/dialog, writes messages, returns LLM reply
-- GET  /public/tilda/history: returns dialog messages for widget_token + external_client_id
+- POST /public/tilda/chat/stream: same, but the reply comes as server-sent events while the model generates it
+- GET  /public/tilda/history: returns dialog messages for widget_token + external_client_id (latest page, keyset cursor for older)
 - POST /public/tilda/clear: soft-deletes dialog messages for widget_token + external_client_id
 """
 
 from __future__ import annotations
 
+import asyncio
+import json
 import os
 from datetime import datetime
-from typing import Any
+from typing import Any, AsyncIterator
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from openai import AsyncOpenAI
 from pydantic import BaseModel, Field
-from sqlalchemy import select, update
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.storage.db import get_db
+from src.storage.messages import DialogRef, clear_dialog, list_messages_page, resolve_dialog_ref, write_message
+from src.storage.pagination import MAX_PAGE_SIZE
 from src.models import (
     Resource,
     ResourceSettings,
-    Client,
-    ClientIdentity,
-    Dialog,
-    Message,
 )
 
 router = APIRouter(prefix="/tilda")
@@ -56,6 +58,8 @@ class HistoryItem(BaseModel):
 class TildaHistoryOut(BaseModel):
     dialog_id: int
     items: list[HistoryItem]
+    # более старые сообщения: /history?...&cursor=<next_cursor>; None — это начало диалога
+    next_cursor: str | None = None
 
 
 class TildaClearIn(BaseModel):
@@ -90,70 +94,17 @@ async def _resolve_resource(db: AsyncSession, widget_token: str) -> tuple[Resour
     return resource, settings
 
 
-async def _resolve_or_create_client(
-    db: AsyncSession,
-    *,
-    company_id: int,
-    resource_id: int,
-    external_client_id: str,
-) -> Client:
-    # 1) try identity
-    stmt = (
-        select(Client)
-        .join(ClientIdentity, ClientIdentity.client_id == Client.id)
-        .where(
-            Client.company_id == company_id,
-            Client.is_enabled.is_(True),
-            ClientIdentity.resource_id == resource_id,
-            ClientIdentity.kind == "tilda",
-            ClientIdentity.external_id == external_client_id,
-            ClientIdentity.is_enabled.is_(True),
-        )
-        .limit(1)
-    )
-    client = (await db.execute(stmt)).scalar_one_or_none()
-    if client:
-        return client
-
-    # 2) create client + identity
-    client_code = external_client_id[:64]  # Client.code ограничен 64
-    client = Client(company_id=company_id, code=client_code, meta={"source": "tilda"})
-    db.add(client)
-    await db.flush()  # получить client.id
-
-    identity = ClientIdentity(
-        client_id=client.id,
-        resource_id=resource_id,
-        external_id=external_client_id,
+async def _resolve_ref(db: AsyncSession, resource: Resource, external_client_id: str) -> DialogRef:
+    """client + открытый dialog по (resource, external_client_id) — общий резолвер с кэшем (см. storage.messages)."""
+    return await resolve_dialog_ref(
+        db,
+        company_id=int(resource.company_id),
+        resource_id=int(resource.id),
+        session_id=None,
         kind="tilda",
-        meta={},
-    )
-    db.add(identity)
-    await db.flush()
-
-    return client
-
-
-async def _resolve_or_create_dialog(db: AsyncSession, *, company_id: int, client_id: int, resource_id: int) -> Dialog:
-    stmt = (
-        select(Dialog)
-        .where(
-            Dialog.company_id == company_id,
-            Dialog.client_id == client_id,
-            Dialog.status == "open",
-            Dialog.is_enabled.is_(True),
-        )
-        .order_by(Dialog.created_at.desc())
-        .limit(1)
+        external_id=external_client_id,
+        dialog_meta={"resource_id": int(resource.id)},
     )
-    dialog = (await db.execute(stmt)).scalar_one_or_none()
-    if dialog:
-        return dialog
-
-    dialog = Dialog(company_id=company_id, client_id=client_id, meta={"resource_id": resource_id})
-    db.add(dialog)
-    await db.flush()
-    return dialog
 
 
 def _settings_get(settings: ResourceSettings, key: str, default: Any = None) -> Any:
@@ -162,7 +113,7 @@ def _settings_get(settings: ResourceSettings, key: str, default: Any = None) ->
     return settings.data.get(key, default)
 
 
-async def _call_openai(*, settings: ResourceSettings, text: str) -> str:
+def _build_prompt(*, settings: ResourceSettings, text: str) -> tuple[str, str]:
     model = _settings_get(settings, "model") or os.getenv("OPENAI_MODEL") or "gpt-4o-mini"
     system_prompt = _settings_get(settings, "system_prompt") or os.getenv("OPENAI_SYSTEM_PROMPT")
 
@@ -171,6 +122,11 @@ async def _call_openai(*, settings: ResourceSettings, text: str) -> str:
         prompt = f"{system_prompt}\n\nUSER:\n{text}"
     else:
         prompt = text
+    return model, prompt
+
+
+async def _call_openai(*, settings: ResourceSettings, text: str) -> str:
+    model, prompt = _build_prompt(settings=settings, text=text)
 
     resp = await _openai.responses.create(
         model=model,
@@ -182,37 +138,56 @@ async def _call_openai(*, settings: ResourceSettings, text: str) -> str:
     return reply
 
 
+# элементы очереди между чтением ответа модели и SSE-генератором
+_DONE = object()
+_DISCONNECTED = object()
+
+
+async def _pump_openai(*, settings: ResourceSettings, text: str, queue: asyncio.Queue) -> None:
+    """
+    Читает потоковый ответ модели и складывает куски текста в queue; в конце — _DONE или исключение.
+    Отмена задачи закрывает HTTP-поток к OpenAI (async with), генерация там обрывается.
+    """
+    model, prompt = _build_prompt(settings=settings, text=text)
+    try:
+        async with await _openai.responses.create(model=model, input=prompt, stream=True) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if event.delta:
+                        queue.put_nowait(event.delta)
+                elif event.type in ("response.failed", "error"):
+                    err = getattr(event, "message", None) or getattr(getattr(event, "response", None), "error", None)
+                    raise RuntimeError(f"stream error: {err}")
+        queue.put_nowait(_DONE)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        queue.put_nowait(e)
+
+
+async def _wait_disconnect(request: Request) -> None:
+    """Тело запроса уже прочитано: следующее ASGI-сообщение — только http.disconnect (клиент ушёл)."""
+    while True:
+        message = await request.receive()
+        if message.get("type") == "http.disconnect":
+            return
+
+
+def _sse(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 # ---------- endpoints ----------
 
 @router.post("/chat", response_model=TildaChatOut)
 async def tilda_chat(inp: TildaChatIn, db: AsyncSession = Depends(get_db)) -> TildaChatOut:
     resource, rset = await _resolve_resource(db, inp.widget_token)
-
-    client = await _resolve_or_create_client(
-        db,
-        company_id=resource.company_id,
-        resource_id=resource.id,
-        external_client_id=inp.external_client_id,
-    )
-
-    dialog = await _resolve_or_create_dialog(
-        db,
-        company_id=resource.company_id,
-        client_id=client.id,
-        resource_id=resource.id,
-    )
+    ref = await _resolve_ref(db, resource, inp.external_client_id)
+    # новый client/dialog должен быть закоммичен до записи сообщений через BatchWriter (другая сессия)
+    await db.commit()
 
     # inbound message (фиксируем сразу)
-    msg_in = Message(
-        dialog_id=dialog.id,
-        direction="in",
-        text=inp.text,
-        resource_id=resource.id,
-        session_id=None,
-        meta={"external_client_id": inp.external_client_id},
-    )
-    db.add(msg_in)
-    await db.commit()
+    await write_message(ref, direction="in", text=inp.text, meta={"external_client_id": inp.external_client_id})
 
     # LLM
     try:
@@ -222,79 +197,105 @@ async def tilda_chat(inp: TildaChatIn, db: AsyncSession = Depends(get_db)) -> Ti
         raise HTTPException(status_code=502, detail=f"LLM error: {type(e).__name__}: {e}") from e
 
     # outbound message
-    msg_out = Message(
-        dialog_id=dialog.id,
-        direction="out",
-        text=reply,
-        resource_id=resource.id,
-        session_id=None,
-        meta={},
-    )
-    db.add(msg_out)
+    await write_message(ref, direction="out", text=reply)
+
+    return TildaChatOut(reply=reply, dialog_id=ref.dialog_id)
+
+
+@router.post("/chat/stream")
+async def tilda_chat_stream(inp: TildaChatIn, request: Request, db: AsyncSession = Depends(get_db)) -> StreamingResponse:
+    """
+    Потоковый вариант /chat (text/event-stream):
+      event: meta  data: {"dialog_id"}         — сразу, входящее уже сохранено
+      event: delta data: {"text"}              — куски ответа по мере генерации
+      event: done  data: {"reply", "dialog_id"} — полный ответ, исходящее сохранено одним INSERT
+      event: error data: {"detail"}            — модель упала (входящее остаётся сохранённым)
+    Клиент закрыл соединение — запрос к модели отменяется (токены дальше не тратятся),
+    уже сгенерированная часть сохраняется как исходящее с meta.interrupted.
+    """
+    resource, rset = await _resolve_resource(db, inp.widget_token)
+    ref = await _resolve_ref(db, resource, inp.external_client_id)
+    # новый client/dialog должен быть закоммичен до записи сообщений через BatchWriter (другая сессия)
     await db.commit()
 
-    return TildaChatOut(reply=reply, dialog_id=dialog.id)
+    # inbound message (фиксируем до запроса к модели)
+    await write_message(ref, direction="in", text=inp.text, meta={"external_client_id": inp.external_client_id})
+
+    async def _events() -> AsyncIterator[str]:
+        queue: asyncio.Queue = asyncio.Queue()
+        pump = asyncio.create_task(_pump_openai(settings=rset, text=inp.text, queue=queue))
+
+        async def _watch() -> None:
+            await _wait_disconnect(request)
+            pump.cancel()
+            queue.put_nowait(_DISCONNECTED)
+
+        watcher = asyncio.create_task(_watch())
+        parts: list[str] = []
+        saved = False
+        try:
+            yield _sse("meta", {"dialog_id": ref.dialog_id})
+            while True:
+                item = await queue.get()
+                if item is _DISCONNECTED:
+                    return
+                if isinstance(item, Exception):
+                    yield _sse("error", {"detail": f"LLM error: {type(item).__name__}: {item}"})
+                    saved = True  # как в /chat: без ответа модели исходящего нет
+                    return
+                if item is _DONE:
+                    break
+                parts.append(item)
+                yield _sse("delta", {"text": item})
+
+            reply = "".join(parts).strip() or "Не получил текст ответа от модели."
+            await write_message(ref, direction="out", text=reply)
+            saved = True
+            yield _sse("done", {"reply": reply, "dialog_id": ref.dialog_id})
+        finally:
+            watcher.cancel()
+            pump.cancel()
+            partial = "".join(parts).strip()
+            if not saved and partial:
+                # без ожидания: генератор могут закрывать уже отменённым
+                await write_message(ref, direction="out", text=partial, meta={"interrupted": True}, wait=False)
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/history", response_model=TildaHistoryOut)
-async def tilda_history(widget_token: str, external_client_id: str, db: AsyncSession = Depends(get_db)) -> TildaHistoryOut:
+async def tilda_history(
+    widget_token: str,
+    external_client_id: str,
+    cursor: str | None = None,
+    limit: int = Query(default=MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+) -> TildaHistoryOut:
     resource, _ = await _resolve_resource(db, widget_token)
+    ref = await _resolve_ref(db, resource, external_client_id)
 
-    client = await _resolve_or_create_client(
-        db,
-        company_id=resource.company_id,
-        resource_id=resource.id,
-        external_client_id=external_client_id,
-    )
-
-    dialog = await _resolve_or_create_dialog(
-        db,
-        company_id=resource.company_id,
-        client_id=client.id,
-        resource_id=resource.id,
-    )
-
-    stmt = (
-        select(Message)
-        .where(Message.dialog_id == dialog.id, Message.is_deleted.is_(False))
-        .order_by(Message.created_at.asc())
-        .limit(200)
-    )
-    msgs = (await db.execute(stmt)).scalars().all()
+    # последние limit сообщений (keyset от новых к старым), отдаём по возрастанию времени
+    try:
+        msgs, next_cursor = await list_messages_page(db, dialog_id=ref.dialog_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    msgs.reverse()
 
     items = [
         HistoryItem(id=m.id, direction=m.direction, text=m.text, created_at=m.created_at)
         for m in msgs
     ]
-    return TildaHistoryOut(dialog_id=dialog.id, items=items)
+    return TildaHistoryOut(dialog_id=ref.dialog_id, items=items, next_cursor=next_cursor)
 
 
 @router.post("/clear", response_model=TildaClearOut)
 async def tilda_clear(inp: TildaClearIn, db: AsyncSession = Depends(get_db)) -> TildaClearOut:
     resource, _ = await _resolve_resource(db, inp.widget_token)
+    ref = await _resolve_ref(db, resource, inp.external_client_id)
 
-    client = await _resolve_or_create_client(
-        db,
-        company_id=resource.company_id,
-        resource_id=resource.id,
-        external_client_id=inp.external_client_id,
-    )
-
-    dialog = await _resolve_or_create_dialog(
-        db,
-        company_id=resource.company_id,
-        client_id=client.id,
-        resource_id=resource.id,
-    )
-
-    stmt = (
-        update(Message)
-        .where(Message.dialog_id == dialog.id, Message.is_deleted.is_(False))
-        .values(is_deleted=True)
-    )
-    res = await db.execute(stmt)
-    await db.commit()
-
-    # res.rowcount может быть None в некоторых режимах — приводим к int безопасно
-    deleted = int(res.rowcount or 0)
-    return TildaClearOut(ok=True, dialog_id=dialog.id, deleted=deleted)
+    deleted = await clear_dialog(db, ref)
+    return TildaClearOut(ok=True, dialog_id=ref.dialog_id, deleted=deleted)
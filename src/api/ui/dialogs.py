@@ -1,15 +1,19 @@
 """
 PATH: src/api/ui/dialogs.py
-PURPOSE: UI pages for Dialogs.
+PURPOSE: UI pages for Dialogs + JSON pages for them (keyset cursors, rendered incrementally by /static/ui/dialogs.js).
 """
 
 from __future__ import annotations
 
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, Request, Depends, HTTPException, Query
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
 from src.api.deps import require_company_from_token
+from src.storage.db import get_db
+from src.storage.dialogs import get_company_dialog, list_dialogs_page
+from src.storage.messages import list_messages_page
+from src.storage.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 router = APIRouter()
 templates = Jinja2Templates(directory="src/web/templates")
@@ -27,7 +31,6 @@ async def dialogs_list(
         {
             "request": request,
             "company_id": company_id,
-            "items": [],
         },
     )
 
@@ -37,15 +40,69 @@ async def dialog_detail(
     request: Request,
     dialog_id: int,
     _ctx=Depends(require_company_from_token),
+    db=Depends(get_db),
 ):
     company_id = request.state.company_id
 
+    dialog = await get_company_dialog(db, company_id=company_id, dialog_id=dialog_id)
+    if not dialog:
+        raise HTTPException(status_code=404, detail="Dialog not found")
+
     return templates.TemplateResponse(
         "ui/dialog_detail.html",
         {
             "request": request,
             "company_id": company_id,
             "dialog_id": dialog_id,
-            "messages": [],
+            "dialog": dialog,
         },
     )
+
+
+@router.get("/api/dialogs")
+async def dialogs_page(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    status: str | None = None,
+    _ctx=Depends(require_company_from_token),
+    db=Depends(get_db),
+):
+    """Диалоги компании, свежие по активности первыми. Следующая страница — ?cursor=<next_cursor>."""
+    company_id = request.state.company_id
+
+    try:
+        items, next_cursor = await list_dialogs_page(
+            db, company_id=company_id, limit=limit, cursor=cursor, status=status
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/api/dialogs/{dialog_id}/messages")
+async def dialog_messages_page(
+    request: Request,
+    dialog_id: int,
+    cursor: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    _ctx=Depends(require_company_from_token),
+    db=Depends(get_db),
+):
+    """Сообщения диалога от новых к старым. Следующая страница (более старые) — ?cursor=<next_cursor>."""
+    company_id = request.state.company_id
+
+    dialog = await get_company_dialog(db, company_id=company_id, dialog_id=dialog_id)
+    if not dialog:
+        raise HTTPException(status_code=404, detail="Dialog not found")
+
+    try:
+        msgs, next_cursor = await list_messages_page(db, dialog_id=dialog.id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items = [
+        {"id": m.id, "direction": m.direction, "text": m.text, "created_at": m.created_at}
+        for m in msgs
+    ]
+    return {"dialog_id": dialog.id, "items": items, "next_cursor": next_cursor}
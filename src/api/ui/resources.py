@@ -1,11 +1,9 @@
 from __future__ import annotations
 
+import math
 import time
-import urllib.error
-import urllib.request
 from uuid import uuid4
 
-import anyio
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
@@ -13,9 +11,12 @@ from pydantic import BaseModel
 from sqlalchemy import select, delete
 
 from src.api.deps import require_company_from_token
+from src.core.openai_client import check_openai_key
 from src.models.resource import Resource, ResourceSettings
 from src.models.session import Session, SessionSettings
+from src.resources.cache import invalidate_resource_config
 from src.storage.db import get_db
+from src.storage.notify import notify_config_changed
 import logging
 
 
@@ -176,14 +177,17 @@ async def resource_delete(
 ):
     company_id = request.state.company_id
 
-    await db.execute(
+    res = await db.execute(
         delete(Resource)
         .where(
             Resource.id == resource_id,
             Resource.company_id == company_id,
         )
     )
+    if res.rowcount:
+        await notify_config_changed(db, kind="resource", resource_id=resource_id)
     await db.commit()
+    invalidate_resource_config(resource_id)
 
     return JSONResponse({"status": "ok"})
 
@@ -217,6 +221,8 @@ async def resource_detail(
     prompt_model = ""
     prompt_system_prompt = ""
     prompt_history_pairs = None
+    prompt_burst_window_sec = None
+    prompt_max_input_tokens = None
     prompt_google_sources: list[str] = []
     prompt_out_of_scope_enabled = False
     prompt_models = _get_allowed_prompt_models()
@@ -259,6 +265,20 @@ async def resource_detail(
             except Exception:
                 prompt_history_pairs = None
 
+        bw = data.get("burst_window_sec")
+        if bw is not None:
+            try:
+                prompt_burst_window_sec = float(bw)
+            except Exception:
+                prompt_burst_window_sec = None
+
+        mit = data.get("max_input_tokens")
+        if mit is not None:
+            try:
+                prompt_max_input_tokens = int(mit)
+            except Exception:
+                prompt_max_input_tokens = None
+
         gs = data.get("google_sources")
         if isinstance(gs, list):
             prompt_google_sources = [str(x) for x in gs if str(x).strip()]
@@ -335,6 +355,8 @@ async def resource_detail(
             "prompt_model": prompt_model,
             "prompt_system_prompt": prompt_system_prompt,
             "prompt_history_pairs": prompt_history_pairs,
+            "prompt_burst_window_sec": prompt_burst_window_sec,
+            "prompt_max_input_tokens": prompt_max_input_tokens,
             "prompt_google_sources": prompt_google_sources,
             "prompt_out_of_scope_enabled": prompt_out_of_scope_enabled,
             "prompt_models": prompt_models,
@@ -361,32 +383,22 @@ class OpenAIKeyIn(BaseModel):
     api_key: str | None = None
 
 
-def _check_openai_key_sync(api_key: str) -> tuple[bool, str | None]:
+async def _check_openai_key(api_key: str) -> tuple[bool, str | None]:
     """
-    Самая простая проверка: запрос /v1/models.
+    Самая простая проверка: запрос /v1/models (общий пул соединений OpenAI, без потоков).
     200 => ключ работает, 401/403 => не работает, остальное => ошибка OpenAI/сети.
     """
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/models",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        method="GET",
-    )
-
     try:
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            if getattr(resp, "status", 200) == 200:
-                return True, None
-            return False, f"OpenAI вернул статус {getattr(resp, 'status', 'unknown')}"
-    except urllib.error.HTTPError as e:
-        if e.code in (401, 403):
-            return False, "Ключ не работает (401/403)"
-        return False, f"OpenAI вернул {e.code}"
+        status = await check_openai_key(api_key, timeout_sec=10)
     except Exception as e:
         return False, f"Ошибка сети: {e.__class__.__name__}"
 
+    if status == 200:
+        return True, None
+    if status in (401, 403):
+        return False, "Ключ не работает (401/403)"
+    return False, f"OpenAI вернул {status}"
+
 
 @router.post("/resources/{resource_id}/openai/key")
 async def openai_key_save(
@@ -429,7 +441,10 @@ async def openai_key_save(
     data[OPENAI_KEY_FIELD] = api_key
     settings.data = data
 
+    await notify_config_changed(db, kind="openai", resource_id=resource.id)
     await db.commit()
+    # этот процесс — сразу; воркер — по NOTIFY
+    invalidate_resource_config(resource.id)
     return JSONResponse({"ok": True})
 
 
@@ -469,7 +484,7 @@ async def openai_key_check(
     if not api_key:
         raise HTTPException(status_code=400, detail="api_key required")
 
-    ok, err = await anyio.to_thread.run_sync(_check_openai_key_sync, api_key)
+    ok, err = await _check_openai_key(api_key)
     if ok:
         return JSONResponse({"ok": True})
     return JSONResponse({"ok": False, "error": err})
@@ -479,6 +494,8 @@ class PromptSettingsIn(BaseModel):
     model: str | None = None
     system_prompt: str | None = None
     history_pairs: int | None = None
+    burst_window_sec: float | None = None
+    max_input_tokens: int | None = None
     google_sources: list[str] | None = None
     out_of_scope_enabled: bool | None = None
 
@@ -539,6 +556,24 @@ async def prompt_save(
             raise HTTPException(status_code=400, detail="history_pairs must be 0..50")
         data["history_pairs"] = int(hp)
 
+    # burst_window_sec (0..30): склейка подряд идущих сообщений клиента в один запрос к модели
+    bw = payload.burst_window_sec
+    if bw is None:
+        data.pop("burst_window_sec", None)
+    else:
+        if not math.isfinite(bw) or bw < 0 or bw > 30:
+            raise HTTPException(status_code=400, detail="burst_window_sec must be 0..30")
+        data["burst_window_sec"] = float(bw)
+
+    # max_input_tokens (0 или пусто — OPENAI_MAX_INPUT_TOKENS): бюджет входа модели, история режется под него
+    mit = payload.max_input_tokens
+    if not mit:
+        data.pop("max_input_tokens", None)
+    else:
+        if mit < 500 or mit > 400000:
+            raise HTTPException(status_code=400, detail="max_input_tokens must be 500..400000")
+        data["max_input_tokens"] = int(mit)
+
     # google_sources (clean list)
     gs = payload.google_sources
     if not gs:
@@ -566,7 +601,9 @@ async def prompt_save(
         data["out_of_scope_enabled"] = bool(payload.out_of_scope_enabled)
 
     settings.data = data
+    await notify_config_changed(db, kind="prompt", resource_id=resource.id)
     await db.commit()
+    invalidate_resource_config(resource.id)
     return JSONResponse({"ok": True})
 
 
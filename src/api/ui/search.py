@@ -0,0 +1,43 @@
+"""
+PATH: src/api/ui/search.py
+PURPOSE: Full-text search over company messages (JSON, ranked, keyset cursor; rendered by /static/ui/dialogs.js).
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+
+from fastapi import APIRouter, Request, Depends, HTTPException, Query
+
+from src.api.deps import require_company_from_token
+from src.storage.db import get_db
+from src.storage.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.storage.search import MAX_QUERY_CHARS, search_messages
+
+router = APIRouter()
+
+
+@router.get("/api/search")
+async def messages_search(
+    request: Request,
+    q: str = Query(min_length=1, max_length=MAX_QUERY_CHARS),
+    cursor: str | None = None,
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    _ctx=Depends(require_company_from_token),
+    db=Depends(get_db),
+):
+    """
+    Сообщения компании по запросу q (websearch-синтаксис), самые релевантные первыми.
+    snippet_html — фрагмент с <mark>, текст экранирован. since/until сужают поиск до нужных месяцев.
+    """
+    company_id = request.state.company_id
+
+    try:
+        items, next_cursor = await search_messages(
+            db, company_id=company_id, query=q, limit=limit, cursor=cursor, since=since, until=until
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[K, V]):
+    """
+    LRU + TTL в памяти процесса (один event loop, без блокировок):
+    - не больше maxsize записей, при переполнении выбрасывается давно не использованная;
+    - запись живёт ttl_sec с момента set() (0 — без срока);
+    - hits / misses / evictions / expired — для метрик.
+    Для данных, которые меняет другой процесс: TTL ограничивает устаревание,
+    а точечная инвалидация (pop / pop_where) — по уведомлению.
+    """
+
+    def __init__(self, *, maxsize: int = 10_000, ttl_sec: float = 300.0) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl_sec = max(0.0, float(ttl_sec))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+
+        expires_at, value = item  # type: ignore[misc]
+        if expires_at and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expired += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        expires_at = time.monotonic() + self.ttl_sec if self.ttl_sec else 0.0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: K) -> V | None:
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def pop_where(self, predicate: Callable[[K, V], bool]) -> int:
+        """Удаляет все записи, для которых predicate(key, value) истинно. O(n) — для редких событий."""
+        keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
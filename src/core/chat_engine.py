@@ -1,33 +1,144 @@
 from __future__ import annotations
 
 import os
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core.openai_client import call_openai_text
+from src.core.metrics import METRICS
+from src.core.openai_client import call_openai_text, stream_openai_text
+from src.core.tokens import MESSAGE_OVERHEAD_TOKENS, count_tokens, message_tokens, truncate_tokens
 from src.resources.openai import get_openai_api_key
 from src.resources.prompt import get_prompt_settings
 
 
+# бюджет входа модели (system + история + сообщение), если в Prompt-ресурсе не задан max_input_tokens
+DEFAULT_MAX_INPUT_TOKENS = int(os.getenv("OPENAI_MAX_INPUT_TOKENS", "8000"))
+# сообщение пользователя не обрезается короче этого, даже если system prompt съел весь бюджет
+MIN_USER_TOKENS = 256
+# самое старое из попавших в бюджет сообщений истории обрезается, только если от него остаётся хотя бы столько
+MIN_PARTIAL_TOKENS = 64
+
+METRICS.describe("llm_tokens_total", "LLM tokens by kind: estimated (local count before the call), input/output (reported by the API).")
+METRICS.describe("llm_context_trimmed_total", "Requests whose history was trimmed or truncated to fit the input token budget.")
+
+
 def get_default_model() -> str:
     # Дефолт: gpt-5.2 (если в Prompt-ресурсе модель не задана)
     return (os.getenv("OPENAI_DEFAULT_MODEL") or "gpt-5.2").strip() or "gpt-5.2"
 
 
-async def generate_reply(
+@dataclass
+class ContextStats:
+    budget: int
+    estimated_tokens: int
+    history_total: int
+    history_kept: int
+    truncated: bool
+
+
+def build_context(
+    *,
+    system_prompt: str,
+    history_messages: list[dict] | None,
+    user_text: str,
+    max_input_tokens: int,
+) -> tuple[list[dict], ContextStats]:
+    """
+    input для модели в пределах max_input_tokens (локальный подсчёт, см. core.tokens):
+    - system prompt — всегда целиком;
+    - сообщение пользователя — целиком, если не влезает — обрезается (но не короче MIN_USER_TOKENS);
+    - история — от новых к старым, пока влезает; первое не влезшее сообщение обрезается с начала
+      (остаётся его конец), всё, что старше, отбрасывается.
+    Токены каждого сообщения считаются один раз (TOKEN_COUNT_CACHE) — на следующих ходах та же история бесплатна.
+    """
+    budget = max(1, int(max_input_tokens))
+    history = [item for item in (history_messages or []) if item.get("content")]
+    truncated = False
+
+    system_cost = message_tokens({"content": system_prompt}) if system_prompt else 0
+    user_room = max(MIN_USER_TOKENS, budget - system_cost - MESSAGE_OVERHEAD_TOKENS)
+    if count_tokens(user_text) > user_room:
+        user_text = truncate_tokens(user_text, user_room)
+        truncated = True
+    used = system_cost + message_tokens({"content": user_text})
+
+    kept: list[dict] = []
+    for item in reversed(history):
+        cost = message_tokens(item)
+        if used + cost <= budget:
+            kept.append(item)
+            used += cost
+            continue
+        room = budget - used - MESSAGE_OVERHEAD_TOKENS
+        if room >= MIN_PARTIAL_TOKENS:
+            content = "…" + truncate_tokens(str(item["content"]), room - 1, keep_tail=True)
+            kept.append({"role": item["role"], "content": content})
+            used += message_tokens(kept[-1])
+        truncated = True
+        break
+    kept.reverse()
+
+    input_items: list[dict] = []
+    if system_prompt:
+        input_items.append({"role": "system", "content": system_prompt})
+    input_items.extend(kept)
+    input_items.append({"role": "user", "content": user_text})
+
+    stats = ContextStats(
+        budget=budget,
+        estimated_tokens=used,
+        history_total=len(history),
+        history_kept=len(kept),
+        truncated=truncated,
+    )
+    return input_items, stats
+
+
+def _max_input_tokens(pset: dict) -> int:
+    try:
+        value = int(pset.get("max_input_tokens") or 0)
+    except Exception:
+        value = 0
+    return value if value > 0 else DEFAULT_MAX_INPUT_TOKENS
+
+
+def _report_usage(company_id: int, model: str, stats: ContextStats, usage: dict) -> None:
+    """Токены запроса: локальная оценка входа + фактические input/output из ответа API (если пришли)."""
+    METRICS.inc("llm_tokens_total", stats.estimated_tokens, model=model, kind="estimated")
+    for kind in ("input", "output"):
+        value = usage.get(f"{kind}_tokens")
+        if isinstance(value, int):
+            METRICS.inc("llm_tokens_total", value, model=model, kind=kind)
+    if stats.truncated:
+        METRICS.inc("llm_context_trimmed_total", model=model)
+    print(
+        f"[chat_engine] company={company_id} model={model} budget={stats.budget} "
+        f"estimated={stats.estimated_tokens} input={usage.get('input_tokens')} output={usage.get('output_tokens')} "
+        f"history={stats.history_kept}/{stats.history_total} truncated={int(stats.truncated)}"
+    )
+
+
+async def _prepare_request(
     db: AsyncSession,
     *,
     company_id: int,
     openai_resource_id: int | None,
     prompt_resource_id: int | None,
     user_text: str,
-    history_messages: list[dict] | None = None,  # сюда позже подмешаем N*2 (user/assistant)
-) -> str:
+    history_messages: list[dict] | None,
+) -> tuple[str | None, dict, ContextStats | None]:
+    """
+    (текст ошибки настройки, {}, None)
+    или (None, kwargs для call_openai_text / stream_openai_text, статистика контекста).
+    """
     if not openai_resource_id:
-        return "OpenAI не настроен: выбери OpenAI-ресурс в настройках ресурса."
+        return "OpenAI не настроен: выбери OpenAI-ресурс в настройках ресурса.", {}, None
 
     if not prompt_resource_id:
-        return "Prompt не настроен: выбери Prompt-ресурс в настройках ресурса."
+        return "Prompt не настроен: выбери Prompt-ресурс в настройках ресурса.", {}, None
 
     api_key = await get_openai_api_key(
         db,
@@ -35,7 +146,7 @@ async def generate_reply(
         openai_resource_id=int(openai_resource_id),
     )
     if not api_key:
-        return "OpenAI не настроен: ключ не найден или ресурс отключён."
+        return "OpenAI не настроен: ключ не найден или ресурс отключён.", {}, None
 
     pset = await get_prompt_settings(
         db,
@@ -43,19 +154,82 @@ async def generate_reply(
         prompt_resource_id=int(prompt_resource_id),
     )
     if pset is None:
-        return "Prompt не настроен: Prompt-ресурс не найден или отключён."
+        return "Prompt не настроен: Prompt-ресурс не найден или отключён.", {}, None
 
     model = (str(pset.get("model") or "").strip()) or get_default_model()
     system_prompt = (str(pset.get("system_prompt") or "").strip())
 
-    input_items: list[dict] = []
-    if system_prompt:
-        input_items.append({"role": "system", "content": system_prompt})
+    input_items, stats = build_context(
+        system_prompt=system_prompt,
+        history_messages=history_messages,
+        user_text=user_text,
+        max_input_tokens=_max_input_tokens(pset),
+    )
+    return None, {"api_key": api_key, "model": model, "input_items": input_items}, stats
 
-    if history_messages:
-        input_items.extend(history_messages)
 
-    input_items.append({"role": "user", "content": user_text})
+async def generate_reply(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    openai_resource_id: int | None,
+    prompt_resource_id: int | None,
+    user_text: str,
+    history_messages: list[dict] | None = None,  # последние N*2 (user/assistant), обрезаются по бюджету токенов
+) -> str:
+    error, request, stats = await _prepare_request(
+        db,
+        company_id=company_id,
+        openai_resource_id=openai_resource_id,
+        prompt_resource_id=prompt_resource_id,
+        user_text=user_text,
+        history_messages=history_messages,
+    )
+    if error:
+        return error
 
-    text = await call_openai_text(api_key=api_key, model=model, input_items=input_items)
+    usage: dict = {}
+    text = await call_openai_text(**request, usage=usage)
+    _report_usage(company_id, request["model"], stats, usage)
     return text or "Пустой ответ от модели."
+
+
+async def generate_reply_stream(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    openai_resource_id: int | None,
+    prompt_resource_id: int | None,
+    user_text: str,
+    history_messages: list[dict] | None = None,
+) -> AsyncIterator[str]:
+    """
+    То же, что generate_reply, но кусками по мере генерации (stream_openai_text).
+    Ошибка настройки — одним куском; пустой ответ модели — "Пустой ответ от модели.".
+    """
+    error, request, stats = await _prepare_request(
+        db,
+        company_id=company_id,
+        openai_resource_id=openai_resource_id,
+        prompt_resource_id=prompt_resource_id,
+        user_text=user_text,
+        history_messages=history_messages,
+    )
+    if error:
+        yield error
+        return
+
+    empty = True
+    usage: dict = {}
+    # aclosing: закрытие этого генератора сразу закрывает HTTP-поток к OpenAI
+    try:
+        async with aclosing(stream_openai_text(**request, usage=usage)) as chunks:
+            async for delta in chunks:
+                if delta.strip():
+                    empty = False
+                yield delta
+    finally:
+        # прерванный поток usage не получит — остаётся локальная оценка входа
+        _report_usage(company_id, request["model"], stats, usage)
+    if empty:
+        yield "Пустой ответ от модели."
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import sys
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+# tuple (role, content) + ссылка в deque — примерно, для учёта памяти
+_ITEM_OVERHEAD = 72
+
+
+def _item_size(role: str, content: str) -> int:
+    return sys.getsizeof(content) + sys.getsizeof(role) + _ITEM_OVERHEAD
+
+
+@dataclass
+class _Ring:
+    capacity: int
+    complete: bool  # в буфере вся история диалога (в БД старше ничего нет)
+    items: deque = field(default_factory=deque)
+    size: int = 0
+
+
+class HistoryBuffer:
+    """
+    Последние сообщения диалогов для контекста модели, в памяти процесса (один event loop, без блокировок):
+    - warm(key, items, limit) — после чтения из БД (промах);
+    - append(key, role, content) — после записи в БД, только для уже прогретых ключей (write-through);
+    - get(key, limit) — последние limit элементов {role, content} или None (нужно читать БД);
+    - на ключ не больше capacity элементов (кольцо), на процесс — не больше max_bytes:
+      при переполнении выбрасываются давно не использованные диалоги целиком (LRU).
+    Сброс (pop_where) — при очистке диалога, в том числе по уведомлению из другого процесса.
+    """
+
+    def __init__(self, *, max_bytes: int = 64 * 1024 * 1024, max_items: int = 200) -> None:
+        self.max_bytes = max(1, int(max_bytes))
+        self.max_items = max(1, int(max_items))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data: OrderedDict[Hashable, _Ring] = OrderedDict()
+
+    def get(self, key: Hashable, limit: int) -> list[dict[str, str]] | None:
+        if limit <= 0:
+            return []
+        ring = self._data.get(key)
+        # в кольце меньше limit, а в БД могут быть ещё — честно не ответить
+        if ring is None or (len(ring.items) < int(limit) and not ring.complete):
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        tail = list(ring.items)[-int(limit):]
+        return [{"role": role, "content": content} for role, content in tail]
+
+    def warm(self, key: Hashable, items: list[tuple[str, str]], limit: int) -> None:
+        """items — по возрастанию времени, ровно как вернула БД для limit."""
+        capacity = min(max(1, int(limit)), self.max_items)
+        kept = items[-capacity:]
+        ring = _Ring(capacity=capacity, complete=len(items) < int(limit) and len(items) <= capacity)
+        for role, content in kept:
+            ring.items.append((role, content))
+            ring.size += _item_size(role, content)
+
+        self._drop(key)
+        self._data[key] = ring
+        self._bytes += ring.size
+        self._evict()
+
+    def append(self, key: Hashable, role: str, content: str) -> None:
+        ring = self._data.get(key)
+        if ring is None:
+            # не прогрет — следующий get всё равно пойдёт в БД
+            return
+
+        ring.items.append((role, content))
+        added = _item_size(role, content)
+        ring.size += added
+        self._bytes += added
+        while len(ring.items) > ring.capacity:
+            old_role, old_content = ring.items.popleft()
+            removed = _item_size(old_role, old_content)
+            ring.size -= removed
+            self._bytes -= removed
+            ring.complete = False
+
+        self._data.move_to_end(key)
+        self._evict()
+
+    def pop(self, key: Hashable) -> bool:
+        found = key in self._data
+        self._drop(key)
+        return found
+
+    def pop_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Удаляет ключи, для которых predicate(key) истинно. O(n) — для редких событий."""
+        keys = [k for k in self._data if predicate(k)]
+        for k in keys:
+            self._drop(k)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+    def _drop(self, key: Hashable) -> None:
+        ring = self._data.pop(key, None)
+        if ring is not None:
+            self._bytes -= ring.size
+
+    def _evict(self) -> None:
+        # последний (только что тронутый) ключ не выбрасываем, даже если он один больше лимита
+        while self._bytes > self.max_bytes and len(self._data) > 1:
+            _, ring = self._data.popitem(last=False)
+            self._bytes -= ring.size
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "dialogs": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+
+# HTTP/2 — если установлен h2 (pip install h2); без него httpx работает по HTTP/1.1 с keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class _Entry:
+    __slots__ = ("client", "users", "evicted")
+
+    def __init__(self, client: httpx.AsyncClient) -> None:
+        self.client = client
+        self.users = 0
+        self.evicted = False
+
+
+class ClientPool:
+    """
+    httpx.AsyncClient на каждый ключ (API-ключ, токен) — свой пул keep-alive соединений:
+    TLS-рукопожатие один раз на соединение, а не на каждый запрос, и никаких потоков.
+    - клиентов не больше max_clients, лишний (давно не использованный) закрывается — LRU;
+    - вытесненный клиент закрывается, когда завершится последний запрос через него (users == 0);
+    - один event loop, без блокировок (как TTLCache).
+    """
+
+    def __init__(
+        self,
+        *,
+        base_url: str,
+        max_clients: int = 64,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry_sec: float = 30.0,
+        connect_timeout_sec: float = 5.0,
+        read_timeout_sec: float = 60.0,
+        http2: bool = True,
+    ) -> None:
+        self.base_url = base_url
+        self.max_clients = max(1, int(max_clients))
+        self.limits = httpx.Limits(
+            max_connections=max(1, int(max_connections)),
+            max_keepalive_connections=max(0, int(max_keepalive)),
+            keepalive_expiry=float(keepalive_expiry_sec),
+        )
+        self.timeout = httpx.Timeout(
+            connect=float(connect_timeout_sec),
+            read=float(read_timeout_sec),
+            write=float(connect_timeout_sec),
+            pool=float(connect_timeout_sec),
+        )
+        self.http2 = bool(http2) and HTTP2_AVAILABLE
+        self.counters: Counter[str] = Counter()
+        self._clients: OrderedDict[str, _Entry] = OrderedDict()
+
+    def _new_client(self, key: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {key}"},
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=self.http2,
+        )
+
+    def _entry(self, key: str) -> _Entry:
+        entry = self._clients.get(key)
+        if entry is not None:
+            self._clients.move_to_end(key)
+            self.counters["reused"] += 1
+            return entry
+
+        entry = _Entry(self._new_client(key))
+        self._clients[key] = entry
+        self.counters["opened"] += 1
+        while len(self._clients) > self.max_clients:
+            _, old = self._clients.popitem(last=False)
+            old.evicted = True
+            self.counters["evicted"] += 1
+            if old.users == 0:
+                self._close_later(old)
+        return entry
+
+    def _close_later(self, entry: _Entry) -> None:
+        task = asyncio.get_running_loop().create_task(entry.client.aclose())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    @asynccontextmanager
+    async def client(self, key: str, *, cache: bool = True) -> AsyncIterator[httpx.AsyncClient]:
+        """
+        Клиент ключа на время запроса (или чтения потока): async with pool.client(key) as c: ...
+        cache=False — разовый запрос с произвольным ключом (проверка ключа из UI): пул не меняется —
+        уже открытый клиент ключа используется без сдвига в LRU, иначе создаётся временный и закрывается сразу.
+        """
+        if not cache and key not in self._clients:
+            self.counters["transient"] += 1
+            async with self._new_client(key) as temp:
+                yield temp
+            return
+
+        entry = self._clients[key] if not cache else self._entry(key)
+        entry.users += 1
+        try:
+            yield entry.client
+        finally:
+            entry.users -= 1
+            if entry.evicted and entry.users == 0:
+                await entry.client.aclose()
+
+    async def aclose(self) -> None:
+        """При остановке процесса: закрыть все соединения."""
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for entry in entries:
+            entry.evicted = True
+            if entry.users == 0:
+                try:
+                    await entry.client.aclose()
+                except Exception as e:
+                    print(f"[http_pool] close error: {e.__class__.__name__}: {e}")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "clients": len(self._clients),
+            "max_clients": self.max_clients,
+            "in_use": sum(e.users for e in self._clients.values()),
+            "http2": int(self.http2),
+            "opened": self.counters["opened"],
+            "reused": self.counters["reused"],
+            "evicted": self.counters["evicted"],
+            "transient": self.counters["transient"],
+        }
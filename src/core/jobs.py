@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import socket
+import traceback
+from typing import Awaitable, Callable, Dict
+
+from src.storage.db import get_sessionmaker
+from src.storage.jobs import (
+    JOBS_CHANNEL,
+    LeasedJob,
+    complete_job,
+    extend_leases,
+    fail_job,
+    lease_jobs,
+    purge_finished_jobs,
+    release_job,
+)
+from src.storage.notify import listen
+
+JobHandler = Callable[[LeasedJob], Awaitable[None]]
+
+# очередь (Job.queue) -> обработчик; обработчик вернул управление — задача done, исключение — retry/failed,
+# JobRelease — задача возвращается в очередь без траты попытки
+_HANDLERS: Dict[str, JobHandler] = {}
+
+
+class JobRelease(Exception):
+    """Обработчик не может выполнить задачу на этом воркере (не ошибка задачи): вернуть её в очередь через delay_sec."""
+
+    def __init__(self, reason: str, *, delay_sec: float = 5.0) -> None:
+        super().__init__(reason)
+        self.delay_sec = float(delay_sec)
+
+
+def register_handler(queue: str, handler: JobHandler) -> None:
+    _HANDLERS[str(queue)] = handler
+
+
+def get_handler(queue: str) -> JobHandler | None:
+    return _HANDLERS.get(str(queue))
+
+
+def retry_delay_sec(attempts: int, *, base_sec: float = 2.0, max_sec: float = 300.0) -> float:
+    """Экспоненциальная задержка с jitter: base * 2^(attempts-1), не больше max_sec."""
+    delay = min(max_sec, base_sec * (2 ** max(0, int(attempts) - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobRunner:
+    """
+    Исполнитель задач из таблицы jobs для зарегистрированных очередей:
+    - берёт задачи пачками через lease_jobs (FOR UPDATE SKIP LOCKED), не больше concurrency одновременно;
+    - пока задача выполняется, продлевает её аренду (иначе после lease_sec её заберёт другой воркер);
+    - ошибка -> повтор с экспоненциальной задержкой до max_attempts, дальше failed;
+    - JobRelease -> задача возвращается в очередь, попытка не считается;
+    - complete/fail/release меняют задачу, только пока она арендована этим воркером;
+    - просыпается по NOTIFY от enqueue_jobs, а без него — раз в poll_sec;
+    - retention_sec > 0: раз в purge_interval_sec удаляет done / failed задачи старше retention_sec.
+    """
+
+    def __init__(
+        self,
+        queues: list[str],
+        *,
+        concurrency: int = 32,
+        lease_sec: float = 120.0,
+        poll_sec: float = 1.0,
+        worker_id: str | None = None,
+        retention_sec: float = 0.0,
+        purge_interval_sec: float = 3600.0,
+    ) -> None:
+        self.queues = [str(q) for q in queues]
+        self.concurrency = max(1, int(concurrency))
+        self.lease_sec = float(lease_sec)
+        self.poll_sec = float(poll_sec)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.retention_sec = max(0.0, float(retention_sec or 0))
+        self.purge_interval_sec = max(1.0, float(purge_interval_sec))
+        self.purged = 0
+
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+
+    def stats(self) -> dict[str, int]:
+        return {"running": len(self._running), "concurrency": self.concurrency, "purged": self.purged}
+
+    async def _run_one(self, job: LeasedJob) -> None:
+        handler = get_handler(job.queue)
+        sm = get_sessionmaker()
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler for queue {job.queue!r}")
+            await handler(job)
+        except asyncio.CancelledError:
+            # остановка воркера: аренда истечёт, задачу заберут заново
+            raise
+        except JobRelease as e:
+            try:
+                async with sm() as db:
+                    await release_job(
+                        db,
+                        job,
+                        retry_in_sec=e.delay_sec,
+                        worker_id=self.worker_id,
+                        reason=str(e),
+                    )
+            except Exception as e2:
+                print(f"[jobs] job={job.id} release_job error: {e2.__class__.__name__}: {e2}")
+            return
+        except Exception as e:
+            tb = traceback.format_exc()
+            print(f"[jobs] job={job.id} queue={job.queue} attempt={job.attempts} error: {e.__class__.__name__}: {e}\n{tb}")
+            try:
+                async with sm() as db:
+                    await fail_job(
+                        db,
+                        job,
+                        error=f"{e.__class__.__name__}: {e}",
+                        retry_in_sec=retry_delay_sec(job.attempts),
+                        worker_id=self.worker_id,
+                    )
+            except Exception as e2:
+                print(f"[jobs] job={job.id} fail_job error: {e2.__class__.__name__}: {e2}")
+            return
+
+        try:
+            async with sm() as db:
+                if not await complete_job(db, job.id, worker_id=self.worker_id):
+                    print(f"[jobs] job={job.id} lease lost before completion")
+        except Exception as e:
+            print(f"[jobs] job={job.id} complete_job error: {e.__class__.__name__}: {e}")
+
+    async def _heartbeat(self, stop: asyncio.Event) -> None:
+        sm = get_sessionmaker()
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(1.0, self.lease_sec / 3))
+                return
+            except asyncio.TimeoutError:
+                pass
+            ids = list(self._running)
+            if not ids:
+                continue
+            try:
+                async with sm() as db:
+                    await extend_leases(db, ids, lease_sec=self.lease_sec, worker_id=self.worker_id)
+            except Exception as e:
+                print(f"[jobs] extend lease error: {e.__class__.__name__}: {e}")
+
+    async def _purge(self, stop: asyncio.Event) -> None:
+        sm = get_sessionmaker()
+        while True:
+            try:
+                async with sm() as db:
+                    n = await purge_finished_jobs(db, older_than_sec=self.retention_sec)
+                self.purged += n
+                if n:
+                    print(f"[jobs] purged {n} finished jobs")
+            except Exception as e:
+                print(f"[jobs] purge error: {e.__class__.__name__}: {e}")
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.purge_interval_sec)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def _lease(self) -> int:
+        sm = get_sessionmaker()
+        leased = 0
+        for queue in self.queues:
+            free = self.concurrency - len(self._running)
+            if free <= 0:
+                break
+            async with sm() as db:
+                jobs = await lease_jobs(
+                    db,
+                    queue=queue,
+                    limit=free,
+                    lease_sec=self.lease_sec,
+                    worker_id=self.worker_id,
+                )
+            for job in jobs:
+                t = asyncio.create_task(self._run_one(job))
+                self._running[job.id] = t
+                t.add_done_callback(lambda _t, _id=job.id: self._on_done(_id))
+            leased += len(jobs)
+        return leased
+
+    def _on_done(self, job_id: int) -> None:
+        self._running.pop(job_id, None)
+        # освободился слот — можно брать следующую задачу, не дожидаясь poll_sec
+        self._wakeup.set()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        listener = None
+        heartbeat = asyncio.create_task(self._heartbeat(stop))
+        purge = asyncio.create_task(self._purge(stop)) if self.retention_sec > 0 else None
+        try:
+            while not stop.is_set():
+                if listener is None or listener.is_closed():
+                    try:
+                        listener = await listen(JOBS_CHANNEL, lambda _payload: self._wakeup.set())
+                    except Exception as e:
+                        listener = None
+                        print(f"[jobs] listen error: {e.__class__.__name__}: {e}")
+
+                self._wakeup.clear()
+                leased = 0
+                try:
+                    leased = await self._lease()
+                except Exception as e:
+                    print(f"[jobs] lease error: {e.__class__.__name__}: {e}")
+
+                if leased and len(self._running) < self.concurrency:
+                    # очередь могла не опустеть — сразу следующий заход
+                    continue
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_sec)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            heartbeat.cancel()
+            if purge is not None:
+                purge.cancel()
+            for t in list(self._running.values()):
+                t.cancel()
+            if listener is not None:
+                try:
+                    await listener.close()
+                except Exception:
+                    pass
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+# границы бакетов латентности, секунды (от быстрых INSERT до долгих ответов модели)
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+# (имя, тип, help, [(labels, значение)]) — снимок значений на момент отдачи метрик
+Sample = Tuple[str, str, str, Iterable[Tuple[Dict[str, object], float]]]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def _fmt_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in items
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Метрики процесса в памяти, без внешних зависимостей:
+    - inc(name, **labels) — счётчики;
+    - set(name, value, **labels) — gauge'и, которые выставляются по событию (длительность старта и т.п.);
+    - observe(name, seconds, **labels) / timer(...) — гистограммы (фиксированные бакеты, O(log n) на запись);
+    - add_collector(fn) — gauge'и, которые считаются в момент отдачи (глубина очередей и т.п.).
+    render() -> текст в формате Prometheus.
+    """
+
+    def __init__(self, *, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._help: Dict[str, str] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._collectors: list[Callable[[], Iterable[Sample]]] = []
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels: object) -> None:
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: object) -> None:
+        self._gauges.setdefault(name, {})[_labels(labels)] = float(value)
+
+    def observe(self, name: str, value: float, **labels: object) -> None:
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = _Histogram(self.buckets)
+        hist.observe(float(value))
+
+    @contextmanager
+    def timer(self, name: str, **labels: object) -> Iterator[None]:
+        """Время блока в гистограмму name (в том числе если блок упал)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def add_collector(self, fn: Callable[[], Iterable[Sample]]) -> None:
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def _head(name: str, kind: str, help_text: str = "") -> None:
+            help_text = help_text or self._help.get(name, "")
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name in sorted(self._counters):
+            _head(name, "counter")
+            for key, value in sorted(self._counters[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+
+        for name in sorted(self._gauges):
+            _head(name, "gauge")
+            for key, value in sorted(self._gauges[name].items()):
+                lines.append(f"{name}{_fmt_labels(key)} {_fmt_value(value)}")
+
+        for name in sorted(self._histograms):
+            _head(name, "histogram")
+            for key, hist in sorted(self._histograms[name].items()):
+                acc = 0
+                for bound, n in zip(self.buckets + (float("inf"),), hist.counts):
+                    acc += n
+                    lines.append(f"{name}_bucket{_fmt_labels(key, (('le', _fmt_value(bound)),))} {acc}")
+                lines.append(f"{name}_sum{_fmt_labels(key)} {_fmt_value(hist.total)}")
+                lines.append(f"{name}_count{_fmt_labels(key)} {hist.count}")
+
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                lines.append(f"# collector error: {e.__class__.__name__}: {e}")
+                continue
+            for name, kind, help_text, values in samples:
+                _head(name, kind, help_text)
+                for labels, value in values:
+                    lines.append(f"{name}{_fmt_labels(_labels(labels))} {_fmt_value(float(value))}")
+
+        return "\n".join(lines) + "\n"
+
+
+# общий реестр процесса
+METRICS = MetricsRegistry()
+
+# path -> () -> (content_type, body)
+HttpRoute = Callable[[], Tuple[str, str]]
+
+
+async def serve_http(host: str, port: int, routes: Dict[str, HttpRoute]) -> asyncio.AbstractServer:
+    """
+    Минимальный HTTP/1.0 сервер только для GET служебных страниц (/metrics и т.п.),
+    чтобы не тянуть в воркер web-фреймворк.
+    """
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # заголовки не нужны, но их надо вычитать
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if not line or line in (b"\r\n", b"\n"):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            method = parts[0] if parts else ""
+            path = (parts[1] if len(parts) > 1 else "/").split("?", 1)[0]
+
+            route = routes.get(path)
+            if method != "GET":
+                status, ctype, body = "405 Method Not Allowed", "text/plain", "method not allowed\n"
+            elif route is None:
+                status, ctype, body = "404 Not Found", "text/plain", "not found\n"
+            else:
+                try:
+                    ctype, body = route()
+                    status = "200 OK"
+                except Exception as e:
+                    status, ctype, body = "500 Internal Server Error", "text/plain", f"{e.__class__.__name__}: {e}\n"
+
+            data = body.encode("utf-8")
+            writer.write(
+                (
+                    f"HTTP/1.0 {status}\r\n"
+                    f"Content-Type: {ctype}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + data
+            )
+            await writer.drain()
+        except Exception:
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    return await asyncio.start_server(_handle, host, port)
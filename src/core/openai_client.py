@@ -1,21 +1,54 @@
 from __future__ import annotations
 
 import json
-import urllib.error
-import urllib.request
-from functools import partial
-
-import anyio
-
-OPENAI_RESPONSES_URL = "https://api.openai.com/v1/responses"
+import os
+from typing import AsyncIterator
+
+import httpx
+
+from src.core.http_pool import ClientPool
+
+OPENAI_BASE_URL = (os.getenv("OPENAI_BASE_URL") or "https://api.openai.com/v1").rstrip("/")
+OPENAI_RESPONSES_URL = f"{OPENAI_BASE_URL}/responses"
+
+OPENAI_CONNECT_TIMEOUT_SEC = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SEC", "5"))
+OPENAI_READ_TIMEOUT_SEC = float(os.getenv("OPENAI_READ_TIMEOUT_SEC", "60"))
+# клиентов (API-ключей) в пуле процесса; у каждого свои keep-alive соединения
+OPENAI_POOL_MAX_CLIENTS = int(os.getenv("OPENAI_POOL_MAX_CLIENTS", "64"))
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", "100"))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", "20"))
+OPENAI_HTTP2 = (os.getenv("OPENAI_HTTP2") or "1").strip().lower() not in ("0", "false", "no")
+
+# один пул на процесс (как engine / BatchWriter): запросы идут прямо из event loop, без to_thread
+OPENAI_POOL = ClientPool(
+    base_url=OPENAI_BASE_URL,
+    max_clients=OPENAI_POOL_MAX_CLIENTS,
+    max_connections=OPENAI_POOL_MAX_CONNECTIONS,
+    max_keepalive=OPENAI_POOL_MAX_KEEPALIVE,
+    connect_timeout_sec=OPENAI_CONNECT_TIMEOUT_SEC,
+    read_timeout_sec=OPENAI_READ_TIMEOUT_SEC,
+    http2=OPENAI_HTTP2,
+)
+
+
+def _timeout(timeout_sec: float | None) -> httpx.Timeout | None:
+    """Таймаут чтения на один вызов; connect — общий для пула."""
+    if timeout_sec is None:
+        return None
+    return httpx.Timeout(
+        connect=OPENAI_CONNECT_TIMEOUT_SEC,
+        read=float(timeout_sec),
+        write=OPENAI_CONNECT_TIMEOUT_SEC,
+        pool=OPENAI_CONNECT_TIMEOUT_SEC,
+    )
 
 
-def _responses_create_sync(
+async def _responses_create(
     *,
     api_key: str,
     model: str,
     input_items: list[dict],
-    timeout_sec: int = 30,
+    timeout_sec: float | None = None,
 ) -> dict:
     payload = {
         "model": model,
@@ -23,19 +56,14 @@ def _responses_create_sync(
         "store": False,
     }
 
-    req = urllib.request.Request(
-        OPENAI_RESPONSES_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        method="POST",
-    )
-
-    with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-        raw = resp.read()
-        return json.loads(raw.decode("utf-8"))
+    async with OPENAI_POOL.client(api_key) as client:
+        kwargs = {"json": payload}
+        timeout = _timeout(timeout_sec)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        resp = await client.post("/responses", **kwargs)
+        resp.raise_for_status()
+        return resp.json()
 
 
 def extract_output_text(resp_json: dict) -> str:
@@ -69,31 +97,117 @@ async def call_openai_text(
     api_key: str,
     model: str,
     input_items: list[dict],
-    timeout_sec: int = 30,
+    timeout_sec: float | None = 30,
+    usage: dict | None = None,
 ) -> str:
+    """usage (если передан) заполняется полями usage ответа: input_tokens, output_tokens, total_tokens."""
     try:
-        fn = partial(
-            _responses_create_sync,
+        resp_json = await _responses_create(
             api_key=api_key,
             model=model,
             input_items=input_items,
             timeout_sec=timeout_sec,
         )
-        resp_json = await anyio.to_thread.run_sync(fn)
+        if usage is not None and isinstance(resp_json.get("usage"), dict):
+            usage.update(resp_json["usage"])
         return extract_output_text(resp_json) or ""
 
-    except urllib.error.HTTPError as e:
-        try:
-            body = e.read().decode("utf-8", errors="ignore")
-        except Exception:
-            body = ""
-        msg = f"OpenAI HTTP {getattr(e, 'code', 'unknown')}"
+    except httpx.HTTPStatusError as e:
+        body = e.response.text if e.response is not None else ""
+        msg = f"OpenAI HTTP {e.response.status_code if e.response is not None else 'unknown'}"
         if body:
             msg = f"{msg}: {body[:1200]}"
         raise RuntimeError(msg) from e
 
-    except urllib.error.URLError as e:
-        raise RuntimeError(f"OpenAI URL error: {getattr(e, 'reason', e)}") from e
+    except httpx.TransportError as e:
+        raise RuntimeError(f"OpenAI URL error: {e.__class__.__name__}: {e}") from e
 
     except Exception as e:
         raise RuntimeError(f"OpenAI call failed: {e.__class__.__name__}: {e}") from e
+
+
+def _stream_error(event: dict) -> str:
+    err = event.get("error")
+    if not isinstance(err, dict):
+        err = (event.get("response") or {}).get("error") or {}
+    msg = err.get("message") if isinstance(err, dict) else None
+    return str(msg or event.get("message") or event.get("type") or "stream error")
+
+
+async def stream_openai_text(
+    *,
+    api_key: str,
+    model: str,
+    input_items: list[dict],
+    timeout_sec: float | None = None,
+    usage: dict | None = None,
+) -> AsyncIterator[str]:
+    """
+    Тот же Responses API со stream=true: отдаёт куски текста (response.output_text.delta) по мере генерации.
+    Ошибки — RuntimeError с тем же текстом, что у call_openai_text.
+    Прерывание чтения (aclose() / отмена задачи) закрывает HTTP-поток — генерация на стороне OpenAI
+    обрывается и дальше токены не тратит.
+    timeout_sec — пауза между событиями, а не длительность всего ответа.
+    usage (если передан) заполняется из финального события response.completed.
+    """
+    payload = {
+        "model": model,
+        "input": input_items,
+        "store": False,
+        "stream": True,
+    }
+
+    try:
+        async with OPENAI_POOL.client(api_key) as client:
+            kwargs = {"json": payload}
+            timeout = _timeout(timeout_sec)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            async with client.stream("POST", "/responses", **kwargs) as resp:
+                if resp.status_code >= 400:
+                    body = (await resp.aread()).decode("utf-8", errors="ignore")
+                    msg = f"OpenAI HTTP {resp.status_code}"
+                    if body:
+                        msg = f"{msg}: {body[:1200]}"
+                    raise RuntimeError(msg)
+
+                # SSE: нужны только строки "data: {...}", тип события есть в самом JSON
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if not data or data == "[DONE]":
+                        continue
+                    event = json.loads(data)
+                    etype = event.get("type")
+                    if etype == "response.output_text.delta":
+                        delta = event.get("delta")
+                        if isinstance(delta, str) and delta:
+                            yield delta
+                    elif etype in ("response.completed", "response.incomplete"):
+                        final = event.get("response") or {}
+                        if usage is not None and isinstance(final.get("usage"), dict):
+                            usage.update(final["usage"])
+                        return
+                    elif etype in ("response.failed", "error"):
+                        raise RuntimeError(f"OpenAI stream error: {_stream_error(event)[:1200]}")
+
+    except RuntimeError:
+        raise
+
+    except httpx.TransportError as e:
+        raise RuntimeError(f"OpenAI URL error: {e.__class__.__name__}: {e}") from e
+
+    except Exception as e:
+        raise RuntimeError(f"OpenAI call failed: {e.__class__.__name__}: {e}") from e
+
+
+async def check_openai_key(api_key: str, *, timeout_sec: float = 10) -> int:
+    """
+    GET /v1/models: HTTP-статус ответа (200 — ключ рабочий).
+    Ключ из формы может быть любым — в пул он не попадает и рабочих клиентов не вытесняет (cache=False).
+    Сетевые ошибки — httpx.TransportError вызывающему.
+    """
+    async with OPENAI_POOL.client(api_key, cache=False) as client:
+        resp = await client.get("/models", timeout=_timeout(timeout_sec))
+        return resp.status_code
@@ -1,7 +1,16 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from typing import Callable
+
+# что делать с новым сообщением, когда очередь сессии заполнена
+OVERLOAD_DROP_OLDEST = "drop_oldest"  # выбрасываем самое старое сообщение очереди
+OVERLOAD_COALESCE = "coalesce"        # склеиваем с последним ожидающим сообщением того же чата
+OVERLOAD_BUSY = "busy"                # не берём новое, вызывающий отвечает "занят"
+OVERLOAD_POLICIES = (OVERLOAD_DROP_OLDEST, OVERLOAD_COALESCE, OVERLOAD_BUSY)
 
 
 @dataclass(frozen=True)
@@ -9,22 +18,256 @@ class InboundMessage:
     chat_id: int
     message_id: int
     text: str
+    received_at: float = field(default_factory=time.monotonic)
+    # durable-режим: future завершается, когда сообщение обработано или выброшено из очереди
+    done: asyncio.Future | None = field(default=None, compare=False, repr=False)
+    # overload=coalesce: id более ранних сообщений, склеенных в это (message_id — последнее)
+    merged_ids: tuple[int, ...] = ()
+
+    @property
+    def message_ids(self) -> list[int]:
+        return [*self.merged_ids, self.message_id]
+
+
+def _chain(src: asyncio.Future, dst: asyncio.Future) -> None:
+    """dst завершится так же, как src."""
+
+    def _copy(f: asyncio.Future) -> None:
+        if dst.done():
+            return
+        if f.cancelled():
+            dst.cancel()
+        elif f.exception() is not None:
+            dst.set_exception(f.exception())
+        else:
+            dst.set_result(f.result())
+
+    src.add_done_callback(_copy)
 
 
 class SessionQueue:
-    def __init__(self, *, maxsize: int = 0) -> None:
-        self._q: asyncio.Queue[InboundMessage] = asyncio.Queue(maxsize=maxsize)
+    """
+    Очередь входящих одной сессии с ключом chat_id.
+    - внутри одного chat_id строгий порядок: чат выдаётся только одному обработчику за раз
+      (следующее сообщение чата — только после task_done(chat_id));
+    - разные чаты обрабатываются параллельно, но не более max_in_flight одновременно;
+    - чаты выдаются по кругу, чтобы «болтливый» чат не вытеснял остальных;
+    - maxsize > 0 ограничивает число ожидающих сообщений, при переполнении действует overload;
+    - max_age_sec > 0: сообщения старше этого при выдаче выбрасываются (отвечать поздно);
+    - window_sec > 0: чат выдаётся только когда от него window_sec нет новых сообщений
+      (debounce), и выдаётся пачкой — все ожидающие сообщения чата сразу;
+    - max_window_sec > 0: debounce не ждёт дольше max_window_sec от первого ожидающего сообщения чата,
+      иначе клиент, который пишет чаще window_sec, не получил бы ответа никогда.
+    Каждое выброшенное/склеенное сообщение учитывается в shed (по причинам) и передаётся в on_shed.
+    done склеенного сообщения не завершается сразу: оно завершится вместе с записью, в которую вошло.
+    """
+
+    def __init__(
+        self,
+        *,
+        maxsize: int = 0,
+        max_in_flight: int = 1,
+        max_age_sec: float = 0,
+        window_sec: float = 0,
+        max_window_sec: float = 0,
+        overload: str = OVERLOAD_DROP_OLDEST,
+        on_shed: Callable[[str, InboundMessage], None] | None = None,
+    ) -> None:
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError(f"overload must be one of {OVERLOAD_POLICIES}")
+
+        self.maxsize = int(maxsize)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_age_sec = float(max_age_sec or 0)
+        self.window_sec = max(0.0, float(window_sec or 0))
+        self.max_window_sec = max(0.0, float(max_window_sec or 0))
+        self.overload = overload
+        self.on_shed = on_shed
+        self.shed: Counter[str] = Counter()
+
+        self._pending: OrderedDict[int, deque[InboundMessage]] = OrderedDict()
+        self._busy: set[int] = set()
+        self._size = 0
+        self._cond = asyncio.Condition()
+
+    def _shed(self, reason: str, msg: InboundMessage, *, resolve: bool = True) -> None:
+        self.shed[reason] += 1
+        if resolve and msg.done is not None and not msg.done.done():
+            msg.done.set_result(reason)
+        if self.on_shed is not None:
+            try:
+                self.on_shed(reason, msg)
+            except Exception:
+                pass
+
+    def _pop_chat(self, chat_id: int) -> list[InboundMessage]:
+        pending = self._pending.pop(chat_id)
+        self._size -= len(pending)
+        return list(pending)
+
+    def _drop_expired(self) -> None:
+        if self.max_age_sec <= 0 or not self._size:
+            return
+        deadline = time.monotonic() - self.max_age_sec
+        for chat_id in list(self._pending):
+            pending = self._pending[chat_id]
+            while pending and pending[0].received_at < deadline:
+                self._size -= 1
+                self._shed("expired", pending.popleft())
+            if not pending:
+                del self._pending[chat_id]
+
+    def _ready_chat(self) -> tuple[int | None, float | None]:
+        """
+        (chat_id, None) — чат готов к выдаче;
+        (None, wait) — готовых нет, ближайший «дозреет» через wait секунд (None — ждать нечего по времени).
+        """
+        if len(self._busy) >= self.max_in_flight:
+            return None, None
+
+        now = time.monotonic()
+        wait: float | None = None
+        for chat_id, pending in self._pending.items():
+            if chat_id in self._busy or not pending:
+                continue
+            ready_at = pending[-1].received_at + self.window_sec
+            if self.max_window_sec > 0:
+                ready_at = min(ready_at, pending[0].received_at + self.max_window_sec)
+            left = ready_at - now
+            if left <= 0:
+                return chat_id, None
+            wait = left if wait is None else min(wait, left)
+        return None, wait
+
+    def _oldest_chat(self) -> int | None:
+        oldest: tuple[float, int] | None = None
+        for chat_id, pending in self._pending.items():
+            if pending and (oldest is None or pending[0].received_at < oldest[0]):
+                oldest = (pending[0].received_at, chat_id)
+        return oldest[1] if oldest else None
 
-    async def put(self, msg: InboundMessage) -> None:
-        await self._q.put(msg)
+    async def put(self, msg: InboundMessage) -> bool:
+        """
+        Не блокирует. False — сообщение не принято (overload=busy при полной очереди),
+        вызывающий сам решает, что ответить клиенту.
+        """
+        async with self._cond:
+            self._drop_expired()
 
-    async def get(self, *, timeout: float | None = None) -> InboundMessage:
-        if timeout is None:
-            return await self._q.get()
-        return await asyncio.wait_for(self._q.get(), timeout=timeout)
+            if self.maxsize > 0 and self._size >= self.maxsize:
+                if self.overload == OVERLOAD_BUSY:
+                    self._shed("busy", msg)
+                    return False
 
-    def task_done(self) -> None:
-        self._q.task_done()
+                pending = self._pending.get(msg.chat_id)
+                if self.overload == OVERLOAD_COALESCE and pending:
+                    last = pending[-1]
+                    # done склеенного сообщения завершится вместе с done записи, в которую оно вошло
+                    done = last.done
+                    if msg.done is not None:
+                        if done is None:
+                            done = msg.done
+                        else:
+                            _chain(done, msg.done)
+                    pending[-1] = replace(
+                        last,
+                        message_id=msg.message_id,
+                        merged_ids=(*last.merged_ids, last.message_id),
+                        text=f"{last.text}\n{msg.text}",
+                        done=done,
+                    )
+                    self._shed("coalesced", msg, resolve=False)
+                    self._cond.notify_all()
+                    return True
+
+                chat_id = self._oldest_chat()
+                if chat_id is not None:
+                    pending = self._pending[chat_id]
+                    self._size -= 1
+                    self._shed("drop_oldest", pending.popleft())
+                    if not pending:
+                        del self._pending[chat_id]
+
+            self._pending.setdefault(msg.chat_id, deque()).append(msg)
+            self._size += 1
+            self._cond.notify_all()
+            return True
+
+    async def get_batch(self, *, timeout: float | None = None) -> list[InboundMessage]:
+        """
+        Все ожидающие сообщения одного готового чата (в порядке поступления).
+        Чат помечается занятым до task_done(chat_id).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+
+        async with self._cond:
+            while True:
+                self._drop_expired()
+                chat_id, wait = self._ready_chat()
+                if chat_id is not None:
+                    break
+
+                if deadline is not None:
+                    left = deadline - loop.time()
+                    if left <= 0:
+                        raise asyncio.TimeoutError()
+                    wait = left if wait is None else min(wait, left)
+
+                try:
+                    await asyncio.wait_for(self._cond.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pop_chat(chat_id)
+            self._busy.add(chat_id)
+            return batch
+
+    async def task_done(self, chat_id: int) -> None:
+        async with self._cond:
+            self._busy.discard(int(chat_id))
+            self._cond.notify_all()
+
+    async def set_max_in_flight(self, value: int) -> None:
+        async with self._cond:
+            self.max_in_flight = max(1, int(value))
+            self._cond.notify_all()
+
+    async def set_window(self, value: float) -> None:
+        async with self._cond:
+            self.window_sec = max(0.0, float(value or 0))
+            self._cond.notify_all()
+
+    def drain(self) -> list[InboundMessage]:
+        """Забирает все ожидающие сообщения (остановка сессии)."""
+        out: list[InboundMessage] = []
+        for pending in self._pending.values():
+            out.extend(pending)
+        self._pending.clear()
+        self._size = 0
+        return out
+
+    def qsize(self) -> int:
+        return self._size
+
+    def in_flight(self) -> int:
+        return len(self._busy)
 
     def empty(self) -> bool:
-        return self._q.empty()
+        return self._size == 0
+
+    def oldest_age_sec(self) -> float:
+        heads = [p[0].received_at for p in self._pending.values() if p]
+        return max(0.0, time.monotonic() - min(heads)) if heads else 0.0
+
+    def stats(self) -> dict[str, int]:
+        out = {
+            "depth": self._size,
+            "in_flight": len(self._busy),
+            "chats_pending": len(self._pending),
+            "max_in_flight": self.max_in_flight,
+            "shed_total": sum(self.shed.values()),
+        }
+        for reason, n in self.shed.items():
+            out[f"shed_{reason}"] = n
+        return out
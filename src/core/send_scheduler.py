@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable, TypeVar
+
+from telethon.errors import FloodWaitError
+
+T = TypeVar("T")
+
+# сетевые сбои, после которых идемпотентный вызов имеет смысл повторить.
+# По ним не понять, дошёл ли запрос до Telegram: повтор send_message может продублировать сообщение
+_TRANSIENT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+
+
+class SendScheduler:
+    """
+    Исходящие вызовы одной Telegram-сессии (send_message / send_read_acknowledge / ...):
+    - token bucket: не больше rate_per_sec в среднем, всплеск до burst;
+    - FloodWaitError: вся сессия молчит e.seconds, затем вызов повторяется (не теряется);
+      сколько бы раз это ни случилось — ошибкой считается только пауза длиннее max_flood_wait_sec;
+    - сетевые сбои: повтор с экспоненциальной паузой, до max_retries — только для идемпотентных вызовов
+      (правка сообщения, read ack); send_message после сбоя не повторяется — ошибка уходит вызывающему;
+    - read ack'и копятся по чату (только max_id) и уходят пачкой раз в ack_interval_sec.
+    """
+
+    def __init__(
+        self,
+        *,
+        rate_per_sec: float = 2.0,
+        burst: int = 5,
+        max_retries: int = 5,
+        ack_interval_sec: float = 1.0,
+        max_flood_wait_sec: float = 900.0,
+    ) -> None:
+        self.rate_per_sec = max(0.01, float(rate_per_sec))
+        self.burst = max(1, int(burst))
+        self.max_retries = max(0, int(max_retries))
+        self.ack_interval_sec = max(0.05, float(ack_interval_sec))
+        self.max_flood_wait_sec = float(max_flood_wait_sec)
+
+        self.counters: Counter[str] = Counter()
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self._acks: dict[int, int] = {}
+
+    async def _acquire(self) -> None:
+        # lock — чтобы ожидающие получали токены по очереди (FIFO), а не гонкой
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate_per_sec)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate_per_sec)
+
+    async def send(self, call: Callable[[], Awaitable[T]], *, idempotent: bool = False) -> T:
+        """
+        Выполнить исходящий вызов с учётом лимитов. call — фабрика корутины (повтор = новый вызов).
+        FloodWait повторяется всегда: запрос отклонён и не выполнен. Сетевой сбой повторяется,
+        только если idempotent=True — иначе (новое сообщение) пробрасывается сразу.
+        """
+        attempt = 0
+        self._waiting += 1
+        try:
+            while True:
+                await self._acquire()
+                try:
+                    result = await call()
+                    self.counters["sent"] += 1
+                    return result
+                except FloodWaitError as e:
+                    seconds = float(getattr(e, "seconds", 0) or 1)
+                    self.counters["flood_wait"] += 1
+                    self.counters["flood_wait_sec"] += int(seconds)
+                    # FloodWait — не сбой: попытки не тратит, ограничен только max_flood_wait_sec
+                    if seconds > self.max_flood_wait_sec:
+                        self.counters["failed"] += 1
+                        raise
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+                except _TRANSIENT_ERRORS:
+                    if not idempotent or attempt >= self.max_retries:
+                        self.counters["failed"] += 1
+                        raise
+                    self.counters["retry"] += 1
+                    await asyncio.sleep(min(30.0, 0.5 * (2 ** attempt)))
+                    attempt += 1
+        finally:
+            self._waiting -= 1
+
+    def read_ack(self, chat_id: int, max_id: int) -> None:
+        """Отметить прочитанным до max_id. Несколько сообщений чата подряд -> один вызов."""
+        chat_id = int(chat_id)
+        if int(max_id) > self._acks.get(chat_id, 0):
+            self._acks[chat_id] = int(max_id)
+            self.counters["ack_queued"] += 1
+
+    async def run_acks(self, stop: asyncio.Event, ack: Callable[[int, int], Awaitable[object]]) -> None:
+        """Фоновая отправка накопленных read ack'ов: ack(chat_id, max_id)."""
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=self.ack_interval_sec)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            pending, self._acks = self._acks, {}
+            for chat_id, max_id in pending.items():
+                try:
+                    await self.send(lambda c=chat_id, m=max_id: ack(c, m), idempotent=True)
+                    self.counters["ack_sent"] += 1
+                except Exception:
+                    self.counters["ack_failed"] += 1
+
+    def stats(self) -> dict[str, int]:
+        out = {
+            "send_waiting": self._waiting,
+            "acks_pending": len(self._acks),
+            "flood_blocked_sec": max(0, int(self._blocked_until - time.monotonic())),
+        }
+        for k, v in self.counters.items():
+            out[f"send_{k}"] = int(v)
+        return out
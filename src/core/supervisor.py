@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable
+
+STATE_RUNNING = "running"
+STATE_BACKOFF = "backoff"
+STATE_QUARANTINED = "quarantined"
+STATE_IDLE = "idle"
+
+
+@dataclass
+class RuntimeHealth:
+    sig: str = ""
+    state: str = STATE_IDLE
+    starts: int = 0
+    failures: int = 0        # подряд, сбрасывается после стабильной работы
+    auth_failures: int = 0   # подряд
+    total_failures: int = 0
+    last_error: str | None = None
+    last_failure_at: float | None = None  # unix time
+    started_at: float | None = None       # monotonic
+    retry_at: float = 0.0                 # monotonic
+
+
+class RuntimeSupervisor:
+    """
+    История падений долгоживущих задач (Telegram-сессий) по ключу:
+    - падение -> перезапуск не раньше чем через base * 2^(failures-1) (до max_sec) с jitter;
+    - auth_quarantine_after ошибок авторизации подряд -> карантин: не перезапускаем,
+      пока не сменится подпись подключения (новая session_string / api_hash);
+    - проработала stable_sec и упала — считаем, что это новая серия, счётчик с нуля.
+    Сам ничего не запускает: воркер спрашивает can_start() и due().
+    """
+
+    def __init__(
+        self,
+        *,
+        base_sec: float = 5.0,
+        max_sec: float = 900.0,
+        stable_sec: float = 300.0,
+        auth_quarantine_after: int = 3,
+    ) -> None:
+        self.base_sec = float(base_sec)
+        self.max_sec = float(max_sec)
+        self.stable_sec = float(stable_sec)
+        self.auth_quarantine_after = max(1, int(auth_quarantine_after))
+        self._health: Dict[Any, RuntimeHealth] = {}
+
+    def _get(self, key: Any) -> RuntimeHealth:
+        h = self._health.get(key)
+        if h is None:
+            h = self._health[key] = RuntimeHealth()
+        return h
+
+    def backoff_sec(self, failures: int) -> float:
+        delay = min(self.max_sec, self.base_sec * (2 ** max(0, int(failures) - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def can_start(self, key: Any, sig: str) -> bool:
+        h = self._health.get(key)
+        if h is None:
+            return True
+        if h.sig != sig:
+            # подключение перенастроили — старая история к нему не относится
+            self._health[key] = RuntimeHealth(sig=sig, starts=h.starts, total_failures=h.total_failures)
+            return True
+        if h.state == STATE_QUARANTINED:
+            return False
+        return time.monotonic() >= h.retry_at
+
+    def on_start(self, key: Any, sig: str) -> None:
+        h = self._get(key)
+        h.sig = sig
+        h.state = STATE_RUNNING
+        h.starts += 1
+        h.started_at = time.monotonic()
+
+    def on_stop(self, key: Any) -> None:
+        """Штатная остановка (выключили / перенастроили) — не падение."""
+        h = self._health.get(key)
+        if h is not None:
+            h.state = STATE_IDLE
+            h.started_at = None
+
+    def on_failure(self, key: Any, error: str, *, auth: bool = False) -> float | None:
+        """Возвращает паузу до перезапуска, None — сессия в карантине."""
+        h = self._get(key)
+        now = time.monotonic()
+        if h.started_at is not None and now - h.started_at >= self.stable_sec:
+            h.failures = 0
+            h.auth_failures = 0
+
+        h.failures += 1
+        h.total_failures += 1
+        h.auth_failures = h.auth_failures + 1 if auth else 0
+        h.last_error = error[:500]
+        h.last_failure_at = time.time()
+        h.started_at = None
+
+        if h.auth_failures >= self.auth_quarantine_after:
+            h.state = STATE_QUARANTINED
+            return None
+
+        delay = self.backoff_sec(h.failures)
+        h.state = STATE_BACKOFF
+        h.retry_at = now + delay
+        return delay
+
+    def postpone(self, keys: Iterable[Any], sec: float) -> None:
+        """Отложить перезапуск (например, не удалось прочитать конфигурацию)."""
+        retry_at = time.monotonic() + float(sec)
+        for key in keys:
+            h = self._health.get(key)
+            if h is not None and h.state == STATE_BACKOFF:
+                h.retry_at = max(h.retry_at, retry_at)
+
+    def retain(self, keys: Iterable[Any]) -> None:
+        """Забыть ключи, которых больше нет в конфигурации."""
+        keep = set(keys)
+        for key in [k for k in self._health if k not in keep]:
+            del self._health[key]
+
+    def due(self) -> list[Any]:
+        """Ключи, у которых закончилась пауза после падения — пора перезапускать."""
+        now = time.monotonic()
+        return [k for k, h in self._health.items() if h.state == STATE_BACKOFF and h.retry_at <= now]
+
+    def next_due_in(self) -> float | None:
+        now = time.monotonic()
+        waits = [h.retry_at - now for h in self._health.values() if h.state == STATE_BACKOFF]
+        return max(0.0, min(waits)) if waits else None
+
+    def status(self, key: Any) -> dict[str, Any]:
+        h = self._health.get(key)
+        if h is None:
+            return {"state": STATE_IDLE}
+        out: dict[str, Any] = {
+            "state": h.state,
+            "starts": h.starts,
+            "failures": h.failures,
+            "auth_failures": h.auth_failures,
+            "total_failures": h.total_failures,
+            "last_error": h.last_error,
+            "last_failure_at": h.last_failure_at,
+        }
+        if h.state == STATE_BACKOFF:
+            out["retry_in_sec"] = round(max(0.0, h.retry_at - time.monotonic()), 1)
+        if h.state == STATE_RUNNING and h.started_at is not None:
+            out["uptime_sec"] = round(time.monotonic() - h.started_at, 1)
+        return out
+
+    def keys(self) -> list[Any]:
+        return list(self._health)
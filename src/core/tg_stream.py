@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+# лимит длины одного сообщения Telegram
+TG_MAX_MESSAGE_LEN = 4096
+
+
+def _cut(text: str, limit: int) -> int:
+    """Где разрезать слишком длинный текст: по переводу строки или пробелу во второй половине, иначе ровно по limit."""
+    for sep in ("\n", " "):
+        pos = text.rfind(sep, limit // 2, limit)
+        if pos > 0:
+            return pos
+    return limit
+
+
+class StreamedReply:
+    """
+    Ответ, который показывается в чате по мере генерации:
+    - первый непустой кусок -> send (новое сообщение), дальше — edit того же сообщения
+      не чаще edit_interval_sec;
+    - правка уходит фоном: пока она в пути (в т.ч. ждёт SendScheduler / FloodWait), куски только копятся,
+      следующая правка покажет всё накопленное — чтение ответа модели не тормозит;
+    - текст длиннее max_len: сообщение дописывается до границы, продолжение — новым сообщением;
+    - finish() — последняя правка с полным текстом.
+    send(text) -> сообщение (с .id), edit(message, text) — вызывающий оборачивает их в SendScheduler.
+    Ошибки send и последней правки — вызывающему; ошибки промежуточных правок только считаются
+    (их перекроет следующая правка).
+    """
+
+    def __init__(
+        self,
+        *,
+        send: Callable[[str], Awaitable[Any]],
+        edit: Callable[[Any, str], Awaitable[Any]],
+        edit_interval_sec: float = 1.5,
+        max_len: int = TG_MAX_MESSAGE_LEN,
+    ) -> None:
+        self._send = send
+        self._edit = edit
+        self.edit_interval_sec = max(0.0, float(edit_interval_sec))
+        self.max_len = max(16, int(max_len))
+
+        self.text = ""
+        self.first_message_id: int | None = None
+        self.messages = 0
+        self.edits = 0
+        self.edit_errors = 0
+
+        self._msg: Any = None  # текущее (последнее) сообщение
+        self._offset = 0  # начало текста текущего сообщения в self.text
+        self._shown = ""  # что сейчас видно в текущем сообщении
+        self._last_at = 0.0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def started(self) -> bool:
+        return self.first_message_id is not None or self._msg is not None
+
+    async def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        self.text += delta
+        await self._flush(final=False)
+
+    async def finish(self) -> str:
+        """Дождаться фоновой правки и показать полный текст. Возвращает весь текст ответа."""
+        await self._flush(final=True)
+        return self.text
+
+    def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def _wait_pending(self) -> None:
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                pass
+            self._task = None
+
+    async def _show(self, body: str) -> None:
+        if self._msg is None:
+            msg = await self._send(body)
+            self._msg = msg
+            self.messages += 1
+            if self.first_message_id is None:
+                self.first_message_id = int(getattr(msg, "id", 0) or 0) or None
+        elif body != self._shown:
+            await self._edit(self._msg, body)
+            self.edits += 1
+        self._shown = body
+        self._last_at = time.monotonic()
+
+    async def _show_background(self, body: str) -> None:
+        try:
+            await self._show(body)
+        except Exception:
+            self.edit_errors += 1
+
+    async def _flush(self, *, final: bool) -> None:
+        while True:
+            body = self.text[self._offset:]
+
+            if len(body) > self.max_len:
+                # текущее сообщение заполнено: дописываем его до границы, продолжение — в новом
+                cut = _cut(body, self.max_len)
+                await self._wait_pending()
+                await self._show(body[:cut])
+                self._offset += cut
+                while self._offset < len(self.text) and self.text[self._offset].isspace():
+                    self._offset += 1
+                self._msg = None
+                self._shown = ""
+                continue
+
+            if not body.strip() or body == self._shown:
+                if final:
+                    await self._wait_pending()
+                return
+
+            if final or self._msg is None:
+                # после фоновой правки (она могла показать более ранний вариант) — полный текст
+                await self._wait_pending()
+                await self._show(body)
+                return
+
+            if self._task is None or self._task.done():
+                if time.monotonic() - self._last_at >= self.edit_interval_sec:
+                    self._task = asyncio.create_task(self._show_background(body))
+            return
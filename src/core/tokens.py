@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import math
+import os
+
+from src.core.cache import TTLCache
+
+# точный подсчёт — tiktoken (в requirements.txt); если его нет или словарь не загрузился — оценка по байтам UTF-8
+TIKTOKEN_AVAILABLE = importlib.util.find_spec("tiktoken") is not None
+TOKENIZER_ENCODING = (os.getenv("TOKENIZER_ENCODING") or "o200k_base").strip()
+# ~4 байта UTF-8 на токен: английский — около 4 символов, кириллица (2 байта на букву) — около 2;
+# для русского это завышение, т.е. бюджет соблюдается с запасом
+HEURISTIC_BYTES_PER_TOKEN = 4.0
+# служебные токены на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# хеш текста сообщения -> число токенов. История одного диалога уходит в модель на каждом ходе —
+# одни и те же строки (из HISTORY_BUFFER) не токенизируются заново. Ключ — 16-байтный digest,
+# а не сам текст: кеш не держит в памяти копии длинных сообщений
+TOKEN_COUNT_CACHE = TTLCache[bytes, int](
+    maxsize=int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "50000")),
+    ttl_sec=0,
+)
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    """tiktoken-кодировка или None (не установлен / не загрузилась — тогда оценка)."""
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed or not TIKTOKEN_AVAILABLE:
+        return _encoding
+    try:
+        import tiktoken
+
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        # первая загрузка тянет словарь из сети — без неё работаем по оценке
+        _encoding_failed = True
+        print(f"[tokens] tiktoken unavailable, using estimate: {e.__class__.__name__}: {e}")
+    return _encoding
+
+
+async def preload_encoding() -> bool:
+    """Загрузить кодировку при старте процесса (в потоке), а не на первом запросе внутри event loop."""
+    return await asyncio.to_thread(_get_encoding) is not None
+
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def count_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    key = _cache_key(text)
+    cached = TOKEN_COUNT_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    enc = _get_encoding()
+    if enc is not None:
+        n = len(enc.encode(text, disallowed_special=()))
+    else:
+        n = math.ceil(len(text.encode("utf-8")) / HEURISTIC_BYTES_PER_TOKEN)
+    TOKEN_COUNT_CACHE.set(key, n)
+    return n
+
+
+def message_tokens(item: dict) -> int:
+    return count_tokens(str(item.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_tokens(text: str, max_tokens: int, *, keep_tail: bool = False) -> str:
+    """Не больше max_tokens токенов от начала текста (keep_tail=True — от конца)."""
+    max_tokens = max(0, int(max_tokens))
+    n = count_tokens(text)
+    if n <= max_tokens:
+        return text
+    if max_tokens == 0:
+        return ""
+
+    enc = _get_encoding()
+    if enc is not None:
+        tokens = enc.encode(text, disallowed_special=())
+        part = tokens[-max_tokens:] if keep_tail else tokens[:max_tokens]
+        return enc.decode(part)
+
+    chars = int(len(text) * max_tokens / n)
+    return text[-chars:] if keep_tail and chars else text[:chars]
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import os
+from contextlib import asynccontextmanager
+
 import uvicorn
 
 from fastapi import FastAPI, Request, HTTPException
@@ -14,11 +16,25 @@ from src.api.routes_chat import router as chat_router
 from src.api.routes_settings import router as settings_router
 from src.api.ui.router import router as ui_router
 from src.api.public.router import router as public_router
+from src.core.openai_client import OPENAI_POOL
+from src.core.tokens import preload_encoding
+from src.storage.writer import get_writer
 
 
 CRM_HOME_URL = "https://crm.dadaexpo.ru/"
 
-app = FastAPI(title="CargoChats")
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # словарь tiktoken грузится (и при первом запуске скачивается) синхронно — не на первом запросе
+    await preload_encoding()
+    yield
+    # при остановке дописываем накопленные BatchWriter строки (fire-and-forget режим)
+    await get_writer().flush()
+    await OPENAI_POOL.aclose()
+
+
+app = FastAPI(title="CargoChats", lifespan=lifespan)
 
 # статика
 app.mount("/static", StaticFiles(directory="src/web/static"), name="static")
@@ -17,3 +17,7 @@ class Company(Base, TimestampMixin):
     cargo1_company_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
 
     is_enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="true")
+
+    # сколько месяцев хранить messages/events (удаляются целыми секциями, см. src/storage/partitions.py);
+    # NULL — MESSAGES_RETENTION_MONTHS
+    retention_months: Mapped[int | None] = mapped_column(Integer, nullable=True)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import Integer, String, Boolean, ForeignKey, Index
+from sqlalchemy import DateTime, Integer, String, Boolean, ForeignKey, Index, func, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -21,5 +21,19 @@ class Dialog(Base, TimestampMixin):
 
     is_enabled: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="true")
 
+    # время последнего сообщения; ведёт триггер trg_messages_dialog_activity на INSERT в messages (миграция 0006)
+    last_message_at: Mapped["DateTime"] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
 
 Index("ix_dialogs_company_client", Dialog.company_id, Dialog.client_id)
+# список диалогов компании по активности (keyset по (last_message_at, id), см. storage.dialogs)
+Index("ix_dialogs_company_activity", Dialog.company_id, Dialog.last_message_at.desc(), Dialog.id.desc())
+# не больше одного открытого диалога на клиента — на него опирается upsert в storage.messages.resolve_dialog_ref
+Index(
+    "uq_dialogs_client_open",
+    Dialog.client_id,
+    unique=True,
+    postgresql_where=text("status = 'open' AND is_enabled"),
+)
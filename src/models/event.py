@@ -9,6 +9,7 @@ from ._mixins import TimestampMixin
 
 
 class Event(Base, TimestampMixin):
+    # в БД: PARTITION BY RANGE (created_at), PK (id, created_at) — миграция 0005
     __tablename__ = "events"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -27,9 +28,8 @@ class Event(Base, TimestampMixin):
     dialog_id: Mapped[int | None] = mapped_column(
         ForeignKey("dialogs.id", ondelete="SET NULL"), nullable=True, index=True
     )
-    message_id: Mapped[int | None] = mapped_column(
-        ForeignKey("messages.id", ondelete="SET NULL"), nullable=True, index=True
-    )
+    # без FK: messages секционирована по created_at, UNIQUE(id) на ней нет
+    message_id: Mapped[int | None] = mapped_column(Integer, nullable=True, index=True)
 
     meta: Mapped[dict] = mapped_column(JSONB, nullable=False, server_default="{}")
 
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from sqlalchemy import Integer, String, Boolean, ForeignKey, Index
+from sqlalchemy import Integer, String, Boolean, DateTime, ForeignKey, Index, func, text
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 
@@ -26,5 +26,24 @@ class Job(Base, TimestampMixin):
 
     is_locked: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
 
+    # когда задачу можно брать (backoff между попытками)
+    run_after: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    # аренда: пока не истекла — задача занята воркером locked_by; истекла — задачу заберёт другой
+    locked_until: Mapped["DateTime | None"] = mapped_column(DateTime(timezone=True), nullable=True)
+    locked_by: Mapped[str | None] = mapped_column(String(64), nullable=True)
+
 
 Index("ix_jobs_company_queue_status", Job.company_id, Job.queue, Job.status)
+Index(
+    "ix_jobs_queue_ready",
+    Job.queue,
+    Job.run_after,
+    Job.id,
+    postgresql_where=text("status IN ('new', 'running')"),
+)
+Index(
+    "ix_jobs_finished",
+    Job.updated_at,
+    Job.id,
+    postgresql_where=text("status IN ('done', 'failed')"),
+)
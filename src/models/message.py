@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from sqlalchemy import Integer, String, Boolean, ForeignKey, Text, Index
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Integer, String, Boolean, ForeignKey, Text, Index, Computed, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.storage.db import Base
@@ -9,6 +9,8 @@ from ._mixins import TimestampMixin
 
 
 class Message(Base, TimestampMixin):
+    # в БД: PARTITION BY RANGE (created_at), PK (id, created_at) — миграция 0005;
+    # id по-прежнему уникален (одна sequence), поэтому для ORM ключ — id
     __tablename__ = "messages"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
@@ -27,5 +29,34 @@ class Message(Base, TimestampMixin):
     meta: Mapped[dict] = mapped_column(JSONB, nullable=False, server_default="{}")
     is_deleted: Mapped[bool] = mapped_column(Boolean, nullable=False, server_default="false")
 
+    # полнотекстовый поиск (storage.search); deferred — история и списки его не читают
+    text_tsv: Mapped[object | None] = mapped_column(
+        TSVECTOR,
+        Computed(
+            "to_tsvector('russian'::regconfig, coalesce(text, '')) "
+            "|| to_tsvector('english'::regconfig, coalesce(text, ''))",
+            persisted=True,
+        ),
+        nullable=True,
+        deferred=True,
+    )
+
 
 Index("ix_messages_dialog_created", Message.dialog_id, Message.created_at)
+# история для модели: WHERE dialog_id, resource_id, session_id, is_deleted = false ORDER BY created_at DESC, id DESC
+Index(
+    "ix_messages_history",
+    Message.dialog_id,
+    Message.resource_id,
+    Message.session_id,
+    Message.created_at.desc(),
+    Message.id.desc(),
+    postgresql_where=text("is_deleted = false"),
+)
+# полнотекстовый поиск: text_tsv @@ query по неудалённым (storage.search)
+Index(
+    "ix_messages_text_tsv",
+    Message.text_tsv,
+    postgresql_using="gin",
+    postgresql_where=text("is_deleted = false"),
+)
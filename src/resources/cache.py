@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import os
+from typing import Any, Awaitable, Callable, TypeVar
+
+from src.core.cache import TTLCache
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class ResourceConfigCache:
+    """
+    Настройки ресурсов (ключ OpenAI, Prompt) в памяти процесса: (kind, company_id, resource_id) -> значение.
+    Меняются редко (сохранение в UI), а читаются на каждый ответ — в установившемся режиме запросов к БД нет.
+    - invalidate(resource_id): после сохранения в UI (тот же процесс) и по NOTIFY openai/prompt/resource (воркер);
+    - версия ресурса растёт при каждой инвалидации: загрузка, начатая до неё, результат в кэш не кладёт
+      (иначе запрос, прочитавший старую строку до COMMIT сохранения, вернул бы её в кэш уже после сброса);
+    - TTL — страховка для процессов без LISTEN (несколько экземпляров API).
+    None (ресурса нет / выключен) тоже кэшируется: его исправление — тоже сохранение с инвалидацией.
+    """
+
+    def __init__(self, *, maxsize: int = 10_000, ttl_sec: float = 300.0) -> None:
+        self._cache = TTLCache[tuple, tuple[int, Any]](maxsize=maxsize, ttl_sec=ttl_sec)
+        self._versions: dict[int, int] = {}
+        self.invalidations = 0
+
+    async def get_or_load(
+        self,
+        kind: str,
+        company_id: int,
+        resource_id: int,
+        load: Callable[[], Awaitable[V]],
+    ) -> V:
+        rid = int(resource_id)
+        key = (str(kind), int(company_id), rid)
+        version = self._versions.get(rid, 0)
+
+        cached = self._cache.get(key, _MISSING)
+        if cached is not _MISSING and cached[0] == version:
+            return cached[1]
+
+        value = await load()
+        if self._versions.get(rid, 0) == version:
+            self._cache.set(key, (version, value))
+        return value
+
+    def invalidate(self, resource_id: int) -> int:
+        rid = int(resource_id)
+        self._versions[rid] = self._versions.get(rid, 0) + 1
+        self.invalidations += 1
+        return self._cache.pop_where(lambda k, _v: k[2] == rid)
+
+    def clear(self) -> None:
+        for rid in list(self._versions):
+            self._versions[rid] += 1
+        self._cache.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {**self._cache.stats(), "invalidations": self.invalidations}
+
+
+RESOURCE_CONFIG_CACHE = ResourceConfigCache(
+    maxsize=int(os.getenv("RESOURCE_CONFIG_CACHE_SIZE", "10000")),
+    ttl_sec=float(os.getenv("RESOURCE_CONFIG_CACHE_TTL_SEC", "300")),
+)
+
+
+def invalidate_resource_config(resource_id: int) -> None:
+    """Сбросить закэшированные настройки ресурса (вызывать после COMMIT изменения)."""
+    RESOURCE_CONFIG_CACHE.invalidate(int(resource_id))
@@ -4,6 +4,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.models.resource import Resource, ResourceSettings
+from src.resources.cache import RESOURCE_CONFIG_CACHE
 
 OPENAI_KEY_FIELD = "openai_api_key"
 
@@ -17,7 +18,17 @@ async def get_openai_api_key(
     """
     Возвращает OpenAI api_key из ResourceSettings.data выбранного OpenAI-ресурса.
     Защищаемся по company_id + kind=openai + is_enabled.
+    Результат кэшируется (RESOURCE_CONFIG_CACHE), сброс — при сохранении ключа / NOTIFY.
     """
+    return await RESOURCE_CONFIG_CACHE.get_or_load(
+        "openai",
+        company_id,
+        openai_resource_id,
+        lambda: _load_openai_api_key(db, company_id=company_id, openai_resource_id=openai_resource_id),
+    )
+
+
+async def _load_openai_api_key(db: AsyncSession, *, company_id: int, openai_resource_id: int) -> str | None:
     stmt = (
         select(ResourceSettings.data)
         .select_from(Resource)
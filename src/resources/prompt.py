@@ -4,6 +4,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.models.resource import Resource, ResourceSettings
+from src.resources.cache import RESOURCE_CONFIG_CACHE
 
 
 async def get_prompt_settings(
@@ -15,7 +16,17 @@ async def get_prompt_settings(
     """
     Возвращает настройки Prompt из ResourceSettings.data выбранного Prompt-ресурса.
     Защита: company_id + kind=prompt + is_enabled.
+    Результат кэшируется (RESOURCE_CONFIG_CACHE) — dict общий для всех вызовов, не изменять.
     """
+    return await RESOURCE_CONFIG_CACHE.get_or_load(
+        "prompt",
+        company_id,
+        prompt_resource_id,
+        lambda: _load_prompt_settings(db, company_id=company_id, prompt_resource_id=prompt_resource_id),
+    )
+
+
+async def _load_prompt_settings(db: AsyncSession, *, company_id: int, prompt_resource_id: int) -> dict | None:
     stmt = (
         select(ResourceSettings.data)
         .select_from(Resource)
@@ -13,6 +13,7 @@ from src.api.deps import require_company_from_token
 from src.models.resource import Resource, ResourceSettings
 from src.models.session import Session, SessionSettings
 from src.storage.db import get_db
+from src.storage.notify import notify_config_changed
 
 from telethon.errors import FloodWaitError
 from telethon.errors.rpcerrorlist import SendCodeUnavailableError
@@ -123,6 +124,7 @@ async def telegram_save(
         data["prompt_resource_id"] = int(payload.prompt_resource_id)
 
     settings.data = data
+    await notify_config_changed(db, kind="telegram", resource_id=resource.id)
     await db.commit()
     return JSONResponse({"ok": True})
 
@@ -409,6 +411,7 @@ async def telegram_session_activation_confirm(
         ss.data = ss_data
 
         # IMPORTANT: do NOT auto-enable; that is controlled by /set_enabled button
+        await notify_config_changed(db, kind="telegram", resource_id=resource.id, session_id=session.id)
         await db.commit()
 
         return JSONResponse(
@@ -478,6 +481,7 @@ async def telegram_session_set_enabled(
     session.is_enabled = bool(payload.is_enabled)
     ss.is_enabled = bool(payload.is_enabled)
 
+    await notify_config_changed(db, kind="telegram", resource_id=resource.id, session_id=session.id)
     await db.commit()
     return JSONResponse(
         {
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from typing import Any
+
+from sqlalchemy import false, select, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.client import Client
+from src.models.dialog import Dialog
+from src.models.message import Message
+from src.storage.pagination import keyset_desc, page_result
+
+# длина превью последнего сообщения в списке диалогов
+PREVIEW_CHARS = 200
+
+
+async def list_dialogs_page(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    limit: int,
+    cursor: str | None = None,
+    status: str | None = None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """
+    Диалоги компании по последней активности (last_message_at DESC, id DESC), keyset по ix_dialogs_company_activity.
+    К каждому — клиент и превью последнего сообщения (LATERAL ... LIMIT 1 по ix_messages_dialog_created).
+    Возвращает (строки, курсор следующей страницы или None). Битый cursor -> ValueError.
+    """
+    last = (
+        select(Message.direction, Message.text)
+        .where(Message.dialog_id == Dialog.id, Message.is_deleted == false())
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .lateral("last_msg")
+    )
+
+    stmt = (
+        select(
+            Dialog.id,
+            Dialog.client_id,
+            Dialog.status,
+            Dialog.title,
+            Dialog.created_at,
+            Dialog.last_message_at,
+            Client.display_name,
+            last.c.direction,
+            last.c.text,
+        )
+        .join(Client, Client.id == Dialog.client_id)
+        .outerjoin(last, true())
+        .where(Dialog.company_id == int(company_id))
+    )
+    if status:
+        stmt = stmt.where(Dialog.status == str(status))
+
+    stmt = keyset_desc(stmt, Dialog.last_message_at, Dialog.id, cursor=cursor, limit=limit)
+    rows, next_cursor = page_result((await db.execute(stmt)).all(), limit, lambda r: (r.last_message_at, r.id))
+
+    items = [
+        {
+            "id": int(r.id),
+            "client_id": int(r.client_id),
+            "client_name": r.display_name,
+            "status": r.status,
+            "title": r.title,
+            "created_at": r.created_at,
+            "last_message_at": r.last_message_at,
+            "last_direction": r.direction,
+            "last_text": (r.text or "")[:PREVIEW_CHARS] if r.direction else None,
+        }
+        for r in rows
+    ]
+    return items, next_cursor
+
+
+async def get_company_dialog(db: AsyncSession, *, company_id: int, dialog_id: int) -> Dialog | None:
+    return (
+        await db.execute(select(Dialog).where(Dialog.id == int(dialog_id), Dialog.company_id == int(company_id)))
+    ).scalar_one_or_none()
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import Any
+
+from src.models.event import Event
+from src.storage.writer import get_writer
+
+
+async def write_event(
+    *,
+    company_id: int,
+    kind: str,
+    message: str | None = None,
+    level: str = "info",
+    resource_id: int | None = None,
+    session_id: int | None = None,
+    dialog_id: int | None = None,
+    message_id: int | None = None,
+    meta: dict[str, Any] | None = None,
+    wait: bool | None = False,
+) -> int | None:
+    """
+    Журнал событий (events) через общий BatchWriter.
+    По умолчанию fire-and-forget: событие не должно тормозить обработку сообщения.
+    """
+    row = {
+        "company_id": int(company_id),
+        "level": str(level)[:16],
+        "kind": str(kind)[:64],
+        "message": message,
+        "resource_id": resource_id,
+        "session_id": session_id,
+        "dialog_id": dialog_id,
+        "message_id": message_id,
+        "meta": meta or {},
+    }
+    return await get_writer().add(Event, row, wait=wait)
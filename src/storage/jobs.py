@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import and_, delete, func, insert, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.job import Job
+
+# канал, по которому enqueue будит JobRunner (иначе он опрашивает таблицу раз в poll_sec)
+JOBS_CHANNEL = "cargochats_jobs"
+
+JOB_NEW = "new"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+# предикат частичного индекса ix_jobs_finished — литералом: с bind-параметрами Postgres не сопоставит его с индексом
+FINISHED_PREDICATE = text(f"jobs.status IN ('{JOB_DONE}', '{JOB_FAILED}')")
+
+
+@dataclass(frozen=True)
+class LeasedJob:
+    id: int
+    company_id: int
+    queue: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+def _secs(value: float):
+    return func.make_interval(0, 0, 0, 0, 0, 0, float(value))
+
+
+async def enqueue_jobs(
+    db: AsyncSession,
+    jobs: list[dict[str, Any]],
+    *,
+    commit: bool = True,
+) -> list[int]:
+    """
+    Пачка задач одним multi-row INSERT ... RETURNING.
+    jobs: [{company_id, queue, payload, max_attempts?}]; id возвращаются в порядке jobs.
+    """
+    if not jobs:
+        return []
+
+    rows = []
+    for j in jobs:
+        row = {
+            "company_id": int(j["company_id"]),
+            "queue": str(j["queue"]),
+            "payload": dict(j.get("payload") or {}),
+        }
+        if j.get("max_attempts"):
+            row["max_attempts"] = int(j["max_attempts"])
+        rows.append(row)
+
+    result = await db.execute(
+        insert(Job).returning(Job.id, sort_by_parameter_order=True),
+        rows,
+    )
+    ids = [int(x) for x in result.scalars().all()]
+
+    for q in sorted({r["queue"] for r in rows}):
+        await db.execute(text("SELECT pg_notify(:channel, :queue)"), {"channel": JOBS_CHANNEL, "queue": q})
+
+    if commit:
+        await db.commit()
+    return ids
+
+
+async def lease_jobs(
+    db: AsyncSession,
+    *,
+    queue: str,
+    limit: int,
+    lease_sec: float,
+    worker_id: str,
+) -> list[LeasedJob]:
+    """
+    Берёт до limit готовых задач очереди в аренду на lease_sec:
+    - new, у которых наступил run_after;
+    - running, чья аренда истекла (воркер упал / перезапустился).
+    FOR UPDATE SKIP LOCKED — параллельные воркеры не ждут друг друга и не берут одно и то же.
+    Задачи с исчерпанными попытками и истекшей арендой сразу переводятся в failed.
+    """
+    if limit <= 0:
+        return []
+
+    now = func.now()
+
+    await db.execute(
+        update(Job)
+        .where(
+            Job.queue == queue,
+            Job.status == JOB_RUNNING,
+            Job.locked_until < now,
+            Job.attempts >= Job.max_attempts,
+        )
+        .values(status=JOB_FAILED, is_locked=False, last_error="lease expired on last attempt")
+        .execution_options(synchronize_session=False)
+    )
+
+    candidates = (
+        select(Job.id)
+        .where(
+            Job.queue == queue,
+            Job.attempts < Job.max_attempts,
+            or_(
+                and_(Job.status == JOB_NEW, Job.run_after <= now),
+                and_(Job.status == JOB_RUNNING, Job.locked_until < now),
+            ),
+        )
+        .order_by(Job.run_after, Job.id)
+        .limit(int(limit))
+        .with_for_update(skip_locked=True)
+    )
+
+    stmt = (
+        update(Job)
+        .where(Job.id.in_(candidates.scalar_subquery()))
+        .values(
+            status=JOB_RUNNING,
+            is_locked=True,
+            attempts=Job.attempts + 1,
+            locked_until=now + _secs(lease_sec),
+            locked_by=str(worker_id)[:64],
+        )
+        .returning(Job.id, Job.company_id, Job.queue, Job.payload, Job.attempts, Job.max_attempts)
+        .execution_options(synchronize_session=False)
+    )
+    rows = (await db.execute(stmt)).all()
+    await db.commit()
+
+    jobs = [
+        LeasedJob(
+            id=int(r[0]),
+            company_id=int(r[1]),
+            queue=str(r[2]),
+            payload=dict(r[3] or {}),
+            attempts=int(r[4]),
+            max_attempts=int(r[5]),
+        )
+        for r in rows
+    ]
+    jobs.sort(key=lambda j: j.id)
+    return jobs
+
+
+async def extend_leases(db: AsyncSession, job_ids: list[int], *, lease_sec: float, worker_id: str) -> None:
+    if not job_ids:
+        return
+    await db.execute(
+        update(Job)
+        .where(Job.id.in_([int(x) for x in job_ids]), Job.status == JOB_RUNNING, Job.locked_by == str(worker_id)[:64])
+        .values(locked_until=func.now() + _secs(lease_sec))
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+def _owned(job_id: int, worker_id: str):
+    # задачу, чья аренда истекла и перешла другому воркеру, не трогаем: её состояние теперь ведёт он
+    return and_(Job.id == int(job_id), Job.status == JOB_RUNNING, Job.locked_by == str(worker_id)[:64])
+
+
+async def complete_job(db: AsyncSession, job_id: int, *, worker_id: str) -> bool:
+    """False — задача уже не наша (аренда истекла и перехвачена), статус не изменён."""
+    result = await db.execute(
+        update(Job)
+        .where(_owned(job_id, worker_id))
+        .values(status=JOB_DONE, is_locked=False, locked_until=None, last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def fail_job(
+    db: AsyncSession,
+    job: LeasedJob,
+    *,
+    error: str,
+    retry_in_sec: float,
+    worker_id: str,
+) -> bool:
+    """
+    Ошибка обработки: либо повтор через retry_in_sec (status=new), либо failed,
+    если попытки исчерпаны. True — задача будет повторена.
+    Задачу, которая уже не наша (см. complete_job), не трогает.
+    """
+    retry = job.attempts < job.max_attempts
+    values: dict[str, Any] = {
+        "is_locked": False,
+        "locked_until": None,
+        "last_error": (error or "")[:500],
+        "status": JOB_NEW if retry else JOB_FAILED,
+    }
+    if retry:
+        values["run_after"] = func.now() + _secs(retry_in_sec)
+
+    await db.execute(
+        update(Job)
+        .where(_owned(job.id, worker_id))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return retry
+
+
+async def release_job(
+    db: AsyncSession,
+    job: LeasedJob,
+    *,
+    retry_in_sec: float,
+    worker_id: str,
+    reason: str = "",
+) -> bool:
+    """
+    Вернуть задачу в очередь (status=new через retry_in_sec) без траты попытки:
+    этот воркер не может её выполнить (например, нужная сессия запущена не здесь).
+    """
+    result = await db.execute(
+        update(Job)
+        .where(_owned(job.id, worker_id))
+        .values(
+            status=JOB_NEW,
+            is_locked=False,
+            locked_until=None,
+            locked_by=None,
+            # lease_jobs уже засчитал попытку — возвращаем её
+            attempts=func.greatest(Job.attempts - 1, 0),
+            run_after=func.now() + _secs(retry_in_sec),
+            last_error=(reason or "")[:500] or None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def purge_finished_jobs(db: AsyncSession, *, older_than_sec: float, batch_size: int = 5000) -> int:
+    """
+    Удаляет done / failed задачи, которые не менялись дольше older_than_sec (в payload — полный текст сообщений).
+    Пачками по batch_size, каждая — своей транзакцией; SKIP LOCKED — параллельные воркеры не ждут друг друга.
+    Индекс ix_jobs_finished. Возвращает число удалённых строк.
+    """
+    batch = (
+        select(Job.id)
+        .where(
+            FINISHED_PREDICATE,
+            Job.updated_at < func.now() - _secs(older_than_sec),
+        )
+        .order_by(Job.updated_at, Job.id)
+        .limit(max(1, int(batch_size)))
+        .with_for_update(skip_locked=True)
+    )
+
+    total = 0
+    while True:
+        result = await db.execute(
+            delete(Job).where(Job.id.in_(batch.scalar_subquery())).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        n = int(result.rowcount or 0)
+        total += n
+        if n < batch_size:
+            return total
@@ -1,13 +1,42 @@
 from __future__ import annotations
 
+import hashlib
+import os
+from dataclasses import dataclass
 from typing import Any
 
-from sqlalchemy import select
+from sqlalchemy import and_, event, exists, false, func, literal, select, text, true, update
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 
+from src.core.cache import TTLCache
+from src.core.history_buffer import HistoryBuffer
 from src.models.client import Client, ClientIdentity
 from src.models.dialog import Dialog
 from src.models.message import Message
+from src.storage.notify import notify_config_changed
+from src.storage.pagination import keyset_desc, page_result
+from src.storage.writer import get_writer
+
+# (company_id, resource_id, kind, external_id) -> (client_id, dialog_id) открытого диалога.
+# Кэшируются только уже закоммиченные строки (найденные запросом), созданные в текущей транзакции — нет:
+# при rollback в кэше остались бы несуществующие id.
+DIALOG_REF_CACHE = TTLCache[tuple, tuple[int, int]](
+    maxsize=int(os.getenv("DIALOG_REF_CACHE_SIZE", "10000")),
+    ttl_sec=float(os.getenv("DIALOG_REF_CACHE_TTL_SEC", "300")),
+)
+
+
+# (dialog_id, resource_id, session_id) -> последние сообщения {role, content} для контекста модели.
+# Пополняется только после COMMIT строки (save_message / write_message), сбрасывается при очистке диалога (clear_dialog).
+HISTORY_BUFFER = HistoryBuffer(
+    max_bytes=int(os.getenv("HISTORY_BUFFER_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_items=int(os.getenv("HISTORY_BUFFER_MAX_ITEMS", "200")),
+)
+
+# session.info: строки save_message(commit=False), которые попадут в HISTORY_BUFFER после COMMIT
+_HISTORY_PENDING = "history_buffer_pending"
 
 
 def _norm_session_id(session_id: int | None) -> int | None:
@@ -18,258 +47,725 @@ def _norm_session_id(session_id: int | None) -> int | None:
     return sid if sid and sid > 0 else None
 
 
-async def _resolve_client(
-    db: AsyncSession,
+@dataclass(frozen=True)
+class DialogRef:
+    """
+    Разрешённая один раз привязка сообщения: company/resource/session + client + открытый dialog.
+    Дальше по конвейеру (save_inbound / load_history / save_outbound) передаются только id.
+    """
+
+    company_id: int
+    resource_id: int
+    session_id: int | None
+    client_id: int
+    dialog_id: int
+    external_id: str
+
+
+# предикат частичного уникального индекса uq_dialogs_client_open: у клиента не больше одного открытого диалога.
+# В ON CONFLICT — литералом: с bind-параметрами Postgres не выводит по нему индекс-арбитр.
+OPEN_DIALOG_PREDICATE = text("status = 'open' AND is_enabled")
+
+
+def _open_dialog_where():
+    return and_(Dialog.status == "open", Dialog.is_enabled.is_(True))
+
+
+def _identity_where(*, company_id: int, resource_id: int, kind: str, external_id: str):
+    """Включённая identity включённого клиента компании (запрос должен join'ить Client)."""
+    return and_(
+        Client.company_id == int(company_id),
+        Client.is_enabled.is_(True),
+        ClientIdentity.resource_id == int(resource_id),
+        ClientIdentity.kind == str(kind),
+        ClientIdentity.external_id == str(external_id),
+        ClientIdentity.is_enabled.is_(True),
+    )
+
+
+def _client_code(kind: str, resource_id: int, external_id: str) -> str:
+    """
+    clients.code (уникален в компании, до 64 символов) без коллизий: kind:resource:external_id,
+    а если не помещается — вместо external_id его sha1 (обрезка сливала бы разных клиентов в одного).
+    """
+    code = f"{kind}:{int(resource_id)}:{external_id}"
+    if len(code) <= 64:
+        return code
+    digest = hashlib.sha1(str(external_id).encode("utf-8")).hexdigest()
+    code = f"{kind}:{int(resource_id)}:#{digest}"
+    if len(code) <= 64:
+        return code
+    return "#" + hashlib.sha1(f"{kind}:{int(resource_id)}:{external_id}".encode("utf-8")).hexdigest()
+
+
+def _upsert_dialog_ref_stmt(
     *,
     company_id: int,
     resource_id: int,
     kind: str,
     external_id: str,
-) -> Client | None:
-    stmt = (
-        select(Client)
-        .join(ClientIdentity, ClientIdentity.client_id == Client.id)
+    dialog_meta: dict[str, Any],
+):
+    """
+    Один statement: identity -> client -> открытый dialog, недостающее создаётся.
+    Ищутся только включённые client / identity нужного kind (как и во всех чтениях привязки).
+    Гонки (воркер + API, параллельные обработчики) разрешают уникальные индексы:
+    - clients (company_id, code): код детерминирован (_client_code), DO NOTHING — чужая строка
+      не присваивается; client_id NULL, вызывающий перечитывает (см. resolve_dialog_ref);
+    - client_identities (resource_id, external_id): DO NOTHING;
+    - dialogs (client_id) WHERE open: DO NOTHING -> dialog_id NULL, вызывающий перечитывает.
+    Колонки: client_id, existing_dialog_id, new_dialog_id.
+    """
+    # ВАЖНО: clients имеет уникальность (company_id, code) — делаем код с префиксом, чтобы не конфликтовал между ресурсами.
+    client_code = _client_code(kind, resource_id, external_id)
+
+    ident = (
+        select(ClientIdentity.client_id)
+        .join(Client, Client.id == ClientIdentity.client_id)
         .where(
-            Client.company_id == int(company_id),
-            Client.is_enabled.is_(True),
-            ClientIdentity.resource_id == int(resource_id),
-            ClientIdentity.kind == str(kind),
-            ClientIdentity.external_id == str(external_id),
-            ClientIdentity.is_enabled.is_(True),
+            _identity_where(
+                company_id=company_id,
+                resource_id=resource_id,
+                kind=kind,
+                external_id=external_id,
+            )
         )
-        .limit(1)
+        .cte("ident")
     )
-    return (await db.execute(stmt)).scalar_one_or_none()
 
+    ins_client = pg_insert(Client).from_select(
+        ["company_id", "code", "meta"],
+        select(
+            literal(int(company_id)),
+            literal(client_code),
+            literal({"source": kind}, JSONB),
+        ).where(~exists(select(ident.c.client_id))),
+    )
+    new_client = (
+        ins_client.on_conflict_do_nothing(constraint="uq_clients_company_code")
+        .returning(Client.id)
+        .cte("new_client")
+    )
 
-async def _resolve_or_create_client(
-    db: AsyncSession,
-    *,
-    company_id: int,
-    resource_id: int,
-    kind: str,
-    external_id: str,
-    meta: dict[str, Any] | None = None,
-) -> Client:
-    client = await _resolve_client(
-        db,
-        company_id=company_id,
-        resource_id=resource_id,
-        kind=kind,
-        external_id=external_id,
+    new_ident = (
+        pg_insert(ClientIdentity)
+        .from_select(
+            ["client_id", "resource_id", "external_id", "kind", "meta"],
+            select(
+                new_client.c.id,
+                literal(int(resource_id)),
+                literal(external_id),
+                literal(str(kind)),
+                literal({}, JSONB),
+            ),
+        )
+        .on_conflict_do_nothing(constraint="uq_client_identities_resource_external")
+        .returning(ClientIdentity.client_id)
+        .cte("new_ident")
     )
-    if client:
-        return client
 
-    # ВАЖНО: clients имеет уникальность (company_id, code) — делаем код с префиксом, чтобы не конфликтовал между ресурсами.
-    client_code = f"{kind}:{int(resource_id)}:{external_id}"[:64]
-    client = Client(
-        company_id=int(company_id),
-        code=client_code,
-        meta=meta or {"source": kind},
+    cl = select(
+        func.coalesce(
+            select(ident.c.client_id).limit(1).scalar_subquery(),
+            select(new_ident.c.client_id).limit(1).scalar_subquery(),
+            select(new_client.c.id).limit(1).scalar_subquery(),
+        ).label("client_id")
+    ).cte("cl")
+
+    existing_dialog = (
+        select(Dialog.id)
+        .join(cl, Dialog.client_id == cl.c.client_id)
+        .where(_open_dialog_where())
+        .order_by(Dialog.created_at.desc())
+        .limit(1)
+        .cte("existing_dialog")
     )
-    db.add(client)
-    await db.flush()  # получить client.id
-
-    ident = ClientIdentity(
-        client_id=int(client.id),
-        resource_id=int(resource_id),
-        external_id=str(external_id),
-        kind=str(kind),
-        meta={},
+
+    new_dialog = (
+        pg_insert(Dialog)
+        .from_select(
+            ["company_id", "client_id", "meta"],
+            select(literal(int(company_id)), cl.c.client_id, literal(dialog_meta, JSONB)).where(
+                cl.c.client_id.is_not(None),
+                ~exists(select(existing_dialog.c.id)),
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=[Dialog.client_id], index_where=OPEN_DIALOG_PREDICATE)
+        .returning(Dialog.id)
+        .cte("new_dialog")
     )
-    db.add(ident)
-    await db.flush()
 
-    return client
+    return select(
+        cl.c.client_id,
+        select(existing_dialog.c.id).scalar_subquery(),
+        select(new_dialog.c.id).scalar_subquery(),
+    )
 
 
-async def _resolve_dialog(
+async def resolve_dialog_ref(
     db: AsyncSession,
     *,
     company_id: int,
-    client_id: int,
-) -> Dialog | None:
+    resource_id: int,
+    session_id: int | None,
+    kind: str,
+    external_id: str,
+    create: bool = True,
+    dialog_meta: dict[str, Any] | None = None,
+) -> DialogRef | None:
+    """
+    Клиент + открытый диалог: из DIALOG_REF_CACHE, иначе одним запросом (identity -> client -> dialog).
+    Если чего-то нет: create=True — создаём тем же запросом через INSERT ... ON CONFLICT (без commit),
+    create=False — None.
+    """
+    sid = _norm_session_id(session_id)
+    external_id = str(external_id)
+    cache_key = (int(company_id), int(resource_id), str(kind), external_id)
+
+    def _ref(client_id: int, dialog_id: int) -> DialogRef:
+        return DialogRef(
+            company_id=int(company_id),
+            resource_id=int(resource_id),
+            session_id=sid,
+            client_id=int(client_id),
+            dialog_id=int(dialog_id),
+            external_id=external_id,
+        )
+
+    cached = DIALOG_REF_CACHE.get(cache_key)
+    if cached is not None:
+        return _ref(*cached)
+
+    if create:
+        stmt = _upsert_dialog_ref_stmt(
+            company_id=company_id,
+            resource_id=resource_id,
+            kind=kind,
+            external_id=external_id,
+            dialog_meta=dialog_meta or {},
+        )
+        client_id, existing_dialog_id, new_dialog_id = (await db.execute(stmt)).one()
+        if client_id is None:
+            # код клиента уже занят: либо параллельный запрос только что создал этого же клиента
+            # (новый statement увидит его identity), либо строка чужая / выключенная — её не берём
+            client_id, existing_dialog_id, new_dialog_id = (await db.execute(stmt)).one()
+            if client_id is None:
+                raise RuntimeError(
+                    f"client code {_client_code(kind, resource_id, external_id)!r} is taken "
+                    f"by another or disabled client (company_id={int(company_id)})"
+                )
+        if existing_dialog_id:
+            DIALOG_REF_CACHE.set(cache_key, (int(client_id), int(existing_dialog_id)))
+            return _ref(client_id, existing_dialog_id)
+        if new_dialog_id:
+            return _ref(client_id, new_dialog_id)
+
+        # открытый диалог только что создал параллельный запрос — его строка уже видна новому statement
+        dialog_id = (
+            await db.execute(
+                select(Dialog.id)
+                .where(Dialog.client_id == int(client_id), _open_dialog_where())
+                .order_by(Dialog.created_at.desc())
+                .limit(1)
+            )
+        ).scalar_one()
+        return _ref(client_id, dialog_id)
+
     stmt = (
-        select(Dialog)
+        select(ClientIdentity.client_id, Dialog.id)
+        .select_from(ClientIdentity)
+        .join(Client, Client.id == ClientIdentity.client_id)
+        .join(
+            Dialog,
+            and_(
+                Dialog.client_id == Client.id,
+                Dialog.company_id == int(company_id),
+                _open_dialog_where(),
+            ),
+        )
         .where(
-            Dialog.company_id == int(company_id),
-            Dialog.client_id == int(client_id),
-            Dialog.status == "open",
-            Dialog.is_enabled.is_(True),
+            _identity_where(
+                company_id=company_id,
+                resource_id=resource_id,
+                kind=kind,
+                external_id=external_id,
+            )
         )
         .order_by(Dialog.created_at.desc())
         .limit(1)
     )
-    return (await db.execute(stmt)).scalar_one_or_none()
-
+    row = (await db.execute(stmt)).first()
+    if not row:
+        return None
 
-async def _resolve_or_create_dialog(
-    db: AsyncSession,
-    *,
-    company_id: int,
-    client_id: int,
-    dialog_meta: dict[str, Any] | None = None,
-) -> Dialog:
-    dialog = await _resolve_dialog(db, company_id=company_id, client_id=client_id)
-    if dialog:
-        return dialog
-
-    dialog = Dialog(
-        company_id=int(company_id),
-        client_id=int(client_id),
-        meta=dialog_meta or {},
-    )
-    db.add(dialog)
-    await db.flush()
-    return dialog
+    DIALOG_REF_CACHE.set(cache_key, (int(row[0]), int(row[1])))
+    return _ref(row[0], row[1])
 
 
-async def save_inbound(
+async def resolve_tg_dialog_ref(
     db: AsyncSession,
     *,
     company_id: int,
     resource_id: int,
     session_id: int | None,
     chat_id: int,
-    tg_message_id: int,
-    text: str,
-) -> Message:
-    """
-    Telegram -> система: сохраняем in/user.
-    Привязка: company (через dialog.company_id) + resource_id + session_id + chat_id (через client_identity external_id).
-    """
-    sid = _norm_session_id(session_id)
-    external_id = str(int(chat_id))
-    client = await _resolve_or_create_client(
+    create: bool = True,
+) -> DialogRef | None:
+    """Telegram: ключ (company_id, resource_id, chat_id), identity kind=tg."""
+    return await resolve_dialog_ref(
         db,
         company_id=company_id,
         resource_id=resource_id,
+        session_id=session_id,
         kind="tg",
-        external_id=external_id,
-        meta={"source": "tg"},
+        external_id=str(int(chat_id)),
+        create=create,
+        dialog_meta=_tg_dialog_meta(resource_id=resource_id, session_id=session_id, chat_id=chat_id),
     )
-    dialog = await _resolve_or_create_dialog(
-        db,
-        company_id=company_id,
-        client_id=int(client.id),
-        dialog_meta={"resource_id": int(resource_id), "chat_id": external_id, "session_id": sid},
+
+
+def _tg_dialog_meta(*, resource_id: int, session_id: int | None, chat_id: int) -> dict[str, Any]:
+    return {
+        "resource_id": int(resource_id),
+        "chat_id": str(int(chat_id)),
+        "session_id": _norm_session_id(session_id),
+    }
+
+
+def invalidate_dialog_refs(*, dialog_id: int | None = None, client_id: int | None = None) -> int:
+    """Убирает из DIALOG_REF_CACHE записи диалога / клиента в этом процессе. Возвращает число записей."""
+    if dialog_id is None and client_id is None:
+        return 0
+    return DIALOG_REF_CACHE.pop_where(
+        lambda _key, v: (dialog_id is not None and v[1] == int(dialog_id))
+        or (client_id is not None and v[0] == int(client_id))
+    )
+
+
+def _history_key(ref: DialogRef) -> tuple[int, int, int | None]:
+    # тот же ключ, что у истории в БД (см. _history_filter)
+    return ref.dialog_id, ref.resource_id, ref.session_id
+
+
+def _history_item(direction: str, text: str | None) -> tuple[str, str]:
+    return ("user" if direction == "in" else "assistant"), (text or "").strip()
+
+
+@event.listens_for(Session, "after_commit")
+def _history_after_commit(session: Session) -> None:
+    for key, (role, content) in session.info.pop(_HISTORY_PENDING, ()):
+        HISTORY_BUFFER.append(key, role, content)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _history_after_rollback(session: Session, previous_transaction) -> None:
+    # откат мог быть частичным (savepoint) — что из пачки закоммитится, неизвестно: такие диалоги читаем из БД заново
+    for key, _item in session.info.pop(_HISTORY_PENDING, ()):
+        HISTORY_BUFFER.pop(key)
+
+
+def invalidate_dialog_history(dialog_id: int) -> int:
+    """Убирает из HISTORY_BUFFER историю диалога в этом процессе. Возвращает число ключей."""
+    return HISTORY_BUFFER.pop_where(lambda key: key[0] == int(dialog_id))
+
+
+async def _notify_dialog_changed(db: AsyncSession, *, dialog_id: int, resource_id: int | None) -> None:
+    # другие процессы (воркер) сбросят свой кэш по уведомлению; без resource_id уведомление не разобрать
+    if resource_id:
+        await notify_config_changed(db, kind="dialog", resource_id=int(resource_id), dialog_id=int(dialog_id))
+
+
+async def clear_dialog(db: AsyncSession, ref: DialogRef, *, commit: bool = True) -> int:
+    """Мягко удаляет все сообщения диалога ref (история для модели начинается заново). Возвращает число строк."""
+    res = await db.execute(
+        update(Message)
+        .where(Message.dialog_id == ref.dialog_id, Message.is_deleted.is_(False))
+        .values(is_deleted=True)
+        .execution_options(synchronize_session=False)
     )
+    await _notify_dialog_changed(db, dialog_id=ref.dialog_id, resource_id=ref.resource_id)
+    if commit:
+        await db.commit()
+    invalidate_dialog_refs(dialog_id=ref.dialog_id)
+    invalidate_dialog_history(ref.dialog_id)
+    # res.rowcount может быть None в некоторых режимах — приводим к int безопасно
+    return int(res.rowcount or 0)
 
+
+async def save_message(
+    db: AsyncSession,
+    ref: DialogRef,
+    *,
+    direction: str,
+    text: str | None,
+    meta: dict[str, Any] | None = None,
+    commit: bool = True,
+) -> Message:
+    """
+    Сообщение в диалог ref (in/out) с resource_id/session_id из ref.
+    В HISTORY_BUFFER попадает после COMMIT (при commit=False — после commit вызывающего, при rollback — нет).
+    """
     msg = Message(
-        dialog_id=int(dialog.id),
-        direction="in",
-        text=(text or "").strip(),
-        resource_id=int(resource_id),
-        session_id=sid,
-        meta={"chat_id": external_id, "tg_message_id": int(tg_message_id)},
+        dialog_id=ref.dialog_id,
+        direction=str(direction),
+        text=text,
+        resource_id=ref.resource_id,
+        session_id=ref.session_id,
+        meta=meta or {},
     )
     db.add(msg)
-    await db.commit()
+    db.info.setdefault(_HISTORY_PENDING, []).append((_history_key(ref), _history_item(direction, text)))
+    if commit:
+        await db.commit()
     return msg
 
 
-async def save_outbound(
+async def save_inbound(
     db: AsyncSession,
+    ref: DialogRef,
     *,
-    company_id: int,
-    resource_id: int,
-    session_id: int | None,
-    chat_id: int,
+    tg_message_id: int,
     text: str,
-    tg_message_id: int | None = None,
+    merged_tg_message_ids: list[int] | None = None,
+    commit: bool = True,
 ) -> Message:
     """
-    система -> Telegram: сохраняем out/assistant.
+    Telegram -> система: сохраняем in/user в диалог ref.
+    merged_tg_message_ids — более ранние сообщения, склеенные очередью в это (meta.tg_message_ids — все id).
+    commit=False — только добавляем в сессию (несколько сообщений уйдут одним INSERT при commit/flush).
     """
-    sid = _norm_session_id(session_id)
-    external_id = str(int(chat_id))
-
-    client = await _resolve_or_create_client(
+    meta: dict[str, Any] = {"chat_id": ref.external_id, "tg_message_id": int(tg_message_id)}
+    if merged_tg_message_ids:
+        meta["tg_message_ids"] = [*(int(x) for x in merged_tg_message_ids), int(tg_message_id)]
+    return await save_message(
         db,
-        company_id=company_id,
-        resource_id=resource_id,
-        kind="tg",
-        external_id=external_id,
-        meta={"source": "tg"},
+        ref,
+        direction="in",
+        text=(text or "").strip(),
+        meta=meta,
+        commit=commit,
     )
-    dialog = await _resolve_or_create_dialog(
-        db,
-        company_id=company_id,
-        client_id=int(client.id),
-        dialog_meta={"resource_id": int(resource_id), "chat_id": external_id, "session_id": sid},
+
+
+async def write_message(
+    ref: DialogRef,
+    *,
+    direction: str,
+    text: str | None,
+    meta: dict[str, Any] | None = None,
+    wait: bool | None = None,
+) -> int | None:
+    """
+    То же, что save_message, но через общий BatchWriter: строки разных вызовов уходят одним INSERT ... RETURNING.
+    wait=True — id после COMMIT; wait=False — None сразу (fire-and-forget); None — BATCH_WRITER_WAIT.
+    Диалог ref должен быть уже закоммичен.
+    """
+    row = {
+        "dialog_id": ref.dialog_id,
+        "direction": str(direction),
+        "text": text,
+        "resource_id": ref.resource_id,
+        "session_id": ref.session_id,
+        "meta": meta or {},
+    }
+    key, item = _history_key(ref), _history_item(direction, text)
+    # в буфер — только после COMMIT строки (как after_commit у save_message); для wait=False — тоже
+    return await get_writer().add(
+        Message,
+        row,
+        wait=wait,
+        on_written=lambda _id: HISTORY_BUFFER.append(key, *item),
     )
 
-    meta = {"chat_id": external_id}
+
+async def write_outbound(
+    ref: DialogRef,
+    *,
+    text: str,
+    tg_message_id: int | None = None,
+    wait: bool | None = None,
+) -> int | None:
+    """
+    система -> Telegram: сохраняем out/assistant в диалог ref (через BatchWriter).
+    """
+    meta = {"chat_id": ref.external_id}
     if tg_message_id:
         meta["tg_message_id"] = int(tg_message_id)
 
-    msg = Message(
-        dialog_id=int(dialog.id),
-        direction="out",
-        text=(text or "").strip(),
-        resource_id=int(resource_id),
-        session_id=sid,
-        meta=meta,
+    return await write_message(ref, direction="out", text=(text or "").strip(), meta=meta, wait=wait)
+
+
+def _history_filter(stmt, *, dialog_id, resource_id: int, session_id: int | None, exclude_message_ids=None):
+    """
+    Условия истории под индекс ix_messages_history:
+    (dialog_id, resource_id, session_id, created_at DESC, id DESC) WHERE is_deleted = false.
+    """
+    stmt = stmt.where(
+        Message.dialog_id == dialog_id,
+        # именно "= false" (а не IS false) — так Postgres сопоставляет условие с предикатом частичного индекса
+        Message.is_deleted == false(),
+        Message.resource_id == int(resource_id),
     )
-    db.add(msg)
-    await db.commit()
-    return msg
+    if session_id is None:
+        stmt = stmt.where(Message.session_id.is_(None))
+    else:
+        stmt = stmt.where(Message.session_id == int(session_id))
+
+    exclude = [int(x) for x in (exclude_message_ids or []) if x]
+    if exclude:
+        stmt = stmt.where(Message.id.not_in(exclude))
+
+    return stmt.order_by(Message.created_at.desc(), Message.id.desc())
 
 
 async def load_history(
     db: AsyncSession,
+    ref: DialogRef,
     *,
-    company_id: int,
-    resource_id: int,
-    session_id: int | None,
-    chat_id: int,
     limit_messages: int,
-    exclude_message_id: int | None = None,
+    exclude_message_ids: list[int] | None = None,
 ) -> list[Message]:
     """
-    Возвращает последние сообщения (in/out) по ключу (company_id, resource_id, session_id, chat_id).
+    Возвращает последние сообщения (in/out) диалога ref по ключу (resource_id, session_id).
     Сортировка: по возрастанию времени (готово для OpenAI).
     """
     if not limit_messages or limit_messages <= 0:
         return []
 
+    stmt = _history_filter(
+        select(Message),
+        dialog_id=ref.dialog_id,
+        resource_id=ref.resource_id,
+        session_id=ref.session_id,
+        exclude_message_ids=exclude_message_ids,
+    ).limit(int(limit_messages))
+
+    msgs = (await db.execute(stmt)).scalars().all()
+    msgs.reverse()  # asc
+    return msgs
+
+
+async def list_messages_page(
+    db: AsyncSession,
+    *,
+    dialog_id: int,
+    limit: int,
+    cursor: str | None = None,
+) -> tuple[list[Message], str | None]:
+    """
+    Неудалённые сообщения диалога от новых к старым, keyset по (created_at, id) (ix_messages_dialog_created):
+    следующая страница — более старые. Возвращает (сообщения, курсор следующей страницы или None).
+    Битый cursor -> ValueError.
+    """
+    stmt = select(Message).where(Message.dialog_id == int(dialog_id), Message.is_deleted == false())
+    stmt = keyset_desc(stmt, Message.created_at, Message.id, cursor=cursor, limit=limit)
+    msgs = (await db.execute(stmt)).scalars().all()
+    return page_result(list(msgs), limit, lambda m: (m.created_at, m.id))
+
+
+def _history_by_identity_stmt(
+    *,
+    company_id: int,
+    resource_id: int,
+    session_id: int | None,
+    kind: str,
+    external_id: str,
+    limit_messages: int,
+):
+    """
+    identity -> client -> открытый dialog -> последние limit_messages сообщений одним statement.
+    LEFT JOIN LATERAL: диалог без сообщений даёт одну строку с пустым сообщением (ids всё равно нужны).
+    Колонки: client_id, dialog_id, Message | None (по убыванию времени).
+    """
+    d = (
+        select(ClientIdentity.client_id.label("client_id"), Dialog.id.label("dialog_id"))
+        .join(Client, Client.id == ClientIdentity.client_id)
+        .join(
+            Dialog,
+            and_(
+                Dialog.client_id == Client.id,
+                Dialog.company_id == int(company_id),
+                _open_dialog_where(),
+            ),
+        )
+        .where(
+            _identity_where(
+                company_id=company_id,
+                resource_id=resource_id,
+                kind=kind,
+                external_id=external_id,
+            )
+        )
+        .order_by(Dialog.created_at.desc())
+        .limit(1)
+        .cte("d")
+    )
+
+    # без deferred-колонок (text_tsv): в подзапрос select(Message) отдал бы все колонки таблицы
+    columns = [c for c in Message.__table__.c if c.name != "text_tsv"]
+    hist = (
+        _history_filter(
+            select(*columns),
+            dialog_id=d.c.dialog_id,
+            resource_id=resource_id,
+            session_id=session_id,
+        )
+        .limit(max(0, int(limit_messages)))
+        .lateral("hist")
+    )
+    m = aliased(Message, hist)
+
+    return select(d.c.client_id, d.c.dialog_id, m).select_from(d).outerjoin(hist, true())
+
+
+async def load_dialog_history(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    resource_id: int,
+    session_id: int | None,
+    kind: str,
+    external_id: str,
+    limit_messages: int,
+    create: bool = True,
+    dialog_meta: dict[str, Any] | None = None,
+) -> tuple[DialogRef | None, list[Message]]:
+    """
+    resolve_dialog_ref + load_history за один запрос в обычном случае:
+    - привязка в DIALOG_REF_CACHE -> только load_history;
+    - иначе identity -> dialog -> messages одним statement (и привязка кладётся в кэш);
+    - открытого диалога нет -> resolve_dialog_ref (create) и пустая история.
+    """
     sid = _norm_session_id(session_id)
-    external_id = str(int(chat_id))
+    external_id = str(external_id)
+    cache_key = (int(company_id), int(resource_id), str(kind), external_id)
+
+    if DIALOG_REF_CACHE.get(cache_key) is not None:
+        ref = await resolve_dialog_ref(
+            db,
+            company_id=company_id,
+            resource_id=resource_id,
+            session_id=sid,
+            kind=kind,
+            external_id=external_id,
+            create=False,
+        )
+        # None — запись кэша истекла между двумя чтениями и диалога нет: дальше обычный путь
+        if ref is not None:
+            return ref, await load_history(db, ref, limit_messages=limit_messages)
+
+    rows = (
+        await db.execute(
+            _history_by_identity_stmt(
+                company_id=company_id,
+                resource_id=resource_id,
+                session_id=sid,
+                kind=kind,
+                external_id=external_id,
+                limit_messages=limit_messages,
+            )
+        )
+    ).all()
+
+    if rows:
+        client_id, dialog_id = int(rows[0][0]), int(rows[0][1])
+        DIALOG_REF_CACHE.set(cache_key, (client_id, dialog_id))
+        ref = DialogRef(
+            company_id=int(company_id),
+            resource_id=int(resource_id),
+            session_id=sid,
+            client_id=client_id,
+            dialog_id=dialog_id,
+            external_id=external_id,
+        )
+        msgs = [r[2] for r in rows if r[2] is not None]
+        msgs.reverse()  # asc
+        return ref, msgs
+
+    if not create:
+        return None, []
 
-    client = await _resolve_client(
+    ref = await resolve_dialog_ref(
         db,
         company_id=company_id,
         resource_id=resource_id,
-        kind="tg",
+        session_id=sid,
+        kind=kind,
         external_id=external_id,
+        create=True,
+        dialog_meta=dialog_meta,
     )
-    if not client:
-        return []
+    return ref, []
 
-    dialog = await _resolve_dialog(db, company_id=company_id, client_id=int(client.id))
-    if not dialog:
-        return []
 
-    stmt = (
-        select(Message)
-        .where(
-            Message.dialog_id == int(dialog.id),
-            Message.is_deleted.is_(False),
-            Message.resource_id == int(resource_id),
+async def load_recent_history(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    resource_id: int,
+    session_id: int | None,
+    kind: str,
+    external_id: str,
+    limit_messages: int,
+    dialog_meta: dict[str, Any] | None = None,
+) -> tuple[DialogRef, list[dict[str, str]]]:
+    """
+    Привязка + последние limit_messages сообщений как {role, content} (по возрастанию времени) для модели:
+    - привязка в DIALOG_REF_CACHE и история в HISTORY_BUFFER -> без обращения к БД;
+    - иначе load_dialog_history (обычно один запрос), результатом прогревается HISTORY_BUFFER.
+    Недостающие client/dialog создаются (без commit).
+    """
+    sid = _norm_session_id(session_id)
+    external_id = str(external_id)
+
+    if DIALOG_REF_CACHE.get((int(company_id), int(resource_id), str(kind), external_id)) is not None:
+        ref = await resolve_dialog_ref(
+            db,
+            company_id=company_id,
+            resource_id=resource_id,
+            session_id=sid,
+            kind=kind,
+            external_id=external_id,
+            create=False,
         )
-        .order_by(Message.created_at.desc(), Message.id.desc())
-        .limit(int(limit_messages))
-    )
+        if ref is not None:
+            items = HISTORY_BUFFER.get(_history_key(ref), limit_messages)
+            if items is not None:
+                return ref, items
 
-    if sid is None:
-        stmt = stmt.where(Message.session_id.is_(None))
-    else:
-        stmt = stmt.where(Message.session_id == sid)
+    ref, msgs = await load_dialog_history(
+        db,
+        company_id=company_id,
+        resource_id=resource_id,
+        session_id=sid,
+        kind=kind,
+        external_id=external_id,
+        limit_messages=limit_messages,
+        dialog_meta=dialog_meta,
+    )
+    assert ref is not None  # create=True
+    items = [_history_item(m.direction, m.text) for m in msgs]
+    HISTORY_BUFFER.warm(_history_key(ref), items, limit_messages)
+    return ref, [{"role": role, "content": content} for role, content in items]
 
-    if exclude_message_id:
-        stmt = stmt.where(Message.id != int(exclude_message_id))
 
-    msgs = (await db.execute(stmt)).scalars().all()
-    msgs.reverse()  # asc
-    return msgs
+async def load_tg_recent_history(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    resource_id: int,
+    session_id: int | None,
+    chat_id: int,
+    limit_messages: int,
+) -> tuple[DialogRef, list[dict[str, str]]]:
+    """Telegram: load_recent_history по chat_id (identity kind=tg), недостающее создаётся."""
+    return await load_recent_history(
+        db,
+        company_id=company_id,
+        resource_id=resource_id,
+        session_id=session_id,
+        kind="tg",
+        external_id=str(int(chat_id)),
+        limit_messages=limit_messages,
+        dialog_meta=_tg_dialog_meta(resource_id=resource_id, session_id=session_id, chat_id=chat_id),
+    )
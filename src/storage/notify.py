@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Callable
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.storage.db import build_db_url
+
+# канал, через который UI сообщает воркеру об изменении настроек ресурсов/сессий
+CONFIG_CHANNEL = "cargochats_config"
+
+
+async def notify_config_changed(
+    db: AsyncSession,
+    *,
+    kind: str,
+    resource_id: int,
+    session_id: int | None = None,
+    dialog_id: int | None = None,
+) -> None:
+    """
+    Ставит pg_notify в текущую транзакцию.
+    Postgres доставит уведомление только после COMMIT (при rollback — не доставит),
+    поэтому вызывать нужно ДО db.commit().
+    """
+    payload: dict[str, Any] = {"kind": str(kind), "resource_id": int(resource_id)}
+    if session_id:
+        payload["session_id"] = int(session_id)
+    if dialog_id:
+        payload["dialog_id"] = int(dialog_id)
+
+    await db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CONFIG_CHANNEL, "payload": json.dumps(payload)},
+    )
+
+
+def parse_config_payload(raw: str) -> dict[str, Any] | None:
+    try:
+        data = json.loads(raw or "")
+    except Exception:
+        return None
+    if not isinstance(data, dict):
+        return None
+    try:
+        data["resource_id"] = int(data.get("resource_id") or 0)
+    except Exception:
+        return None
+    if not data["resource_id"]:
+        return None
+    return data
+
+
+async def listen(channel: str, callback: Callable[[str], None]) -> asyncpg.Connection:
+    """
+    Отдельное (не из пула SQLAlchemy) asyncpg-соединение под LISTEN.
+    callback получает payload уведомления. Соединение закрывает вызывающий.
+    """
+    dsn = build_db_url().replace("postgresql+asyncpg://", "postgresql://", 1)
+    conn = await asyncpg.connect(dsn)
+
+    def _on_notify(_conn, _pid, _channel, payload: str) -> None:
+        callback(payload)
+
+    await conn.add_listener(channel, _on_notify)
+    return conn
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import base64
+import math
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _pack(head: str, row_id: int) -> str:
+    raw = f"{head}|{int(row_id)}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _unpack(cursor: str) -> tuple[str, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        head, id_raw = base64.urlsafe_b64decode(padded.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return head, int(id_raw)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+
+def encode_cursor(ts: datetime, row_id: int) -> str:
+    """Позиция последней строки страницы (ts, id) -> непрозрачная строка для ?cursor=."""
+    return _pack(ts.isoformat(), row_id)
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Обратное к encode_cursor. Битый курсор -> ValueError (в API — 400)."""
+    head, row_id = _unpack(cursor)
+    try:
+        ts = datetime.fromisoformat(head)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if ts.tzinfo is None:
+        raise ValueError("invalid cursor")
+    return ts, row_id
+
+
+def encode_rank_cursor(rank: float, row_id: int) -> str:
+    """То же для выдачи по релевантности: (rank, id). repr — точное значение, без потерь при обратном чтении."""
+    return _pack(repr(float(rank)), row_id)
+
+
+def decode_rank_cursor(cursor: str) -> tuple[float, int]:
+    head, row_id = _unpack(cursor)
+    try:
+        rank = float(head)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not math.isfinite(rank):
+        raise ValueError("invalid cursor")
+    return rank, row_id
+
+
+def keyset_desc(stmt, ts_col, id_col, *, cursor: str | None, limit: int):
+    """
+    Страница по убыванию (ts_col, id_col), начиная после cursor.
+    Сравнение строк (ts, id) < (:ts, :id) Postgres ведёт по индексу (..., ts DESC, id DESC) —
+    стоимость O(страница) на любой глубине, в отличие от OFFSET.
+    Берётся limit + 1 строк: лишняя означает, что есть следующая страница (см. page_result).
+    """
+    if cursor:
+        ts, row_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(ts_col, id_col) < tuple_(ts, row_id))
+    return stmt.order_by(ts_col.desc(), id_col.desc()).limit(int(limit) + 1)
+
+
+def page_result(rows: list, limit: int, key) -> tuple[list, str | None]:
+    """rows из keyset_desc -> (строки страницы, курсор следующей или None). key(row) -> (ts, id)."""
+    if len(rows) <= int(limit):
+        return rows, None
+    rows = rows[: int(limit)]
+    return rows, encode_cursor(*key(rows[-1]))
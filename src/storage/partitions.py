@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# секционированы помесячно по created_at (миграция 0005)
+PARTITIONED_TABLES = ("messages", "events")
+
+PARTITIONS_AHEAD_MONTHS = int(os.getenv("PARTITIONS_AHEAD_MONTHS", "3"))
+# срок хранения для компаний без companies.retention_months; 0 — хранить всё
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "0"))
+# DDL над секциями берёт ACCESS EXCLUSIVE на родителя — не ждём его дольше этого
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+
+def month_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(dt: datetime, n: int) -> datetime:
+    y, m = divmod(dt.year * 12 + dt.month - 1 + int(n), 12)
+    return datetime(y, m + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+@dataclass(frozen=True)
+class Partition:
+    name: str
+    lower: datetime  # включительно
+    upper: datetime  # не включительно
+
+
+def _check_table(table: str) -> str:
+    # имена идут в DDL как есть — только известные таблицы
+    if table not in PARTITIONED_TABLES:
+        raise ValueError(f"table {table!r} is not partitioned")
+    return table
+
+
+async def list_partitions(conn: AsyncConnection, table: str) -> list[Partition]:
+    """Помесячные секции table по возрастанию (DEFAULT и чужие секции не входят)."""
+    table = _check_table(table)
+    pattern = re.compile(rf"^{table}_p(\d{{4}})_(\d{{2}})$")
+    names = (
+        await conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = CAST(:t AS regclass)"
+            ),
+            {"t": table},
+        )
+    ).scalars().all()
+
+    out: list[Partition] = []
+    for name in names:
+        m = pattern.match(name)
+        if m:
+            lower = datetime(int(m.group(1)), int(m.group(2)), 1, tzinfo=timezone.utc)
+            out.append(Partition(name=name, lower=lower, upper=add_months(lower, 1)))
+    return sorted(out, key=lambda p: p.lower)
+
+
+async def insertable_columns(conn: AsyncConnection, table: str) -> list[str]:
+    """
+    Колонки table, в которые можно писать явно: без GENERATED ... STORED (messages.text_tsv, миграция 0007) —
+    Postgres отказывает в INSERT с явным значением такой колонки, её пересчитает сам.
+    """
+    table = _check_table(table)
+    return list(
+        (
+            await conn.execute(
+                text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :t AND is_generated = 'NEVER' "
+                    "ORDER BY ordinal_position"
+                ),
+                {"t": table},
+            )
+        ).scalars().all()
+    )
+
+
+def move_rows_sql(table: str, source: str, columns: list[str]) -> str:
+    """INSERT строк месяца из source (отсоединённой DEFAULT-секции) обратно в table — явным списком колонок."""
+    table = _check_table(table)
+    if not columns:
+        raise ValueError(f"no insertable columns for {table!r}")
+    cols = ", ".join(f'"{c}"' for c in columns)
+    return (
+        f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {source} "
+        "WHERE created_at >= :lo AND created_at < :hi"
+    )
+
+
+async def ensure_partitions(
+    conn: AsyncConnection,
+    table: str,
+    *,
+    months_ahead: int = PARTITIONS_AHEAD_MONTHS,
+    now: datetime | None = None,
+    dry_run: bool = False,
+) -> list[str]:
+    """
+    Создаёт недостающие секции с текущего месяца на months_ahead вперёд.
+    Если обслуживание пропускали и строки месяца уже легли в DEFAULT-секцию —
+    DEFAULT на время переноса отсоединяется (иначе Postgres не даст создать пересекающуюся секцию).
+    """
+    table = _check_table(table)
+    existing = {p.name for p in await list_partitions(conn, table)}
+    default = f"{table}_default"
+    month = month_start(now or datetime.now(timezone.utc))
+    created: list[str] = []
+
+    for _ in range(max(0, int(months_ahead)) + 1):
+        name = partition_name(table, month)
+        upper = add_months(month, 1)
+        if name not in existing:
+            created.append(name)
+            if not dry_run:
+                bounds = {"lo": month, "hi": upper}
+                stray = (
+                    await conn.execute(
+                        text(
+                            f"SELECT EXISTS (SELECT 1 FROM {default} "
+                            "WHERE created_at >= :lo AND created_at < :hi)"
+                        ),
+                        bounds,
+                    )
+                ).scalar()
+
+                if stray:
+                    await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+                await conn.execute(
+                    text(
+                        f"CREATE TABLE {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+                    )
+                )
+                if stray:
+                    columns = await insertable_columns(conn, table)
+                    await conn.execute(text(move_rows_sql(table, default, columns)), bounds)
+                    await conn.execute(
+                        text(f"DELETE FROM {default} WHERE created_at >= :lo AND created_at < :hi"), bounds
+                    )
+                    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+        month = upper
+    return created
+
+
+async def retention_cutoffs(
+    conn: AsyncConnection,
+    *,
+    default_months: int = MESSAGES_RETENTION_MONTHS,
+    now: datetime | None = None,
+) -> dict[int, datetime | None]:
+    """
+    company_id -> граница хранения (всё, что раньше, можно удалять); None — хранить всё.
+    Граница выровнена по месяцу: секции удаляются целиком.
+    """
+    current = month_start(now or datetime.now(timezone.utc))
+    rows = (await conn.execute(text("SELECT id, retention_months FROM companies"))).all()
+
+    out: dict[int, datetime | None] = {}
+    for company_id, months in rows:
+        months = int(months) if months is not None else int(default_months)
+        out[int(company_id)] = add_months(current, -months) if months > 0 else None
+    return out
+
+
+def table_cutoff(cutoffs: dict[int, datetime | None]) -> datetime | None:
+    """
+    Секция общая для всех компаний, поэтому удалить её можно, только когда она
+    вышла за срок хранения у каждой компании: граница — самая ранняя из всех.
+    """
+    if not cutoffs or any(c is None for c in cutoffs.values()):
+        return None
+    return min(c for c in cutoffs.values() if c is not None)
+
+
+async def drop_expired_partitions(
+    conn: AsyncConnection,
+    table: str,
+    *,
+    cutoff: datetime | None,
+    detach: bool = False,
+    dry_run: bool = False,
+) -> list[str]:
+    """
+    Удаляет (DROP) или отсоединяет (DETACH — таблица остаётся для выгрузки в архив)
+    секции, целиком лежащие раньше cutoff. Без DELETE: освобождение места — O(1).
+    """
+    table = _check_table(table)
+    if cutoff is None:
+        return []
+
+    expired = [p for p in await list_partitions(conn, table) if p.upper <= cutoff]
+    if not dry_run:
+        for p in expired:
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {p.name}"))
+            if not detach:
+                await conn.execute(text(f"DROP TABLE {p.name}"))
+    return [p.name for p in expired]
+
+
+async def purge_company_rows(
+    conn: AsyncConnection,
+    table: str,
+    *,
+    company_id: int,
+    cutoff: datetime | None,
+    dry_run: bool = False,
+) -> int:
+    """
+    Компания с более коротким сроком, чем у соседей по секции: её строки из секций,
+    которые ещё нельзя удалить целиком, чистятся DELETE по одной секции
+    (обращение к секции напрямую — без просмотра всей таблицы). Только по явному --purge.
+    """
+    table = _check_table(table)
+    if cutoff is None:
+        return 0
+
+    if table == "events":
+        where = "company_id = :company_id"
+    else:
+        where = "dialog_id IN (SELECT id FROM dialogs WHERE company_id = :company_id)"
+
+    total = 0
+    for p in await list_partitions(conn, table):
+        if p.upper > cutoff:
+            break
+        if dry_run:
+            sql = f"SELECT count(*) FROM {p.name} WHERE {where}"
+            total += int((await conn.execute(text(sql), {"company_id": int(company_id)})).scalar() or 0)
+        else:
+            res = await conn.execute(text(f"DELETE FROM {p.name} WHERE {where}"), {"company_id": int(company_id)})
+            total += int(res.rowcount or 0)
+    return total
+
+
+async def set_lock_timeout(conn: AsyncConnection) -> None:
+    await conn.execute(text("SELECT set_config('lock_timeout', :v, true)"), {"v": PARTITION_LOCK_TIMEOUT})
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import html
+from datetime import datetime
+from typing import Any
+
+from sqlalchemy import cast, false, func, literal_column, select, tuple_
+from sqlalchemy.dialects.postgresql import REAL, TSQUERY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.dialog import Dialog
+from src.models.message import Message
+from src.storage.pagination import decode_rank_cursor, encode_rank_cursor
+
+# те же конфигурации, что в messages.text_tsv (миграция 0007)
+RU = literal_column("'russian'::regconfig")
+EN = literal_column("'english'::regconfig")
+
+# маркеры подсветки из ts_headline: символы private use, в тексте сообщений их не бывает;
+# после html.escape заменяются на <mark> (сам ts_headline HTML не экранирует)
+_MARK_START = "\ue000"
+_MARK_STOP = "\ue001"
+HEADLINE_OPTIONS = (
+    f'StartSel="{_MARK_START}", StopSel="{_MARK_STOP}", '
+    'MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "'
+)
+
+MAX_QUERY_CHARS = 200
+
+
+def tsquery(query: str):
+    """Запрос пользователя (синтаксис websearch: "фраза", -исключить, or) по обеим конфигурациям."""
+    return func.websearch_to_tsquery(RU, query).op("||", return_type=TSQUERY)(func.websearch_to_tsquery(EN, query))
+
+
+def snippet_html(raw: str | None) -> str:
+    return html.escape(raw or "").replace(_MARK_START, "<mark>").replace(_MARK_STOP, "</mark>")
+
+
+def search_messages_stmt(
+    *,
+    company_id: int,
+    query: str,
+    limit: int,
+    cursor: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+):
+    """
+    Поиск по неудалённым сообщениям компании, по убыванию (rank, id):
+    - кандидаты — Bitmap Index Scan по ix_messages_text_tsv (GIN), компания — через dialogs;
+    - since/until отсекают месячные секции messages (partition pruning) — на больших объёмах это главный рычаг;
+    - rank (ts_rank_cd) считается для всех совпадений, keyset (rank, id) < (:rank, :id) режет уже отданное;
+    - ts_headline (дорогой: разбирает текст заново) — только для строк страницы.
+    Берётся limit + 1 строк: лишняя означает, что есть следующая страница. Битый cursor -> ValueError.
+    """
+    q = tsquery(query)
+    matches = (
+        select(
+            Message.id,
+            Message.dialog_id,
+            Dialog.client_id,
+            Message.direction,
+            Message.text,
+            Message.created_at,
+            func.ts_rank_cd(Message.text_tsv, q).label("rank"),
+        )
+        .join(Dialog, Dialog.id == Message.dialog_id)
+        .where(
+            Dialog.company_id == int(company_id),
+            Message.is_deleted == false(),
+            Message.text_tsv.op("@@")(q),
+        )
+    )
+    if since is not None:
+        matches = matches.where(Message.created_at >= since)
+    if until is not None:
+        matches = matches.where(Message.created_at < until)
+    m = matches.subquery("m")
+
+    page = select(m)
+    if cursor:
+        rank, row_id = decode_rank_cursor(cursor)
+        # rank — real (float4): сравниваем в том же типе, иначе строка на границе страницы повторится
+        page = page.where(tuple_(m.c.rank, m.c.id) < tuple_(cast(rank, REAL), row_id))
+    page = page.order_by(m.c.rank.desc(), m.c.id.desc()).limit(int(limit) + 1).subquery("page")
+
+    return select(
+        page.c.id,
+        page.c.dialog_id,
+        page.c.client_id,
+        page.c.direction,
+        page.c.created_at,
+        page.c.rank,
+        func.ts_headline(RU, page.c.text, q, HEADLINE_OPTIONS).label("snippet"),
+    ).order_by(page.c.rank.desc(), page.c.id.desc())
+
+
+async def search_messages(
+    db: AsyncSession,
+    *,
+    company_id: int,
+    query: str,
+    limit: int,
+    cursor: str | None = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+) -> tuple[list[dict[str, Any]], str | None]:
+    """Найденные сообщения (с подсвеченным фрагментом) + курсор следующей страницы или None."""
+    query = (query or "").strip()[:MAX_QUERY_CHARS]
+    if not query:
+        return [], None
+
+    stmt = search_messages_stmt(
+        company_id=company_id, query=query, limit=limit, cursor=cursor, since=since, until=until
+    )
+    rows = (await db.execute(stmt)).all()
+
+    next_cursor = None
+    if len(rows) > int(limit):
+        rows = rows[: int(limit)]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].id)
+
+    items = [
+        {
+            "message_id": int(r.id),
+            "dialog_id": int(r.dialog_id),
+            "client_id": int(r.client_id),
+            "direction": r.direction,
+            "created_at": r.created_at,
+            "rank": float(r.rank),
+            "snippet_html": snippet_html(r.snippet),
+        }
+        for r in rows
+    ]
+    return items, next_cursor
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import Counter
+from typing import Any, Callable
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from src.storage.db import get_sessionmaker
+
+# по умолчанию вызывающий ждёт COMMIT своей строки; 0 — fire-and-forget (строка может потеряться при падении процесса)
+WRITER_WAIT = (os.getenv("BATCH_WRITER_WAIT") or "1").strip().lower() not in ("0", "false", "no")
+WRITER_DELAY_MS = float(os.getenv("BATCH_WRITER_DELAY_MS", "5"))
+WRITER_MAX_BATCH = int(os.getenv("BATCH_WRITER_MAX_BATCH", "500"))
+
+
+def _is_row_error(e: BaseException) -> bool:
+    """Ошибка из-за данных конкретной строки (а не соединения / БД целиком)."""
+    return isinstance(e, (IntegrityError, DataError))
+
+
+class BatchWriter:
+    """
+    Копит INSERT'ы (messages / events / ...) delay_ms миллисекунд (или до max_batch строк)
+    и пишет их multi-row INSERT ... RETURNING id одной транзакцией.
+    - add(..., wait=True): вернёт id строки после COMMIT, ошибка INSERT/COMMIT — исключение вызывающему;
+    - add(..., wait=False): вернёт None сразу, ошибка только логируется;
+    - on_written(id): вызывается после COMMIT строки (и только если она записана).
+    Если транзакцию сорвала одна строка (IntegrityError / DataError), пачка пишется заново частями
+    (делением пополам) — ошибку получают только вызывающие с плохими строками.
+    Строки могут ссылаться только на уже закоммиченные client/dialog: пишет отдельная сессия.
+    """
+
+    def __init__(self, *, delay_ms: float = 5.0, max_batch: int = 500) -> None:
+        self.delay_sec = max(0.0, float(delay_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self.counters: Counter[str] = Counter()
+
+        # модель -> [(row, future)]; порядок моделей = порядок первой записи (messages раньше events)
+        self._pending: dict[Any, list[tuple[dict, asyncio.Future]]] = {}
+        self._size = 0
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def add(
+        self,
+        model: Any,
+        row: dict[str, Any],
+        *,
+        wait: bool | None = None,
+        on_written: Callable[[int], None] | None = None,
+    ) -> int | None:
+        wait = WRITER_WAIT if wait is None else bool(wait)
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        if on_written is not None:
+            fut.add_done_callback(
+                lambda f: on_written(f.result()) if not f.cancelled() and f.exception() is None else None
+            )
+        self._pending.setdefault(model, []).append((dict(row), fut))
+        self._size += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self._size >= self.max_batch:
+            self._full.set()
+
+        if wait:
+            return await asyncio.shield(fut)
+        fut.add_done_callback(self._log_dropped)
+        return None
+
+    def _log_dropped(self, fut: asyncio.Future) -> None:
+        if fut.cancelled():
+            return
+        e = fut.exception()
+        if e is not None:
+            print(f"[writer] fire-and-forget row lost: {e.__class__.__name__}: {e}")
+
+    async def _run(self) -> None:
+        while self._pending:
+            if self._size < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.delay_sec)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            await self._flush_once()
+
+    async def _flush_once(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._size = 0
+        if not pending:
+            return
+
+        chunks: list[tuple[Any, list[tuple[dict, asyncio.Future]]]] = []
+        for model, items in pending.items():
+            # executemany требует одинаковый набор колонок в пачке
+            groups: dict[tuple[str, ...], list[tuple[dict, asyncio.Future]]] = {}
+            for row, fut in items:
+                groups.setdefault(tuple(sorted(row)), []).append((row, fut))
+            for group in groups.values():
+                for i in range(0, len(group), self.max_batch):
+                    chunks.append((model, group[i : i + self.max_batch]))
+
+        total = sum(len(chunk) for _, chunk in chunks)
+        try:
+            results = await self._write(chunks)
+        except Exception as e:
+            self.counters["failed_flushes"] += 1
+            print(f"[writer] flush error ({total} rows): {e.__class__.__name__}: {e}")
+            if not _is_row_error(e):
+                # БД недоступна и т.п. — делить пачку бессмысленно
+                self._fail([f for _, chunk in chunks for _, f in chunk], e)
+                return
+            # ошибка одной строки (FK на удалённый диалог, битые данные): пишем пачку частями,
+            # чтобы исключение получили только её вызывающие
+            results = []
+            for model, chunk in chunks:
+                results.extend(await self._write_isolated(model, chunk))
+        else:
+            self.counters["flushes"] += 1
+
+        self.counters["rows"] += len(results)
+        for fut, row_id in results:
+            if not fut.done():
+                fut.set_result(row_id)
+
+    async def _write(
+        self, chunks: list[tuple[Any, list[tuple[dict, asyncio.Future]]]]
+    ) -> list[tuple[asyncio.Future, int]]:
+        """Все пачки одной транзакцией: [(future, id)] после COMMIT."""
+        results: list[tuple[asyncio.Future, int]] = []
+        async with get_sessionmaker()() as db:
+            for model, chunk in chunks:
+                ids = (
+                    await db.execute(
+                        insert(model).returning(model.id, sort_by_parameter_order=True),
+                        [row for row, _ in chunk],
+                    )
+                ).scalars().all()
+                results.extend((fut, int(x)) for (_, fut), x in zip(chunk, ids))
+            await db.commit()
+        return results
+
+    async def _write_isolated(
+        self, model: Any, chunk: list[tuple[dict, asyncio.Future]]
+    ) -> list[tuple[asyncio.Future, int]]:
+        """Пачка своей транзакцией; при ошибке строки — пополам, пока ошибка не останется у одной строки."""
+        try:
+            return await self._write([(model, chunk)])
+        except Exception as e:
+            if len(chunk) == 1 or not _is_row_error(e):
+                print(f"[writer] {len(chunk)} row(s) rejected: {e.__class__.__name__}: {e}")
+                self._fail([f for _, f in chunk], e)
+                return []
+        mid = len(chunk) // 2
+        return await self._write_isolated(model, chunk[:mid]) + await self._write_isolated(model, chunk[mid:])
+
+    def _fail(self, futures: list[asyncio.Future], e: BaseException) -> None:
+        self.counters["failed_rows"] += len(futures)
+        for fut in futures:
+            if not fut.done():
+                fut.set_exception(e)
+
+    async def flush(self) -> None:
+        """Дописать всё накопленное сейчас (остановка процесса)."""
+        while self._pending:
+            await self._flush_once()
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": self._size, **{k: int(v) for k, v in self.counters.items()}}
+
+
+_writer: BatchWriter | None = None
+
+
+def get_writer() -> BatchWriter:
+    """Singleton на процесс (как engine / sessionmaker)."""
+    global _writer
+    if _writer is None:
+        _writer = BatchWriter(delay_ms=WRITER_DELAY_MS, max_batch=WRITER_MAX_BATCH)
+    return _writer
@@ -6,6 +6,8 @@
 
   const modelEl = document.getElementById("modelSelect");
   const historyPairsEl = document.getElementById("historyPairs");
+  const burstWindowEl = document.getElementById("burstWindowSec");
+  const maxInputTokensEl = document.getElementById("maxInputTokens");
   const systemPromptEl = document.getElementById("systemPrompt");
   const outOfScopeEl = document.getElementById("outOfScopeEnabled");
 
@@ -124,6 +126,28 @@
       history_pairs = Math.floor(n);
     }
 
+    let burst_window_sec = null;
+    const rawBw = (burstWindowEl.value || "").trim();
+    if (rawBw !== "") {
+      const n = Number(rawBw);
+      if (!Number.isFinite(n) || n < 0 || n > 30) {
+        showStatus("err", "Склейка должна быть числом 0..30.");
+        return;
+      }
+      burst_window_sec = n;
+    }
+
+    let max_input_tokens = null;
+    const rawMit = (maxInputTokensEl.value || "").trim();
+    if (rawMit !== "" && Number(rawMit) !== 0) {
+      const n = Number(rawMit);
+      if (!Number.isFinite(n) || n < 500 || n > 400000) {
+        showStatus("err", "Лимит входа должен быть 0 или числом 500..400000.");
+        return;
+      }
+      max_input_tokens = Math.floor(n);
+    }
+
     const google_sources = collectSources();
     const out_of_scope_enabled = !!outOfScopeEl.checked;
 
@@ -133,6 +157,8 @@
         model,
         system_prompt,
         history_pairs,
+        burst_window_sec,
+        max_input_tokens,
         google_sources,
         out_of_scope_enabled,
       });
@@ -0,0 +1,239 @@
+(function () {
+  // Диалоги, сообщения и поиск страницами по keyset-курсору (/ui/api/...):
+  // каждая страница дорисовывается к уже показанным, без перерисовки всего списка.
+  const PAGE_SIZE = 50;
+
+  function getTokenFromUrl() {
+    const t = new URLSearchParams(window.location.search).get("token");
+    return t && t.trim() ? t.trim() : null;
+  }
+
+  function withToken(url) {
+    const token = getTokenFromUrl();
+    if (!token) return url;
+    return url.includes("?")
+      ? `${url}&token=${encodeURIComponent(token)}`
+      : `${url}?token=${encodeURIComponent(token)}`;
+  }
+
+  async function getJson(url) {
+    const res = await fetch(withToken(url), { credentials: "same-origin" });
+
+    let data = null;
+    try { data = await res.json(); } catch (_) {}
+
+    if (!res.ok) {
+      const msg = (data && data.detail) ? data.detail : `HTTP ${res.status}`;
+      throw new Error(msg);
+    }
+    return data;
+  }
+
+  function fmtTime(value) {
+    if (!value) return "";
+    const d = new Date(value);
+    return isNaN(d.getTime()) ? String(value) : d.toLocaleString();
+  }
+
+  function showStatus(box, type, text) {
+    box.style.display = "block";
+    box.className = `status ${type}`; // ok | err | info
+    box.textContent = text;
+  }
+
+  function clearStatus(box) {
+    box.style.display = "none";
+    box.textContent = "";
+    box.className = "status";
+  }
+
+  // один загрузчик на список: курсор следующей страницы + защита от двойного клика
+  function pager(buildUrl, render, moreBtn, statusBox) {
+    let cursor = null;
+    let loading = false;
+    let done = false;
+
+    async function load() {
+      if (loading || done) return;
+      loading = true;
+      moreBtn.disabled = true;
+      try {
+        const data = await getJson(buildUrl(cursor));
+        clearStatus(statusBox);
+        render(data.items || []);
+        cursor = data.next_cursor || null;
+        done = !cursor;
+      } catch (e) {
+        showStatus(statusBox, "err", `Не удалось загрузить: ${e.message}`);
+      } finally {
+        loading = false;
+        moreBtn.disabled = false;
+        moreBtn.style.display = done ? "none" : "";
+      }
+    }
+
+    function reset() {
+      cursor = null;
+      done = false;
+    }
+
+    moreBtn.addEventListener("click", load);
+    return { load, reset };
+  }
+
+  function initDialogs(root) {
+    const tbody = document.querySelector("#dialogs-table tbody");
+    const moreBtn = document.getElementById("dialogs-more");
+    const statusBox = document.getElementById("dialogs-status-box");
+    const statusSel = document.getElementById("dialogs-status");
+
+    function buildUrl(cursor) {
+      const q = new URLSearchParams({ limit: String(PAGE_SIZE) });
+      if (cursor) q.set("cursor", cursor);
+      if (statusSel.value) q.set("status", statusSel.value);
+      return `/ui/api/dialogs?${q.toString()}`;
+    }
+
+    function render(items) {
+      const frag = document.createDocumentFragment();
+      for (const d of items) {
+        const tr = document.createElement("tr");
+
+        const tdId = document.createElement("td");
+        const a = document.createElement("a");
+        a.href = withToken(`/ui/dialogs/${d.id}`);
+        a.textContent = String(d.id);
+        tdId.appendChild(a);
+
+        const tdClient = document.createElement("td");
+        tdClient.textContent = d.client_name || `#${d.client_id}`;
+
+        const tdStatus = document.createElement("td");
+        tdStatus.textContent = d.status || "";
+
+        const tdLast = document.createElement("td");
+        if (d.last_direction) {
+          tdLast.textContent = `${d.last_direction === "in" ? "←" : "→"} ${d.last_text || ""}`;
+        } else {
+          tdLast.textContent = d.title || "";
+        }
+
+        const tdTime = document.createElement("td");
+        tdTime.textContent = fmtTime(d.last_message_at);
+
+        tr.append(tdId, tdClient, tdStatus, tdLast, tdTime);
+        frag.appendChild(tr);
+      }
+      tbody.appendChild(frag);
+    }
+
+    const p = pager(buildUrl, render, moreBtn, statusBox);
+
+    statusSel.addEventListener("change", () => {
+      tbody.textContent = "";
+      p.reset();
+      p.load();
+    });
+
+    p.load();
+  }
+
+  function initSearch(root) {
+    const form = document.getElementById("search-form");
+    const input = document.getElementById("search-q");
+    const list = document.getElementById("search-results");
+    const moreBtn = document.getElementById("search-more");
+    const statusBox = document.getElementById("search-status-box");
+    let query = "";
+
+    function buildUrl(cursor) {
+      const q = new URLSearchParams({ q: query, limit: String(PAGE_SIZE) });
+      if (cursor) q.set("cursor", cursor);
+      return `/ui/api/search?${q.toString()}`;
+    }
+
+    function render(items) {
+      if (!items.length && !list.firstChild) {
+        showStatus(statusBox, "info", "Ничего не найдено");
+      }
+      const frag = document.createDocumentFragment();
+      for (const r of items) {
+        const li = document.createElement("li");
+
+        const a = document.createElement("a");
+        a.href = withToken(`/ui/dialogs/${r.dialog_id}`);
+        a.textContent = `#${r.dialog_id}`;
+
+        const head = document.createElement("span");
+        head.className = "muted";
+        head.textContent = ` ${fmtTime(r.created_at)} ${r.direction === "in" ? "client" : "bot"}: `;
+
+        // snippet_html уже экранирован сервером, разметка — только <mark>
+        const text = document.createElement("span");
+        text.innerHTML = r.snippet_html || "";
+
+        li.append(a, head, text);
+        frag.appendChild(li);
+      }
+      list.appendChild(frag);
+    }
+
+    const p = pager(buildUrl, render, moreBtn, statusBox);
+
+    form.addEventListener("submit", (e) => {
+      e.preventDefault();
+      query = (input.value || "").trim();
+      list.textContent = "";
+      p.reset();
+      if (query) p.load();
+    });
+  }
+
+  function initMessages(root) {
+    const dialogId = root.dataset.dialogId;
+    const list = document.getElementById("messages-list");
+    const moreBtn = document.getElementById("messages-more");
+    const statusBox = document.getElementById("messages-status-box");
+
+    function buildUrl(cursor) {
+      const q = new URLSearchParams({ limit: String(PAGE_SIZE) });
+      if (cursor) q.set("cursor", cursor);
+      return `/ui/api/dialogs/${encodeURIComponent(dialogId)}/messages?${q.toString()}`;
+    }
+
+    // страница приходит от новых к старым; в ленте — по возрастанию, более ранние сверху
+    function render(items) {
+      const frag = document.createDocumentFragment();
+      for (const m of items.slice().reverse()) {
+        const li = document.createElement("li");
+
+        const head = document.createElement("span");
+        head.className = "muted";
+        head.textContent = `${fmtTime(m.created_at)} `;
+
+        const who = document.createElement("b");
+        who.textContent = m.direction === "in" ? "client" : "bot";
+
+        const text = document.createElement("span");
+        text.textContent = `: ${m.text || ""}`;
+
+        li.append(head, who, text);
+        frag.appendChild(li);
+      }
+      list.insertBefore(frag, list.firstChild);
+    }
+
+    pager(buildUrl, render, moreBtn, statusBox).load();
+  }
+
+  document.addEventListener("DOMContentLoaded", () => {
+    const dialogsRoot = document.getElementById("dialogs-page");
+    if (dialogsRoot) initDialogs(dialogsRoot);
+
+    const searchRoot = document.getElementById("search-page");
+    if (searchRoot) initSearch(searchRoot);
+
+    const dialogRoot = document.getElementById("dialog-page");
+    if (dialogRoot) initMessages(dialogRoot);
+  });
+})();
@@ -1,45 +1,181 @@
 from __future__ import annotations
 
 import asyncio
+import json
+import math
 import os
-from dataclasses import dataclass
-from typing import Any, Dict
+import random
+import time
+import traceback
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable
 
-from sqlalchemy import select
+from sqlalchemy import func, or_, select
 from telethon import TelegramClient, events
+from telethon.errors import ApiIdInvalidError, AuthKeyError, UnauthorizedError
 from telethon.sessions import StringSession
 
-from src.core.chat_engine import generate_reply
-from src.core.queues import InboundMessage, SessionQueue
+from src.core.chat_engine import generate_reply, generate_reply_stream
+from src.core.jobs import JobRelease, JobRunner, register_handler
+from src.core.metrics import METRICS, PROMETHEUS_CONTENT_TYPE, Sample, serve_http
+from src.core.openai_client import OPENAI_POOL
+from src.core.queues import OVERLOAD_DROP_OLDEST, OVERLOAD_POLICIES, InboundMessage, SessionQueue
+from src.core.send_scheduler import SendScheduler
+from src.core.supervisor import RuntimeSupervisor
+from src.core.tg_stream import StreamedReply
+from src.core.tokens import preload_encoding
+from src.models.message import Message
+from src.resources.cache import RESOURCE_CONFIG_CACHE, invalidate_resource_config
 from src.models.resource import Resource, ResourceSettings
 from src.models.session import Session, SessionSettings
 from src.storage.db import get_db
-from src.storage.messages import save_inbound, save_outbound, load_history
-
-SYNC_INTERVAL_SEC = int(os.getenv("WORKER_SYNC_INTERVAL_SEC", "5"))
+from src.storage.events import write_event
+from src.storage.jobs import LeasedJob, enqueue_jobs
+from src.storage.messages import (
+    DIALOG_REF_CACHE,
+    HISTORY_BUFFER,
+    DialogRef,
+    invalidate_dialog_history,
+    invalidate_dialog_refs,
+    load_tg_recent_history,
+    save_inbound,
+    write_outbound,
+)
+from src.storage.notify import CONFIG_CHANNEL, listen, parse_config_payload
+from src.storage.writer import get_writer
+
+# полный пересчёт активных сессий — страховка; основной путь — LISTEN/NOTIFY от UI
+SYNC_INTERVAL_SEC = int(os.getenv("WORKER_SYNC_INTERVAL_SEC", "60"))
+LISTEN_RETRY_SEC = int(os.getenv("WORKER_LISTEN_RETRY_SEC", "5"))
 HISTORY_LIMIT_MESSAGES = int(os.getenv("WORKER_HISTORY_LIMIT_MESSAGES", "20"))
+# сколько чатов одной сессии обрабатываются параллельно (переопределяется SessionSettings.data.max_concurrency)
+SESSION_CONCURRENCY = int(os.getenv("WORKER_SESSION_CONCURRENCY", "4"))
+# окно склейки подряд идущих сообщений одного чата (по умолчанию; переопределяется в Prompt-ресурсе)
+BURST_WINDOW_SEC = float(os.getenv("WORKER_BURST_WINDOW_SEC", "0"))
+# потолок ожидания склейки от первого сообщения пачки: окно сдвигается каждым новым сообщением
+BURST_MAX_WAIT_SEC = float(os.getenv("WORKER_BURST_MAX_WAIT_SEC", "30"))
+# защита от перегрузки: лимит очереди сессии, "срок годности" сообщения и политика при переполнении
+QUEUE_MAXSIZE = int(os.getenv("WORKER_QUEUE_MAXSIZE", "500"))
+QUEUE_MAX_AGE_SEC = float(os.getenv("WORKER_QUEUE_MAX_AGE_SEC", "300"))
+QUEUE_OVERLOAD = (os.getenv("WORKER_QUEUE_OVERLOAD") or OVERLOAD_DROP_OLDEST).strip()
+if QUEUE_OVERLOAD not in OVERLOAD_POLICIES:
+    QUEUE_OVERLOAD = OVERLOAD_DROP_OLDEST
+# durable-режим: входящие и исходящие идут через таблицу jobs (переживают рестарт воркера)
+DURABLE_QUEUE = (os.getenv("WORKER_DURABLE_QUEUE") or "").strip().lower() in ("1", "true", "yes")
+JOBS_CONCURRENCY = int(os.getenv("WORKER_JOBS_CONCURRENCY", "256"))
+JOBS_LEASE_SEC = float(os.getenv("WORKER_JOBS_LEASE_SEC", "120"))
+# задача для сессии, которая здесь не запущена, возвращается в очередь через столько секунд (попытка не тратится)
+JOBS_RELEASE_DELAY_SEC = float(os.getenv("WORKER_JOBS_RELEASE_DELAY_SEC", "5"))
+# done / failed задачи (с полным текстом сообщений) хранятся столько часов; 0 — не удалять
+JOBS_RETENTION_HOURS = float(os.getenv("WORKER_JOBS_RETENTION_HOURS", "168"))
+JOBS_PURGE_INTERVAL_SEC = float(os.getenv("WORKER_JOBS_PURGE_INTERVAL_SEC", "3600"))
+# исходящие вызовы сессии (сообщения, read ack): token bucket + ожидание FloodWait, см. SendScheduler
+SEND_RATE_PER_SEC = float(os.getenv("WORKER_SEND_RATE_PER_SEC", "2"))
+SEND_BURST = int(os.getenv("WORKER_SEND_BURST", "5"))
+SEND_MAX_RETRIES = int(os.getenv("WORKER_SEND_MAX_RETRIES", "5"))
+READ_ACK_INTERVAL_SEC = float(os.getenv("WORKER_READ_ACK_INTERVAL_SEC", "1"))
+# потоковые ответы (включаются явно, WORKER_STREAM_REPLIES=1): первое сообщение — после первого куска модели,
+# дальше правки не чаще STREAM_EDIT_INTERVAL_SEC (через тот же SendScheduler), длинный ответ делится на сообщения.
+# В durable-режиме выключено: outbound-задаче нужен весь текст для повтора
+STREAM_REPLIES = (os.getenv("WORKER_STREAM_REPLIES") or "0").strip().lower() in ("1", "true", "yes")
+STREAM_EDIT_INTERVAL_SEC = float(os.getenv("WORKER_STREAM_EDIT_INTERVAL_SEC", "1.5"))
+# подключение клиентов: не больше CONNECT_CONCURRENCY одновременно (MTProto-рукопожатие грузит CPU),
+# перед каждым — случайная пауза до CONNECT_JITTER_SEC; первыми — сессии с недавним трафиком
+CONNECT_CONCURRENCY = max(1, int(os.getenv("WORKER_CONNECT_CONCURRENCY", "8")))
+CONNECT_JITTER_SEC = float(os.getenv("WORKER_CONNECT_JITTER_SEC", "0.5"))
+RECENT_TRAFFIC_DAYS = int(os.getenv("WORKER_RECENT_TRAFFIC_DAYS", "7"))
+# перезапуск упавших сессий: пауза SUPERVISOR_BASE_SEC * 2^(n-1) до SUPERVISOR_MAX_SEC,
+# после SUPERVISOR_AUTH_QUARANTINE_AFTER ошибок авторизации подряд — карантин до смены session_string
+SUPERVISOR_BASE_SEC = float(os.getenv("WORKER_SUPERVISOR_BASE_SEC", "5"))
+SUPERVISOR_MAX_SEC = float(os.getenv("WORKER_SUPERVISOR_MAX_SEC", "900"))
+SUPERVISOR_STABLE_SEC = float(os.getenv("WORKER_SUPERVISOR_STABLE_SEC", "300"))
+SUPERVISOR_AUTH_QUARANTINE_AFTER = int(os.getenv("WORKER_SUPERVISOR_AUTH_QUARANTINE_AFTER", "3"))
+# HTTP /metrics (Prometheus text) и /status (JSON); 0 — выключено
+METRICS_HOST = os.getenv("WORKER_METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+JOB_QUEUE_INBOUND = "inbound"
+JOB_QUEUE_OUTBOUND = "outbound"
+BUSY_REPLY_TEXT = (
+    os.getenv("WORKER_BUSY_REPLY_TEXT") or "Сейчас очень много обращений, ответим чуть позже. Пожалуйста, подождите."
+)
+
+
+STAGE_SECONDS = "worker_stage_duration_seconds"
+METRICS.describe(STAGE_SECONDS, "Time spent in a reply pipeline stage (load_history, save_inbound, openai, send).")
+METRICS.describe("worker_replies_total", "Replies sent to Telegram.")
+METRICS.describe("worker_errors_total", "Pipeline errors by stage.")
+METRICS.describe("worker_runtime_starts_total", "Session runtime starts.")
+METRICS.describe("worker_runtime_restarts_total", "Session runtime stops followed by a new start (reconnect, crash).")
+METRICS.describe("worker_connect_wait_seconds", "Time from runtime start to connected (queueing behind the connect gate included).")
+METRICS.describe("worker_startup_duration_seconds", "Time from the first sync until every started session connected or failed.")
+METRICS.describe("worker_startup_sessions", "Sessions started by the first sync, by outcome.")
+
+METRICS.describe("worker_runtime_quarantined_total", "Sessions quarantined after repeated auth errors.")
+METRICS.describe("worker_llm_ttft_seconds", "Time from the model request to the first streamed text chunk.")
+METRICS.describe("worker_stream_edits_total", "Telegram edit_message calls made while streaming replies.")
+METRICS.describe("worker_queue_shed_total", "Inbound messages dropped or coalesced by the session queue, by reason.")
+
+SUPERVISOR = RuntimeSupervisor(
+    base_sec=SUPERVISOR_BASE_SEC,
+    max_sec=SUPERVISOR_MAX_SEC,
+    stable_sec=SUPERVISOR_STABLE_SEC,
+    auth_quarantine_after=SUPERVISOR_AUTH_QUARANTINE_AFTER,
+)
+
+
+class SessionUnauthorizedError(RuntimeError):
+    """StringSession больше не авторизована (отозвана / разлогинена)."""
+
+
+def _is_auth_error(exc: BaseException) -> bool:
+    return isinstance(exc, (UnauthorizedError, AuthKeyError, ApiIdInvalidError, SessionUnauthorizedError))
+
+
+_connect_gate: asyncio.Semaphore | None = None
+
+
+def _get_connect_gate() -> asyncio.Semaphore:
+    # asyncio.Semaphore будит ожидающих в порядке очереди: кто раньше запущен, тот раньше подключится
+    global _connect_gate
+    if _connect_gate is None:
+        _connect_gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    return _connect_gate
 
 
 @dataclass
 class TgRuntime:
     cfg_sig: str
+    cfg: Dict[str, Any]
     client: TelegramClient
     stop: asyncio.Event
     task: asyncio.Task
+    queue: SessionQueue
+    sender: SendScheduler
+    # выставляет tg_openai_loop после client.connect()
+    connected: asyncio.Event
 
 
-def _cfg_sig(
-    api_id: int,
-    api_hash: str,
-    session_string: str,
-    openai_resource_id: int | None,
-    prompt_resource_id: int | None,
-    history_limit_messages: int | None,
-) -> str:
-    return (
-        f"{api_id}:{api_hash}:{session_string}:"
-        f"{openai_resource_id or ''}:{prompt_resource_id or ''}:{history_limit_messages or ''}"
-    )
+def _cfg_sig(api_id: int, api_hash: str, session_string: str) -> str:
+    """
+    Подпись ПОДКЛЮЧЕНИЯ: только то, без чего нельзя не переподключать TelegramClient.
+    Настройки ответа (openai/prompt/history/окна/лимиты) меняются на лету, см. _apply_reply_cfg.
+    """
+    return f"{api_id}:{api_hash}:{session_string}"
+
+
+async def _apply_reply_cfg(sid: int, rt: TgRuntime, cfg: Dict[str, Any]) -> None:
+    """
+    Применяет новые настройки ответа к работающему tg_openai_loop без переподключения:
+    rt.cfg — тот же dict, что читает цикл на каждой пачке, поэтому обновляем его in place.
+    """
+    if cfg != rt.cfg:
+        rt.cfg.update(cfg)
+        print(f"[worker][tg:{sid}] reply config updated")
+
+    if cfg["max_concurrency"] != rt.queue.max_in_flight:
+        await rt.queue.set_max_in_flight(cfg["max_concurrency"])
+    if cfg["burst_window_sec"] != rt.queue.window_sec:
+        await rt.queue.set_window(cfg["burst_window_sec"])
 
 
 
@@ -56,50 +192,77 @@ async def _get_db_once():
         await agen.aclose()
 
 
-async def fetch_active_tg_sessions() -> Dict[int, Dict[str, Any]]:
+async def fetch_active_tg_sessions(
+    *,
+    session_ids: Iterable[int] | None = None,
+    resource_ids: Iterable[int] | None = None,
+) -> Dict[int, Dict[str, Any]]:
     """
     Возвращает активные Telegram-сессии:
     session_id -> {company_id, resource_id, api_id, api_hash, session_string, openai_resource_id, prompt_resource_id}
+    session_ids / resource_ids — сузить выборку (точечная синхронизация по уведомлению).
     """
+    scope = []
+    if session_ids is not None or resource_ids is not None:
+        if session_ids:
+            scope.append(Session.id.in_([int(x) for x in session_ids]))
+        if resource_ids:
+            scope.append(Resource.id.in_([int(x) for x in resource_ids]))
+        if not scope:
+            return {}
+
     async for db in _get_db_once():
         stmt = (
             select(
                 Resource.company_id,
                 Resource.id,
-                Resource.is_enabled,
                 ResourceSettings.data,
                 Session.id,
-                Session.is_enabled,
-                SessionSettings.is_enabled,
                 SessionSettings.data,
             )
             .select_from(Resource)
             .join(ResourceSettings, ResourceSettings.resource_id == Resource.id)
             .join(Session, Session.resource_id == Resource.id)
             .join(SessionSettings, SessionSettings.session_id == Session.id)
-            .where(Resource.kind == "telegram")
+            .where(
+                Resource.kind == "telegram",
+                Resource.is_enabled.is_(True),
+                Session.is_enabled.is_(True),
+                SessionSettings.is_enabled.is_(True),
+            )
         )
 
+        if scope:
+            stmt = stmt.where(or_(*scope))
+
         rows = (await db.execute(stmt)).all()
 
+        # настройки Prompt-ресурсов — одним запросом на все сессии (а не по запросу на строку)
+        prompt_ids: set[int] = set()
+        for _, _, rs_data, _, _ in rows:
+            try:
+                pid = int((rs_data or {}).get("prompt_resource_id") or 0)
+            except Exception:
+                pid = 0
+            if pid > 0:
+                prompt_ids.add(pid)
+
+        prompt_data: Dict[int, dict] = {}
+        if prompt_ids:
+            stmt_p = select(ResourceSettings.resource_id, ResourceSettings.data).where(
+                ResourceSettings.resource_id.in_(sorted(prompt_ids))
+            )
+            for pid, pr_data in (await db.execute(stmt_p)).all():
+                prompt_data[int(pid)] = pr_data if isinstance(pr_data, dict) else {}
+
     out: Dict[int, Dict[str, Any]] = {}
     for (
         company_id,
         resource_id,
-        resource_enabled,
         rs_data,
         session_id,
-        session_enabled,
-        ss_enabled,
         ss_data,
     ) in rows:
-        if not resource_enabled:
-            continue
-        if not session_enabled:
-            continue
-        if not ss_enabled:
-            continue
-
         rs_data = rs_data or {}
         ss_data = ss_data or {}
 
@@ -111,8 +274,7 @@ async def fetch_active_tg_sessions() -> Dict[int, Dict[str, Any]]:
         history_limit_messages: int | None = None
         try:
             if prompt_resource_id:
-                stmt_p = select(ResourceSettings.data).where(ResourceSettings.resource_id == int(prompt_resource_id))
-                pr_data = (await db.execute(stmt_p)).scalar_one_or_none() or {}
+                pr_data = prompt_data.get(int(prompt_resource_id)) or {}
                 pairs = int(pr_data.get("history_pairs") or 0)
                 if pairs > 0:
                     history_limit_messages = pairs * 2
@@ -123,6 +285,23 @@ async def fetch_active_tg_sessions() -> Dict[int, Dict[str, Any]]:
         is_activated = bool(ss_data.get("is_activated"))
         session_string = (ss_data.get("session_string") or "").strip()
 
+        try:
+            max_concurrency = int(ss_data.get("max_concurrency") or 0) or SESSION_CONCURRENCY
+        except Exception:
+            max_concurrency = SESSION_CONCURRENCY
+
+        # окно склейки подряд идущих сообщений чата — из настроек Prompt-ресурса
+        burst_window_sec = BURST_WINDOW_SEC
+        try:
+            if prompt_resource_id:
+                pr_data = prompt_data.get(int(prompt_resource_id)) or {}
+                if pr_data.get("burst_window_sec") is not None:
+                    burst_window_sec = float(pr_data["burst_window_sec"])
+                    if not math.isfinite(burst_window_sec):
+                        raise ValueError("burst_window_sec is not finite")
+        except Exception:
+            burst_window_sec = BURST_WINDOW_SEC
+
         if not (api_id and api_hash and is_activated and session_string):
             continue
 
@@ -135,24 +314,236 @@ async def fetch_active_tg_sessions() -> Dict[int, Dict[str, Any]]:
             "openai_resource_id": int(openai_resource_id) if openai_resource_id else None,
             "prompt_resource_id": int(prompt_resource_id) if prompt_resource_id else None,
             "history_limit_messages": int(history_limit_messages) if history_limit_messages else None,
+            "max_concurrency": max(1, max_concurrency),
+            "burst_window_sec": max(0.0, burst_window_sec),
         }
 
     return out
 
 
-async def tg_openai_loop(session_id: int, cfg: Dict[str, Any], client: TelegramClient, stop: asyncio.Event) -> None:
+async def fetch_recent_traffic(session_ids: Iterable[int]) -> Dict[int, float]:
     """
-    1 Telegram-сессия = 1 очередь = 1 consumer (строгий порядок).
-    + ставим "прочитано"
-    + показываем "печатает..." пока формируем ответ
+    session_id -> unix-время последнего сообщения за RECENT_TRAFFIC_DAYS (одним GROUP BY).
+    Сессии без сообщений за это окно в ответ не попадают.
     """
-    queue = SessionQueue(maxsize=0)
+    ids = sorted({int(x) for x in session_ids})
+    if not ids:
+        return {}
 
-    async def _safe_read_ack(chat_id: int, message_id: int) -> None:
-        try:
-            await client.send_read_acknowledge(chat_id, max_id=message_id)
-        except Exception:
-            pass
+    out: Dict[int, float] = {}
+    async for db in _get_db_once():
+        stmt = (
+            select(Message.session_id, func.max(Message.created_at))
+            .where(
+                Message.session_id.in_(ids),
+                Message.created_at >= func.now() - func.make_interval(0, 0, 0, RECENT_TRAFFIC_DAYS),
+            )
+            .group_by(Message.session_id)
+        )
+        for sid, last_at in (await db.execute(stmt)).all():
+            if sid is not None and last_at is not None:
+                out[int(sid)] = last_at.timestamp()
+    return out
+
+
+def _resolve_done(batch: list[InboundMessage], error: Exception | None) -> None:
+    for m in batch:
+        if m.done is None or m.done.done():
+            continue
+        if error is None:
+            m.done.set_result(None)
+        else:
+            m.done.set_exception(error)
+
+
+async def _save_inbound_batch(
+    db,
+    rcfg: Dict[str, Any],
+    session_id: int,
+    chat_id: int,
+    batch: list[InboundMessage],
+) -> tuple[DialogRef, list[dict]]:
+    """
+    Первый шаг _process: client/dialog + история (до вставки пачки — исключать её не нужно) + INSERT пачки и COMMIT.
+    В установившемся режиме — 1-2 statement'а на пачку (история из HISTORY_BUFFER или одним запросом, все входящие
+    одним INSERT), при первом контакте — ещё upsert client/dialog.
+    """
+    # client/dialog + история — из HISTORY_BUFFER или обычно одним запросом (см. load_recent_history)
+    with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="load_history"):
+        ref, hist = await load_tg_recent_history(
+            db,
+            company_id=int(rcfg["company_id"]),
+            resource_id=int(rcfg["resource_id"]),
+            session_id=int(session_id),
+            chat_id=chat_id,
+            limit_messages=int(rcfg.get("history_limit_messages") or HISTORY_LIMIT_MESSAGES),
+        )
+
+    with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="save_inbound"):
+        for inbound in batch:
+            await save_inbound(
+                db,
+                ref,
+                tg_message_id=int(inbound.message_id),
+                text=inbound.text,
+                merged_tg_message_ids=list(inbound.merged_ids),
+                commit=False,
+            )
+        await db.commit()
+
+    return ref, [item for item in hist if item["content"]]
+
+
+async def _send_busy(sender: SendScheduler, client: TelegramClient, session_id: int, chat_id: int) -> None:
+    try:
+        await sender.send(lambda: client.send_message(chat_id, BUSY_REPLY_TEXT))
+    except Exception as e:
+        print(f"[worker][tg:{session_id}] send busy error: {e.__class__.__name__}: {e}")
+
+
+async def _send_and_save(
+    sender: SendScheduler,
+    client: TelegramClient,
+    session_id: int,
+    chat_id: int,
+    reply: str,
+    ref: DialogRef | None,
+) -> None:
+    """
+    Отправка ответа + сохранение out-сообщения (через BatchWriter, см. BATCH_WRITER_WAIT).
+    Отправка идёт через SendScheduler (лимит + FloodWait; сетевой сбой не повторяется — сообщение могло уйти),
+    ошибка пробрасывается (outbound-задача уйдёт на повтор),
+    ошибка сохранения только логируется — иначе повтор задачи продублирует ответ клиенту.
+    """
+    try:
+        with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="send"):
+            sent = await sender.send(lambda: client.send_message(chat_id, reply))
+    except Exception:
+        METRICS.inc("worker_errors_total", session_id=session_id, stage="send")
+        raise
+    METRICS.inc("worker_replies_total", session_id=session_id)
+    sent_tg_msg_id = int(getattr(sent, "id", 0) or 0) or None
+    print(f"[worker][tg:{session_id}] sent reply_len={len(reply or '')}")
+
+    if ref is None:
+        return
+    try:
+        with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="save_outbound"):
+            await write_outbound(ref, text=reply, tg_message_id=sent_tg_msg_id)
+    except Exception as e:
+        METRICS.inc("worker_errors_total", session_id=session_id, stage="save_outbound")
+        tb = traceback.format_exc()
+        print(f"[worker][tg:{session_id}] DB_SAVE_OUT_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+
+
+async def _llm_error(rcfg: Dict[str, Any], session_id: int, ref: DialogRef | None, e: Exception) -> str:
+    """Ошибка модели: лог + событие llm; возвращает текст, который уйдёт клиенту вместо ответа."""
+    METRICS.inc("worker_errors_total", session_id=session_id, stage="openai")
+    tb = traceback.format_exc()
+    print(f"[worker][tg:{session_id}] OPENAI_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+    msg = (str(e) or e.__class__.__name__).strip()
+    await write_event(
+        company_id=int(rcfg["company_id"]),
+        level="error",
+        kind="llm",
+        message=f"{e.__class__.__name__}: {msg}"[:1000],
+        resource_id=int(rcfg["resource_id"]),
+        session_id=int(session_id),
+        dialog_id=ref.dialog_id if ref else None,
+    )
+    return f"Ошибка OpenAI: {msg[:180]}"
+
+
+async def _stream_and_save(
+    sender: SendScheduler,
+    client: TelegramClient,
+    db,
+    session_id: int,
+    chat_id: int,
+    rcfg: Dict[str, Any],
+    ref: DialogRef | None,
+    user_text: str,
+    history_messages: list[dict],
+) -> None:
+    """
+    Потоковый ответ (STREAM_REPLIES): первое сообщение — после первого куска модели,
+    дальше правки того же сообщения (StreamedReply), out-сообщение сохраняется один раз — с финальным текстом.
+    Ошибка модели до первого куска — как в обычном режиме (текст ошибки одним сообщением),
+    после — дописывается к уже показанному ответу. Ошибки отправки — наружу, как у _send_and_save.
+    """
+    stream = StreamedReply(
+        send=lambda text: sender.send(lambda: client.send_message(chat_id, text)),
+        edit=lambda msg, text: sender.send(lambda: client.edit_message(chat_id, msg, text), idempotent=True),
+        edit_interval_sec=STREAM_EDIT_INTERVAL_SEC,
+    )
+    chunks = generate_reply_stream(
+        db,
+        company_id=int(rcfg["company_id"]),
+        openai_resource_id=rcfg.get("openai_resource_id"),
+        prompt_resource_id=rcfg.get("prompt_resource_id"),
+        user_text=user_text,
+        history_messages=history_messages,
+    )
+    t0 = time.monotonic()
+    error_text = ""
+    try:
+        async with client.action(chat_id, "typing"):
+            with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="openai"):
+                while True:
+                    try:
+                        delta = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    except Exception as e:
+                        error_text = await _llm_error(rcfg, session_id, ref, e)
+                        break
+                    if not stream.started and delta.strip():
+                        METRICS.observe("worker_llm_ttft_seconds", time.monotonic() - t0, session_id=session_id)
+                    await stream.feed(delta)
+
+            if error_text:
+                await stream.feed(f"\n\n{error_text}" if stream.text.strip() else error_text)
+            with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="send"):
+                reply = await stream.finish()
+    except Exception:
+        METRICS.inc("worker_errors_total", session_id=session_id, stage="send")
+        raise
+    finally:
+        stream.cancel()
+        await chunks.aclose()
+        if stream.edits:
+            METRICS.inc("worker_stream_edits_total", stream.edits, session_id=session_id)
+
+    METRICS.inc("worker_replies_total", session_id=session_id)
+    print(f"[worker][tg:{session_id}] streamed reply_len={len(reply)} messages={stream.messages} edits={stream.edits}")
+
+    if ref is None:
+        return
+    try:
+        with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="save_outbound"):
+            await write_outbound(ref, text=reply, tg_message_id=stream.first_message_id)
+    except Exception as e:
+        METRICS.inc("worker_errors_total", session_id=session_id, stage="save_outbound")
+        tb = traceback.format_exc()
+        print(f"[worker][tg:{session_id}] DB_SAVE_OUT_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+
+
+async def tg_openai_loop(
+    session_id: int,
+    cfg: Dict[str, Any],
+    client: TelegramClient,
+    stop: asyncio.Event,
+    queue: SessionQueue,
+    sender: SendScheduler,
+    connected: asyncio.Event,
+) -> None:
+    """
+    1 Telegram-сессия = 1 очередь с ключом chat_id:
+    + строгий порядок внутри чата, разные чаты — параллельно (до max_in_flight)
+    + ставим "прочитано" (раз в READ_ACK_INTERVAL_SEC, по чату только max_id)
+    + показываем "печатает..." пока формируем ответ
+    Все исходящие вызовы — через sender (общий лимит сессии и FloodWait).
+    """
 
     @client.on(events.NewMessage(incoming=True))
     async def _on_message(event: events.NewMessage.Event) -> None:
@@ -174,119 +565,192 @@ async def tg_openai_loop(session_id: int, cfg: Dict[str, Any], client: TelegramC
         if not chat_id or not message_id:
             return
 
-        asyncio.create_task(_safe_read_ack(chat_id, message_id))
-        await queue.put(InboundMessage(chat_id=chat_id, message_id=message_id, text=text))
-
-    async def _consumer() -> None:
-        import traceback
-
-        while not stop.is_set():
-            try:
-                inbound = await queue.get(timeout=0.5)
-            except asyncio.TimeoutError:
-                continue
-
-            reply = ""
-            inbound_db_msg_id: int | None = None
+        sender.read_ack(chat_id, message_id)
 
+        if DURABLE_QUEUE:
+            # сначала фиксируем в jobs (переживёт рестарт), в SessionQueue его положит обработчик inbound
             try:
-                print(f"[worker][tg:{session_id}] inbound chat_id={inbound.chat_id} msg_id={inbound.message_id}")
+                async for db in _get_db_once():
+                    await enqueue_jobs(
+                        db,
+                        [
+                            {
+                                "company_id": int(cfg["company_id"]),
+                                "queue": JOB_QUEUE_INBOUND,
+                                "payload": {
+                                    "session_id": int(session_id),
+                                    "chat_id": chat_id,
+                                    "message_id": message_id,
+                                    "text": text,
+                                },
+                            }
+                        ],
+                    )
+                return
+            except Exception as e:
+                # БД недоступна — не теряем сообщение, обрабатываем в памяти
+                print(f"[worker][tg:{session_id}] enqueue inbound error: {e.__class__.__name__}: {e}")
+
+        accepted = await queue.put(InboundMessage(chat_id=chat_id, message_id=message_id, text=text))
+        if not accepted:
+            await _send_busy(sender, client, session_id, chat_id)
+
+    async def _process(batch: list[InboundMessage]) -> None:
+        """
+        batch — подряд пришедшие сообщения одного чата (см. SessionQueue.window_sec):
+        каждое сохраняем отдельно, а отвечаем одним запросом к модели.
+
+        Одна DB-сессия на всю пачку: client/dialog разрешаются один раз (DialogRef),
+        дальше по конвейеру идут только id:
+          resolve + history (HISTORY_BUFFER или один запрос) -> INSERT inbound + COMMIT -> LLM -> send -> INSERT outbound
+        """
+        # снимок настроек на всю пачку: cfg может обновиться на лету (_apply_reply_cfg)
+        rcfg = dict(cfg)
+        chat_id = int(batch[-1].chat_id)
+        reply = ""
+        ref: DialogRef | None = None
+        history_messages: list[dict] = []
+        finished = False
+
+        print(
+            f"[worker][tg:{session_id}] inbound chat_id={chat_id} "
+            f"msg_ids={[i for m in batch for i in m.message_ids]}"
+        )
 
-                async with client.action(inbound.chat_id, "typing"):
-                    async for db in _get_db_once():
-                        # 1) save inbound
+        try:
+            async for db in _get_db_once():
+                # 1) client/dialog + history + save inbound (см. _save_inbound_batch)
+                try:
+                    ref, history_messages = await _save_inbound_batch(db, rcfg, session_id, chat_id, batch)
+                except Exception as e:
+                    METRICS.inc("worker_errors_total", session_id=session_id, stage="save_inbound")
+                    tb = traceback.format_exc()
+                    print(f"[worker][tg:{session_id}] DB_SAVE_IN_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+                    await db.rollback()
+                    ref = None
+
+                # 2+3) потоковый ответ: сообщение появляется с первым куском модели и дописывается правками
+                user_text = "\n".join(m.text for m in batch)
+                if STREAM_REPLIES and not DURABLE_QUEUE:
+                    try:
+                        await _stream_and_save(
+                            sender, client, db, session_id, chat_id, rcfg, ref, user_text, history_messages
+                        )
+                    except Exception as e:
+                        print(f"[worker][tg:{session_id}] send error: {e.__class__.__name__}: {e}")
+                        await write_event(
+                            company_id=int(rcfg["company_id"]),
+                            level="error",
+                            kind="adapter",
+                            message=f"send failed: {e.__class__.__name__}: {e}"[:1000],
+                            resource_id=int(rcfg["resource_id"]),
+                            session_id=int(session_id),
+                            dialog_id=ref.dialog_id if ref else None,
+                            meta={"chat_id": chat_id},
+                        )
+                else:
+                    # 2) generate reply with history (пачка — одним сообщением пользователя)
+                    try:
+                        async with client.action(chat_id, "typing"):
+                            with METRICS.timer(STAGE_SECONDS, session_id=session_id, stage="openai"):
+                                reply = await generate_reply(
+                                    db,
+                                    company_id=int(rcfg["company_id"]),
+                                    openai_resource_id=rcfg.get("openai_resource_id"),
+                                    prompt_resource_id=rcfg.get("prompt_resource_id"),
+                                    user_text=user_text,
+                                    history_messages=history_messages,
+                                )
+                    except Exception as e:
+                        reply = await _llm_error(rcfg, session_id, ref, e)
+
+                    # 3) send + save outbound: напрямую или через durable-очередь outbound (с повторами)
+                    enqueued = False
+                    if DURABLE_QUEUE:
+                        payload: Dict[str, Any] = {"session_id": int(session_id), "chat_id": chat_id, "text": reply}
+                        if ref is not None:
+                            payload["ref"] = asdict(ref)
                         try:
-                            m_in = await save_inbound(
+                            await enqueue_jobs(
                                 db,
-                                company_id=int(cfg["company_id"]),
-                                resource_id=int(cfg["resource_id"]),
-                                session_id=int(session_id),
-                                chat_id=int(inbound.chat_id),
-                                tg_message_id=int(inbound.message_id),
-                                text=inbound.text,
+                                [{"company_id": int(rcfg["company_id"]), "queue": JOB_QUEUE_OUTBOUND, "payload": payload}],
                             )
-                            inbound_db_msg_id = int(getattr(m_in, "id", 0) or 0) or None
+                            enqueued = True
                         except Exception as e:
-                            tb = traceback.format_exc()
-                            print(f"[worker][tg:{session_id}] DB_SAVE_IN_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+                            print(f"[worker][tg:{session_id}] enqueue outbound error: {e.__class__.__name__}: {e}")
+                            await db.rollback()
 
-                        # 2) load history (exclude current inbound db row)
+                    if not enqueued:
                         try:
-                            hist = await load_history(
-                                db,
-                                company_id=int(cfg["company_id"]),
-                                resource_id=int(cfg["resource_id"]),
+                            await _send_and_save(sender, client, session_id, chat_id, reply, ref)
+                        except Exception as e:
+                            print(f"[worker][tg:{session_id}] send error: {e.__class__.__name__}: {e}")
+                            await write_event(
+                                company_id=int(rcfg["company_id"]),
+                                level="error",
+                                kind="adapter",
+                                message=f"send failed: {e.__class__.__name__}: {e}"[:1000],
+                                resource_id=int(rcfg["resource_id"]),
                                 session_id=int(session_id),
-                                chat_id=int(inbound.chat_id),
-                                limit_messages=int(cfg.get("history_limit_messages") or HISTORY_LIMIT_MESSAGES),
-                                exclude_message_id=inbound_db_msg_id,
+                                dialog_id=ref.dialog_id if ref else None,
+                                meta={"chat_id": chat_id},
                             )
-                            history_messages = []
-                            for m in hist:
-                                direction = getattr(m, "direction", "") or ""
-                                text = (getattr(m, "text", "") or "").strip()
-                                if not text:
-                                    continue
-                                role = "user" if direction == "in" else "assistant"
-                                history_messages.append({"role": role, "content": text})
-                        except Exception as e:
-                            tb = traceback.format_exc()
-                            print(f"[worker][tg:{session_id}] DB_LOAD_HISTORY_ERROR: {e.__class__.__name__}: {e}\n{tb}")
-                            history_messages = []
-
-                        # 3) generate reply with history
-                        reply = await generate_reply(
-                            db,
-                            company_id=int(cfg["company_id"]),
-                            openai_resource_id=cfg.get("openai_resource_id"),
-                            prompt_resource_id=cfg.get("prompt_resource_id"),
-                            user_text=inbound.text,
-                            history_messages=history_messages,
-                        )
-
-            except Exception as e:
-                tb = traceback.format_exc()
-                print(f"[worker][tg:{session_id}] OPENAI_ERROR: {e.__class__.__name__}: {e}\n{tb}")
-                msg = (str(e) or e.__class__.__name__).strip()
-                reply = f"Ошибка OpenAI: {msg[:180]}"
-
-            sent_tg_msg_id: int | None = None
-            try:
-                sent = await client.send_message(inbound.chat_id, reply)
-                sent_tg_msg_id = int(getattr(sent, "id", 0) or 0) or None
-                print(f"[worker][tg:{session_id}] sent reply_len={len(reply or '')}")
-            except Exception as e:
-                print(f"[worker][tg:{session_id}] send error: {e.__class__.__name__}: {e}")
-            finally:
-                # 4) save outbound (best-effort)
-                try:
-                    async for db in _get_db_once():
-                        await save_outbound(
-                            db,
-                            company_id=int(cfg["company_id"]),
-                            resource_id=int(cfg["resource_id"]),
-                            session_id=int(session_id),
-                            chat_id=int(inbound.chat_id),
-                            text=reply,
-                            tg_message_id=sent_tg_msg_id,
-                        )
-                except Exception as e:
-                    tb = traceback.format_exc()
-                    print(f"[worker][tg:{session_id}] DB_SAVE_OUT_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+            finished = True
+        except Exception as e:
+            # не повторяем: ответ мог уже уйти клиенту
+            METRICS.inc("worker_errors_total", session_id=session_id, stage="process")
+            tb = traceback.format_exc()
+            print(f"[worker][tg:{session_id}] PROCESS_ERROR: {e.__class__.__name__}: {e}\n{tb}")
+            finished = True
+        finally:
+            await queue.task_done(chat_id)
+            # durable: обработанная пачка -> задачи inbound done; прерванная (остановка) -> повтор
+            _resolve_done(batch, None if finished else RuntimeError("processing interrupted"))
 
+    async def _consumer() -> None:
+        """
+        Диспетчер: берёт из очереди пачку готового чата и обрабатывает её отдельной задачей.
+        Порядок внутри чата и лимит параллельности обеспечивает SessionQueue.
+        """
+        in_progress: set[asyncio.Task] = set()
+        try:
+            while not stop.is_set():
                 try:
-                    queue.task_done()
-                except Exception:
-                    pass
-
-    await client.connect()
-    print(f"[worker][tg:{session_id}] connected")
-
-    consumer_task = asyncio.create_task(_consumer())
-    run_task = asyncio.create_task(client.run_until_disconnected())
-    stop_task = asyncio.create_task(stop.wait())
-
+                    batch = await queue.get_batch(timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+
+                t = asyncio.create_task(_process(batch))
+                in_progress.add(t)
+                t.add_done_callback(in_progress.discard)
+        finally:
+            for t in list(in_progress):
+                t.cancel()
+
+    consumer_task: asyncio.Task | None = None
+    acks_task: asyncio.Task | None = None
     try:
+        t0 = time.monotonic()
+        async with _get_connect_gate():
+            if CONNECT_JITTER_SEC > 0:
+                await asyncio.sleep(random.uniform(0, CONNECT_JITTER_SEC))
+            if stop.is_set():
+                return
+            await client.connect()
+            # отозванная сессия подключается без ошибок — проверяем сразу, а не на первом сообщении
+            if not await client.is_user_authorized():
+                raise SessionUnauthorizedError("session is not authorized")
+        connected.set()
+        METRICS.observe("worker_connect_wait_seconds", time.monotonic() - t0, session_id=session_id)
+        print(f"[worker][tg:{session_id}] connected")
+
+        consumer_task = asyncio.create_task(_consumer())
+        acks_task = asyncio.create_task(
+            sender.run_acks(stop, lambda chat_id, max_id: client.send_read_acknowledge(chat_id, max_id=max_id))
+        )
+        run_task = asyncio.create_task(client.run_until_disconnected())
+        stop_task = asyncio.create_task(stop.wait())
+
         done, pending = await asyncio.wait(
             {run_task, stop_task},
             return_when=asyncio.FIRST_COMPLETED,
@@ -300,7 +764,11 @@ async def tg_openai_loop(session_id: int, cfg: Dict[str, Any], client: TelegramC
 
     finally:
         stop.set()
-        consumer_task.cancel()
+        if consumer_task is not None:
+            consumer_task.cancel()
+        if acks_task is not None:
+            acks_task.cancel()
+        _resolve_done(queue.drain(), RuntimeError("session stopped"))
         try:
             await client.disconnect()
         except Exception:
@@ -308,6 +776,88 @@ async def tg_openai_loop(session_id: int, cfg: Dict[str, Any], client: TelegramC
         print(f"[worker][tg:{session_id}] stopped")
 
 
+def runtime_status(runtimes: Dict[int, TgRuntime]) -> Dict[str, Any]:
+    """/status: состояние супервизора по каждой известной сессии + очередь запущенных."""
+    sessions: Dict[str, Any] = {}
+    for sid in sorted(set(SUPERVISOR.keys()) | set(runtimes)):
+        item = SUPERVISOR.status(sid)
+        rt = runtimes.get(sid)
+        if rt is not None:
+            item["connected"] = rt.connected.is_set()
+            item["queue"] = {**rt.queue.stats(), **rt.sender.stats()}
+            item["queue"]["oldest_age_sec"] = round(rt.queue.oldest_age_sec(), 1)
+        sessions[str(sid)] = item
+    return {"running": len(runtimes), "sessions": sessions}
+
+
+def _runtime_samples(runtimes: Dict[int, TgRuntime]) -> list[Sample]:
+    """Gauge'и запущенных сессий — считаются в момент запроса /metrics."""
+    items = sorted(runtimes.items())
+    return [
+        ("worker_sessions_running", "gauge", "Telegram sessions running on this worker.", [({}, len(items))]),
+        (
+            "worker_queue_depth",
+            "gauge",
+            "Inbound messages waiting in the session queue.",
+            [({"session_id": sid}, rt.queue.qsize()) for sid, rt in items],
+        ),
+        (
+            "worker_queue_oldest_age_seconds",
+            "gauge",
+            "Age of the oldest waiting inbound message.",
+            [({"session_id": sid}, rt.queue.oldest_age_sec()) for sid, rt in items],
+        ),
+        (
+            "worker_queue_in_flight",
+            "gauge",
+            "Chats being processed right now.",
+            [({"session_id": sid}, rt.queue.in_flight()) for sid, rt in items],
+        ),
+        (
+            "worker_dialog_ref_cache",
+            "gauge",
+            "Client/dialog resolution cache: size and hit/miss/eviction counters.",
+            [({"stat": k}, v) for k, v in DIALOG_REF_CACHE.stats().items()],
+        ),
+        (
+            "worker_history_buffer",
+            "gauge",
+            "Recent-history ring buffer: dialogs, bytes held and hit/miss/eviction counters.",
+            [({"stat": k}, v) for k, v in HISTORY_BUFFER.stats().items()],
+        ),
+        (
+            "worker_batch_writer",
+            "gauge",
+            "Batched message/event writer: pending rows, flushes, written and failed rows.",
+            [({"stat": k}, v) for k, v in get_writer().stats().items()],
+        ),
+        (
+            "worker_resource_config_cache",
+            "gauge",
+            "OpenAI key / prompt settings cache: size, hit/miss/eviction counters and invalidations.",
+            [({"stat": k}, v) for k, v in RESOURCE_CONFIG_CACHE.stats().items()],
+        ),
+        (
+            "worker_openai_pool",
+            "gauge",
+            "Pooled OpenAI HTTP clients (one per API key): clients, requests in flight, opened/reused/evicted.",
+            [({"stat": k}, v) for k, v in OPENAI_POOL.stats().items()],
+        ),
+        (
+            "worker_send_waiting",
+            "gauge",
+            "Outbound Telegram calls waiting for the rate limiter.",
+            [({"session_id": sid}, rt.sender.stats()["send_waiting"]) for sid, rt in items],
+        ),
+        (
+            "worker_send_flood_wait",
+            "gauge",
+            "FloodWait errors received since the session started.",
+            [({"session_id": sid}, rt.sender.counters["flood_wait"]) for sid, rt in items],
+        ),
+    ]
+
+
 async def _stop_runtime(rt: TgRuntime) -> None:
     rt.stop.set()
     rt.task.cancel()
@@ -323,58 +873,118 @@ async def _stop_runtime(rt: TgRuntime) -> None:
         pass
 
 
-async def _sync_runtimes(runtimes: Dict[int, TgRuntime]) -> None:
-    active = await fetch_active_tg_sessions()
-
-    # stop removed / disabled / changed
+async def _sync_runtimes(
+    runtimes: Dict[int, TgRuntime],
+    *,
+    session_ids: set[int] | None = None,
+    resource_ids: set[int] | None = None,
+) -> list[int]:
+    """
+    Без аргументов — полная синхронизация.
+    С session_ids/resource_ids — сверяем только затронутые сессии, остальные не трогаем.
+    Возвращает id запущенных сессий (в порядке запуска: сначала с недавним трафиком).
+    """
+    partial = session_ids is not None or resource_ids is not None
+    active = await fetch_active_tg_sessions(session_ids=session_ids, resource_ids=resource_ids)
+    if not partial:
+        SUPERVISOR.retain(active)
+    for sid in session_ids or ():
+        if sid not in active:
+            # выключена / удалена — перезапускать нечего
+            SUPERVISOR.on_stop(sid)
+
+    # stop removed / disabled / reconnect-changed; reply-config changes apply in place
     for sid, rt in list(runtimes.items()):
+        if partial and not (
+            sid in (session_ids or ()) or int(rt.cfg["resource_id"]) in (resource_ids or ())
+        ):
+            continue
+
         cfg = active.get(sid)
         if not cfg:
             runtimes.pop(sid, None)
             await _stop_runtime(rt)
+            SUPERVISOR.on_stop(sid)
             continue
 
-        sig = _cfg_sig(
-            cfg["api_id"],
-            cfg["api_hash"],
-            cfg["session_string"],
-            cfg.get("openai_resource_id"),
-            cfg.get("prompt_resource_id"),
-            cfg.get("history_limit_messages"),
-        )
+        sig = _cfg_sig(cfg["api_id"], cfg["api_hash"], cfg["session_string"])
 
         if sig != rt.cfg_sig:
             runtimes.pop(sid, None)
             await _stop_runtime(rt)
-
-    # start new
-    for sid, cfg in active.items():
-        if sid in runtimes:
+            SUPERVISOR.on_stop(sid)
+            METRICS.inc("worker_runtime_restarts_total", session_id=sid, reason="reconnect")
             continue
 
+        await _apply_reply_cfg(sid, rt, cfg)
+
+    # start new: подключение ограничено _connect_gate, порядок очереди — по свежести трафика;
+    # упавшие ждут паузы супервизора, сессии в карантине — смены подписи подключения
+    new_ids = [
+        sid
+        for sid, cfg in active.items()
+        if sid not in runtimes
+        and SUPERVISOR.can_start(sid, _cfg_sig(cfg["api_id"], cfg["api_hash"], cfg["session_string"]))
+    ]
+    if len(new_ids) > 1:
+        try:
+            recent = await fetch_recent_traffic(new_ids)
+        except Exception as e:
+            recent = {}
+            print(f"[worker] recent traffic error: {e.__class__.__name__}: {e}")
+        new_ids.sort(key=lambda x: (-recent.get(x, 0.0), x))
+
+    for sid in new_ids:
+        cfg = active[sid]
+
         stop = asyncio.Event()
         client = TelegramClient(
             StringSession(cfg["session_string"]),
             cfg["api_id"],
             cfg["api_hash"],
         )
-        sig = _cfg_sig(
-            cfg["api_id"],
-            cfg["api_hash"],
-            cfg["session_string"],
-            cfg.get("openai_resource_id"),
-            cfg.get("prompt_resource_id"),
-            cfg.get("history_limit_messages"),
+        sig = _cfg_sig(cfg["api_id"], cfg["api_hash"], cfg["session_string"])
+
+        def _on_shed(reason: str, m: InboundMessage, _sid: int = sid) -> None:
+            METRICS.inc("worker_queue_shed_total", session_id=_sid, reason=reason)
+            print(f"[worker][tg:{_sid}] shed reason={reason} chat_id={m.chat_id} msg_ids={m.message_ids}")
+
+        queue = SessionQueue(
+            maxsize=QUEUE_MAXSIZE,
+            max_in_flight=cfg["max_concurrency"],
+            max_age_sec=QUEUE_MAX_AGE_SEC,
+            window_sec=cfg["burst_window_sec"],
+            max_window_sec=BURST_MAX_WAIT_SEC,
+            overload=QUEUE_OVERLOAD,
+            on_shed=_on_shed,
+        )
+        sender = SendScheduler(
+            rate_per_sec=SEND_RATE_PER_SEC,
+            burst=SEND_BURST,
+            max_retries=SEND_MAX_RETRIES,
+            ack_interval_sec=READ_ACK_INTERVAL_SEC,
+        )
+        connected = asyncio.Event()
+        task = asyncio.create_task(tg_openai_loop(sid, cfg, client, stop, queue, sender, connected))
+        SUPERVISOR.on_start(sid, sig)
+        METRICS.inc("worker_runtime_starts_total", session_id=sid)
+
+        runtimes[sid] = TgRuntime(
+            cfg_sig=sig,
+            cfg=cfg,
+            client=client,
+            stop=stop,
+            task=task,
+            queue=queue,
+            sender=sender,
+            connected=connected,
         )
-
-        task = asyncio.create_task(tg_openai_loop(sid, cfg, client, stop))
-
-        runtimes[sid] = TgRuntime(cfg_sig=sig, client=client, stop=stop, task=task)
 
         def _cleanup(t: asyncio.Task, _sid: int = sid) -> None:
             if t.cancelled():
                 return
 
+            # штатная остановка (_stop_runtime) сначала убирает сессию из runtimes
             rt2 = runtimes.get(_sid)
             if not (rt2 and rt2.task is t and t.done()):
                 return
@@ -386,25 +996,235 @@ async def _sync_runtimes(runtimes: Dict[int, TgRuntime]) -> None:
             except asyncio.CancelledError:
                 return
 
-            if exc:
-                print(f"[worker][tg:{_sid}] crashed: {exc.__class__.__name__}: {exc}")
+            # без исключения — Telegram разорвал соединение; для супервизора это тоже падение
+            error = f"{exc.__class__.__name__}: {exc}" if exc else "disconnected"
+            delay = SUPERVISOR.on_failure(_sid, error, auth=exc is not None and _is_auth_error(exc))
+            METRICS.inc("worker_runtime_restarts_total", session_id=_sid, reason="crash" if exc else "disconnect")
+            if delay is None:
+                METRICS.inc("worker_runtime_quarantined_total", session_id=_sid)
+                print(f"[worker][tg:{_sid}] quarantined: {error}")
+            else:
+                print(f"[worker][tg:{_sid}] crashed: {error}; restart in {delay:.0f}s")
 
         task.add_done_callback(_cleanup)
 
+    return new_ids
+
+
+async def _track_startup(started_at: float, rts: list[TgRuntime]) -> None:
+    """Время «до всех подключённых» после первой синхронизации: ждём connected или завершения каждой сессии."""
+
+    async def _one(rt: TgRuntime) -> bool:
+        wait_connected = asyncio.create_task(rt.connected.wait())
+        try:
+            await asyncio.wait({wait_connected, rt.task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wait_connected.cancel()
+        return rt.connected.is_set()
+
+    results = await asyncio.gather(*(_one(rt) for rt in rts))
+    elapsed = time.monotonic() - started_at
+    ok = sum(1 for x in results if x)
+
+    METRICS.set("worker_startup_duration_seconds", elapsed)
+    METRICS.set("worker_startup_sessions", ok, outcome="connected")
+    METRICS.set("worker_startup_sessions", len(results) - ok, outcome="failed")
+    print(f"[worker] startup: {ok}/{len(results)} sessions connected in {elapsed:.1f}s")
+
+
+def _register_job_handlers(runtimes: Dict[int, TgRuntime]) -> None:
+    """
+    inbound: из jobs -> в SessionQueue нужной сессии; задача завершается, когда пачка с этим сообщением обработана.
+    outbound: отправка ответа + сохранение; ошибка отправки -> повтор с backoff.
+    Сессия не запущена на этом воркере -> JobRelease: задача вернётся в очередь без траты попытки
+    (её возьмёт воркер с этой сессией или этот же, когда сессия поднимется).
+    """
+
+    def _runtime(job: LeasedJob) -> TgRuntime:
+        sid = int(job.payload.get("session_id") or 0)
+        rt = runtimes.get(sid)
+        if rt is None:
+            raise JobRelease(f"session {sid} is not running", delay_sec=JOBS_RELEASE_DELAY_SEC)
+        return rt
+
+    async def _handle_inbound(job: LeasedJob) -> None:
+        rt = _runtime(job)
+        p = job.payload
+        chat_id = int(p["chat_id"])
+
+        done = asyncio.get_running_loop().create_future()
+        inbound = InboundMessage(chat_id=chat_id, message_id=int(p["message_id"]), text=str(p["text"]), done=done)
+        if not await rt.queue.put(inbound):
+            await _send_busy(rt.sender, rt.client, int(p["session_id"]), chat_id)
+            return
+        await done
+
+    async def _handle_outbound(job: LeasedJob) -> None:
+        rt = _runtime(job)
+        p = job.payload
+        ref = DialogRef(**p["ref"]) if p.get("ref") else None
+        await _send_and_save(rt.sender, rt.client, int(p["session_id"]), int(p["chat_id"]), str(p.get("text") or ""), ref)
+
+    register_handler(JOB_QUEUE_INBOUND, _handle_inbound)
+    register_handler(JOB_QUEUE_OUTBOUND, _handle_outbound)
+
+
+def _change_scope(runtimes: Dict[int, TgRuntime], payloads: list[str]) -> tuple[set[int], set[int]]:
+    """
+    Уведомления UI -> (session_ids, resource_ids), которые нужно пересверить.
+    telegram/resource: сессии самого ресурса; openai/prompt/resource: запущенные сессии, которые на него ссылаются.
+    dialog: диалог очищен — сессии не трогаем, только сбрасываем кэш привязок и буфер истории.
+    openai/prompt/resource также сбрасывают RESOURCE_CONFIG_CACHE этого ресурса.
+    """
+    session_ids: set[int] = set()
+    resource_ids: set[int] = set()
+
+    for raw in payloads:
+        data = parse_config_payload(raw)
+        if not data:
+            continue
+
+        kind = str(data.get("kind") or "")
+        rid = int(data["resource_id"])
+
+        if kind == "dialog":
+            if data.get("dialog_id"):
+                invalidate_dialog_refs(dialog_id=int(data["dialog_id"]))
+                invalidate_dialog_history(int(data["dialog_id"]))
+            continue
+
+        if data.get("session_id"):
+            session_ids.add(int(data["session_id"]))
+
+        if kind in ("telegram", "resource"):
+            resource_ids.add(rid)
+
+        if kind in ("openai", "prompt", "resource"):
+            invalidate_resource_config(rid)
+            keys = ("openai_resource_id", "prompt_resource_id") if kind == "resource" else (f"{kind}_resource_id",)
+            for sid, rt in runtimes.items():
+                if any(rt.cfg.get(k) == rid for k in keys):
+                    session_ids.add(sid)
+
+    return session_ids, resource_ids
+
 
 async def main_async() -> None:
     runtimes: Dict[int, TgRuntime] = {}
+    changes: asyncio.Queue[str] = asyncio.Queue()
+    listener = None
+    loop = asyncio.get_running_loop()
+    next_full_sync = 0.0
+    startup_task: asyncio.Task | None = None
+
+    # словарь tiktoken — до запуска сессий, чтобы первый ответ не грузил его внутри event loop
+    await preload_encoding()
+
+    metrics_server = None
+    if METRICS_PORT > 0:
+        METRICS.add_collector(lambda: _runtime_samples(runtimes))
+        metrics_server = await serve_http(
+            METRICS_HOST,
+            METRICS_PORT,
+            {
+                "/metrics": lambda: (PROMETHEUS_CONTENT_TYPE, METRICS.render()),
+                "/status": lambda: ("application/json", json.dumps(runtime_status(runtimes), ensure_ascii=False)),
+            },
+        )
+        print(f"[worker] metrics on {METRICS_HOST}:{METRICS_PORT}/metrics, /status")
+
+    jobs_stop = asyncio.Event()
+    jobs_task: asyncio.Task | None = None
+    if DURABLE_QUEUE:
+        _register_job_handlers(runtimes)
+        runner = JobRunner(
+            [JOB_QUEUE_INBOUND, JOB_QUEUE_OUTBOUND],
+            concurrency=JOBS_CONCURRENCY,
+            lease_sec=JOBS_LEASE_SEC,
+            retention_sec=JOBS_RETENTION_HOURS * 3600,
+            purge_interval_sec=JOBS_PURGE_INTERVAL_SEC,
+        )
+        jobs_task = asyncio.create_task(runner.run(jobs_stop))
 
-    while True:
-        try:
-            await _sync_runtimes(runtimes)
-        except Exception as e:
-            print(f"[worker] sync error: {e.__class__.__name__}: {e}")
+    try:
+        while True:
+            if listener is None or listener.is_closed():
+                try:
+                    listener = await listen(CONFIG_CHANNEL, changes.put_nowait)
+                    # пока слушателя не было, уведомления могли потеряться — пересчитываем всё
+                    next_full_sync = 0.0
+                    RESOURCE_CONFIG_CACHE.clear()
+                    print(f"[worker] listening {CONFIG_CHANNEL}")
+                except Exception as e:
+                    listener = None
+                    print(f"[worker] listen error: {e.__class__.__name__}: {e}")
 
+            if loop.time() >= next_full_sync:
+                try:
+                    t0 = time.monotonic()
+                    started = await _sync_runtimes(runtimes)
+                    if startup_task is None:
+                        startup_task = asyncio.create_task(
+                            _track_startup(t0, [runtimes[sid] for sid in started if sid in runtimes])
+                        )
+                except Exception as e:
+                    print(f"[worker] sync error: {e.__class__.__name__}: {e}")
+                next_full_sync = loop.time() + SYNC_INTERVAL_SEC
+
+            # у упавших сессий закончилась пауза — перезапускаем, не дожидаясь полной синхронизации
+            due = SUPERVISOR.due()
+            if due:
+                try:
+                    await _sync_runtimes(runtimes, session_ids=set(due))
+                except Exception as e:
+                    SUPERVISOR.postpone(due, LISTEN_RETRY_SEC)
+                    print(f"[worker] sync error: {e.__class__.__name__}: {e}")
+
+            timeout = max(0.0, next_full_sync - loop.time())
+            if listener is None:
+                timeout = min(timeout, LISTEN_RETRY_SEC)
+            next_due = SUPERVISOR.next_due_in()
+            if next_due is not None:
+                timeout = min(timeout, next_due + 0.1)
+
+            try:
+                raw = await asyncio.wait_for(changes.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                continue
+            except asyncio.CancelledError:
+                return
+
+            payloads = [raw]
+            while not changes.empty():
+                payloads.append(changes.get_nowait())
+
+            session_ids, resource_ids = _change_scope(runtimes, payloads)
+            if not (session_ids or resource_ids):
+                continue
+
+            try:
+                await _sync_runtimes(runtimes, session_ids=session_ids, resource_ids=resource_ids)
+            except Exception as e:
+                print(f"[worker] sync error: {e.__class__.__name__}: {e}")
+    finally:
+        jobs_stop.set()
+        if jobs_task is not None:
+            jobs_task.cancel()
+        if startup_task is not None:
+            startup_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        # fire-and-forget строки, ещё не ушедшие в БД
         try:
-            await asyncio.sleep(SYNC_INTERVAL_SEC)
-        except asyncio.CancelledError:
-            return
+            await get_writer().flush()
+        except Exception as e:
+            print(f"[worker] writer flush error: {e.__class__.__name__}: {e}")
+        await OPENAI_POOL.aclose()
+        if listener is not None:
+            try:
+                await listener.close()
+            except Exception:
+                pass
 
 
 def main() -> None:
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.storage.messages import (
+    DIALOG_REF_CACHE,
+    _client_code,
+    _history_by_identity_stmt,
+    _upsert_dialog_ref_stmt,
+    load_dialog_history,
+    resolve_dialog_ref,
+)
+
+
+def _sql(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_client_code_is_collision_free_for_long_external_ids():
+    a = "x" * 60 + "a"
+    b = "x" * 60 + "b"
+
+    assert _client_code("tg", 5, "123") == "tg:5:123"
+    assert _client_code("tilda", 5, a) != _client_code("tilda", 5, b)
+    assert all(len(_client_code(k, 5, e)) <= 64 for k in ("tg", "k" * 32) for e in (a, b))
+
+
+def test_upsert_does_not_claim_existing_clients_and_filters_disabled():
+    sql = _sql(
+        _upsert_dialog_ref_stmt(company_id=1, resource_id=2, kind="tg", external_id="3", dialog_meta={})
+    )
+
+    assert "ON CONFLICT ON CONSTRAINT uq_clients_company_code DO NOTHING" in sql
+    assert "DO UPDATE" not in sql
+    ident = sql[sql.index("ident AS") : sql.index("new_client AS")]
+    for predicate in ("clients.is_enabled IS true", "client_identities.kind =", "client_identities.is_enabled IS true"):
+        assert predicate in ident
+
+
+def test_history_lookup_filters_disabled_clients():
+    sql = _sql(
+        _history_by_identity_stmt(company_id=1, resource_id=2, session_id=None, kind="tg", external_id="3", limit_messages=5)
+    )
+
+    for predicate in ("clients.is_enabled IS true", "client_identities.kind =", "client_identities.is_enabled IS true"):
+        assert predicate in sql
+
+
+class _Result:
+    def __init__(self, row):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+    def first(self):
+        return self.row
+
+    def all(self):
+        return [self.row] if self.row is not None else []
+
+
+class FakeDB:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.calls = 0
+
+    async def execute(self, stmt):
+        self.calls += 1
+        return _Result(self.rows.pop(0))
+
+
+def _resolve(db):
+    DIALOG_REF_CACHE.clear()
+    return asyncio.run(
+        resolve_dialog_ref(db, company_id=1, resource_id=2, session_id=None, kind="tg", external_id="3")
+    )
+
+
+def test_taken_client_code_is_reread_once():
+    # параллельный запрос создал этого клиента: повтор statement'а видит его identity
+    db = FakeDB([(None, None, None), (10, 20, None)])
+
+    ref = _resolve(db)
+
+    assert (ref.client_id, ref.dialog_id) == (10, 20)
+    assert db.calls == 2
+
+
+def test_foreign_client_code_raises():
+    db = FakeDB([(None, None, None), (None, None, None)])
+
+    with pytest.raises(RuntimeError):
+        _resolve(db)
+
+
+def test_load_dialog_history_survives_expired_cache_entry(monkeypatch):
+    # кэш говорит «привязка есть», но к моменту чтения её нет: resolve(create=False) -> None
+    calls = {"n": 0}
+
+    def fake_get(key, default=None):
+        calls["n"] += 1
+        return (10, 20) if calls["n"] == 1 else default
+
+    monkeypatch.setattr(DIALOG_REF_CACHE, "get", fake_get)
+    # create=False lookup -> None, history-by-identity -> пусто, upsert -> новый диалог
+    db = FakeDB([None, None, (10, None, 21)])
+
+    ref, msgs = asyncio.run(
+        load_dialog_history(db, company_id=1, resource_id=2, session_id=None, kind="tg", external_id="3", limit_messages=5)
+    )
+
+    assert (ref.client_id, ref.dialog_id) == (10, 21)
+    assert msgs == []
@@ -0,0 +1,117 @@
+"""
+EXPLAIN-проверка запросов истории: они должны идти по ix_messages_history (или по его экземплярам
+в секциях messages) без Sort над messages.
+
+Нужна БД с применёнными миграциями: DATABASE_URL=postgresql+asyncpg://... python -m pytest tests/test_history_plans.py
+Без DATABASE_URL модуль пропускается. enable_seqscan выключается на время проверки: на маленькой таблице
+планировщик честно выбрал бы Seq Scan, а нас интересует, что индекс вообще применим.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.models.message import Message
+from src.storage.messages import _history_by_identity_stmt, _history_filter
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+INDEX_NAME = "ix_messages_history"
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL не задан")
+
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans") or []:
+        yield from _nodes(child)
+
+
+def _is_messages(relation: str | None) -> bool:
+    # messages секционирована: в плане фигурируют секции messages_pYYYY_MM / messages_default
+    return relation == "messages" or (relation or "").startswith("messages_")
+
+
+def _statements(dialog_id: int, resource_id: int, session_id: int) -> dict:
+    return {
+        "load_history": _history_filter(
+            select(Message),
+            dialog_id=dialog_id,
+            resource_id=resource_id,
+            session_id=session_id,
+        ).limit(20),
+        "load_dialog_history": _history_by_identity_stmt(
+            company_id=1,
+            resource_id=resource_id,
+            session_id=session_id,
+            kind="tg",
+            external_id="0",
+            limit_messages=20,
+        ),
+    }
+
+
+async def _plans() -> tuple[dict[str, dict], set[str]]:
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        async with engine.connect() as conn:
+            # реальные значения, если есть; иначе условные — план от этого не зависит
+            row = (
+                await conn.execute(
+                    select(Message.dialog_id, Message.resource_id, Message.session_id)
+                    .where(Message.resource_id.is_not(None))
+                    .order_by(Message.id.desc())
+                    .limit(1)
+                )
+            ).first()
+            dialog_id, resource_id, session_id = row if row else (1, 1, 1)
+
+            # у каждой секции свой экземпляр индекса с автоматическим именем
+            index_names = {INDEX_NAME} | set(
+                (
+                    await conn.execute(
+                        text(
+                            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                            "WHERE i.inhparent = CAST(:idx AS regclass)"
+                        ),
+                        {"idx": INDEX_NAME},
+                    )
+                ).scalars().all()
+            )
+
+            await conn.execute(text("SET LOCAL enable_seqscan = off"))
+            plans = {}
+            for name, stmt in _statements(int(dialog_id), int(resource_id), session_id).items():
+                sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+                raw = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()
+                data = raw if isinstance(raw, list) else json.loads(raw)
+                plans[name] = data[0]["Plan"]
+            await conn.rollback()
+    finally:
+        await engine.dispose()
+    return plans, index_names
+
+
+@pytest.fixture(scope="module")
+def history_plans():
+    return asyncio.run(_plans())
+
+
+@pytest.mark.parametrize("name", ["load_history", "load_dialog_history"])
+def test_history_uses_index_without_sort(history_plans, name):
+    plans, index_names = history_plans
+    nodes = list(_nodes(plans[name]))
+    dump = json.dumps(plans[name], indent=2, ensure_ascii=False, default=str)
+
+    assert any(n.get("Index Name") in index_names for n in nodes), dump
+    assert not any(
+        n.get("Node Type") in ("Sort", "Incremental Sort")
+        and any(_is_messages(c.get("Relation Name")) for c in _nodes(n))
+        for n in nodes
+    ), dump
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+
+from src.core.http_pool import ClientPool
+
+
+def _pool(max_clients: int = 2) -> tuple[ClientPool, list[str]]:
+    pool = ClientPool(base_url="https://api.test/v1", max_clients=max_clients)
+    seen: list[str] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.headers["Authorization"])
+        return httpx.Response(200, json={})
+
+    def new_client(key: str) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=pool.base_url,
+            headers={"Authorization": f"Bearer {key}"},
+            transport=httpx.MockTransport(handler),
+        )
+
+    pool._new_client = new_client
+    return pool, seen
+
+
+def test_uncached_request_does_not_touch_lru():
+    async def run():
+        pool, seen = _pool(max_clients=2)
+        for key in ("a", "b"):
+            async with pool.client(key) as c:
+                await c.get("/models")
+        live = {k: e.client for k, e in pool._clients.items()}
+
+        for key in ("x", "y", "z"):
+            async with pool.client(key, cache=False) as c:
+                assert (await c.get("/models")).status_code == 200
+
+        # известный ключ — тем же клиентом, без сдвига в LRU
+        async with pool.client("a", cache=False) as c:
+            assert c is live["a"]
+        return pool, live, seen
+
+    pool, live, seen = asyncio.run(run())
+
+    assert list(pool._clients) == ["a", "b"]
+    assert all(pool._clients[k].client is live[k] and not live[k].is_closed for k in live)
+    assert pool.stats()["evicted"] == 0
+    assert pool.stats()["transient"] == 3
+    assert seen[2:] == ["Bearer x", "Bearer y", "Bearer z"]
+
+
+def test_cached_clients_are_evicted_lru():
+    async def run():
+        pool, _ = _pool(max_clients=2)
+        for key in ("a", "b", "c"):
+            async with pool.client(key) as c:
+                await c.get("/models")
+        return pool
+
+    pool = asyncio.run(run())
+
+    assert list(pool._clients) == ["b", "c"]
+    assert pool.stats()["evicted"] == 1
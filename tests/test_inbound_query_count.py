@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.core.queues import InboundMessage
+from src.storage.messages import DIALOG_REF_CACHE, HISTORY_BUFFER
+from src.worker import _save_inbound_batch
+
+# обещанный бюджет (см. _save_inbound_batch): история + INSERT пачки; первый контакт — ещё upsert client/dialog
+BUDGET_FIRST_CONTACT = 3
+BUDGET_STEADY = 2
+BUDGET_WARM = 1
+
+CLIENT_ID = 10
+DIALOG_ID = 20
+
+
+def _attr(name: str):
+    return SimpleNamespace(name=name, type=SimpleNamespace(oid=0))
+
+
+# запросы диалекта при первом подключении
+_INIT = {
+    "select pg_catalog.version()": "PostgreSQL 16.0 on x86_64-pc-linux-gnu",
+    "show standard_conforming_strings": "on",
+    "show transaction isolation level": "read committed",
+    "select current_schema()": "public",
+    "select 1": 1,
+}
+
+
+def _top_level_columns(sql: str) -> list[str]:
+    """Имена колонок результата: список SELECT (или RETURNING) верхнего уровня, без CTE и подзапросов."""
+    depth, i, n = 0, 0, len(sql)
+    start = end = None
+    while i < n:
+        ch = sql[i]
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            if start is None and sql.startswith(("SELECT ", "RETURNING "), i):
+                start = sql.index(" ", i) + 1
+            elif start is not None and re.match(r"\s(FROM|ORDER BY|LIMIT)\b", sql[i:]):
+                end = i
+                break
+        i += 1
+    if start is None:
+        return []
+
+    cols, depth, cur = [], 0, ""
+    for ch in sql[start:end]:
+        if ch == "," and depth == 0:
+            cols.append(cur)
+            cur = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur += ch
+    cols.append(cur)
+    return [c.strip().split(" AS ")[-1].split(".")[-1] for c in cols]
+
+
+class FakePrepared:
+    def __init__(self, conn: "FakeAsyncpgConnection", sql: str) -> None:
+        self.conn = conn
+        self.sql = sql
+        if sql.startswith(tuple(_INIT)):
+            self.columns = ["x"]
+        elif sql.startswith("INSERT"):
+            self.columns = _top_level_columns("RETURNING " + sql.split(" RETURNING ")[-1]) if " RETURNING " in sql else []
+        else:
+            self.columns = _top_level_columns(sql)
+        self._status = "SELECT 0"
+
+    def get_attributes(self):
+        return [_attr(c) for c in self.columns]
+
+    def _values(self, **known):
+        # "id AS id__1" — sentinel-колонка insertmanyvalues
+        return tuple(known.get(re.sub(r"__\d+$", "", c)) for c in self.columns)
+
+    async def fetch(self, *params):
+        sql = self.sql
+        for prefix, value in _INIT.items():
+            if sql.startswith(prefix):
+                return [(value,)]
+        if "new_dialog" in sql:
+            # upsert identity -> client -> dialog: диалог создан этим statement
+            self.conn.dialog_exists = True
+            return [(CLIENT_ID, None, DIALOG_ID)]
+        if sql.startswith("WITH d AS"):
+            # identity -> dialog -> история: диалог без сообщений — одна строка с пустым сообщением
+            if not self.conn.dialog_exists:
+                return []
+            return [self._values(client_id=CLIENT_ID, dialog_id=DIALOG_ID)]
+        if sql.startswith("INSERT"):
+            # строк столько, сколько наборов параметров "($1, ...)" в VALUES
+            n = len(re.findall(r"\(\$\d+", sql)) or 1
+            rows = []
+            for i in range(n):
+                self.conn.next_id += 1
+                rows.append(self._values(id=self.conn.next_id, created_at=datetime.now(timezone.utc)))
+            self._status = f"INSERT 0 {n}"
+            return rows
+        return []
+
+    def get_statusmsg(self):
+        return self._status
+
+
+class FakeTransaction:
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeAsyncpgConnection:
+    """Минимум asyncpg.Connection, который нужен диалекту postgresql+asyncpg; ответы — по тексту SQL."""
+
+    def __init__(self) -> None:
+        self.dialog_exists = False
+        self.next_id = 0
+
+    async def set_type_codec(self, *args, **kwargs):
+        pass
+
+    def transaction(self, **kwargs):
+        return FakeTransaction()
+
+    async def prepare(self, sql, name=None):
+        return FakePrepared(self, sql)
+
+    async def reload_schema_state(self):
+        pass
+
+    def is_closed(self):
+        return False
+
+    async def close(self, timeout=None):
+        pass
+
+    def terminate(self):
+        pass
+
+
+def _json_codec_patch(monkeypatch):
+    # у диалекта свои хелперы для json-кодеков: для фейка — no-op
+    from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+
+    async def _noop(self, conn):
+        return None
+
+    monkeypatch.setattr(PGDialect_asyncpg, "setup_asyncpg_json_codec", _noop)
+    monkeypatch.setattr(PGDialect_asyncpg, "setup_asyncpg_jsonb_codec", _noop)
+
+
+@pytest.fixture
+def run_batches(monkeypatch):
+    _json_codec_patch(monkeypatch)
+    DIALOG_REF_CACHE.clear()
+    HISTORY_BUFFER.pop_where(lambda _key: True)
+
+    fake = FakeAsyncpgConnection()
+
+    async def _connect():
+        return fake
+
+    async def run(batches: list[list[str]]) -> list[list[str]]:
+        engine = create_async_engine("postgresql+asyncpg://u:p@localhost/db", async_creator=_connect)
+        statements: list[str] = []
+        counting = False
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            if counting:
+                statements.append(statement)
+
+        sm = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
+        rcfg = {"company_id": 1, "resource_id": 2, "history_limit_messages": 20}
+        per_batch: list[list[str]] = []
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("select 1")  # initialize диалекта — не в счёт
+
+        next_msg = 100
+        for texts in batches:
+            batch = []
+            for t in texts:
+                next_msg += 1
+                batch.append(InboundMessage(chat_id=555, message_id=next_msg, text=t))
+            statements.clear()
+            counting = True
+            async with sm() as db:
+                await _save_inbound_batch(db, rcfg, 7, 555, batch)
+            counting = False
+            per_batch.append(list(statements))
+        await engine.dispose()
+        return per_batch
+
+    yield lambda batches: asyncio.run(run(batches))
+    DIALOG_REF_CACHE.clear()
+    HISTORY_BUFFER.pop_where(lambda _key: True)
+
+
+def _inserts(stmts: list[str]) -> list[str]:
+    return [s for s in stmts if s.startswith("INSERT INTO messages")]
+
+
+def test_first_contact_batch_within_budget(run_batches):
+    (stmts,) = run_batches([["a", "b", "c"]])
+
+    assert len(stmts) <= BUDGET_FIRST_CONTACT, stmts
+    # вся пачка — одним INSERT, а не по строке
+    assert len(_inserts(stmts)) == 1
+
+
+def test_steady_state_batches_within_budget(run_batches):
+    first, second, third = run_batches([["hi"], ["a", "b", "c"], ["d", "e"]])
+
+    assert len(first) <= BUDGET_FIRST_CONTACT, first
+    # созданная в транзакции привязка не кэшируется: следующая пачка перечитывает её вместе с историей
+    assert len(second) <= BUDGET_STEADY, second
+    # привязка в кэше, история в HISTORY_BUFFER — остаётся только INSERT пачки
+    assert len(third) <= BUDGET_WARM, third
+    assert all(len(_inserts(b)) == 1 for b in (first, second, third))
+
+
+def test_cold_history_batch_within_budget(run_batches):
+    run_batches([["hi"], ["again"]])
+    HISTORY_BUFFER.pop_where(lambda _key: True)
+
+    (stmts,) = run_batches([["a", "b", "c", "d"]])
+
+    # привязка из кэша, история — одним запросом, пачка — одним INSERT
+    assert len(stmts) <= BUDGET_STEADY, stmts
+    assert len(_inserts(stmts)) == 1
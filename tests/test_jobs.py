@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import src.core.jobs as jobs_mod
+from src.core.jobs import JobRelease, JobRunner, register_handler
+from src.storage.jobs import LeasedJob
+
+
+class _Result:
+    rowcount = 1
+
+
+class FakeDB:
+    def __init__(self, log: list[str]) -> None:
+        self.log = log
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, params=None):
+        self.log.append(str(stmt.compile(dialect=postgresql.dialect())))
+        return _Result()
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def sql_log(monkeypatch):
+    log: list[str] = []
+    monkeypatch.setattr(jobs_mod, "get_sessionmaker", lambda: (lambda: FakeDB(log)))
+    return log
+
+
+def _job(queue: str) -> LeasedJob:
+    return LeasedJob(id=7, company_id=1, queue=queue, payload={}, attempts=1, max_attempts=5)
+
+
+def _run(queue: str, handler) -> None:
+    register_handler(queue, handler)
+    asyncio.run(JobRunner([queue], worker_id="w1")._run_one(_job(queue)))
+
+
+def test_complete_job_only_if_still_leased_by_this_worker(sql_log):
+    async def ok(_job):
+        return None
+
+    _run("test_ok", ok)
+
+    assert len(sql_log) == 1
+    sql = sql_log[0]
+    assert "SET status=%(status)s" in sql
+    assert "jobs.status = %(status_1)s" in sql and "jobs.locked_by = %(locked_by_1)s" in sql
+
+
+def test_fail_job_only_if_still_leased_by_this_worker(sql_log):
+    async def boom(_job):
+        raise ValueError("boom")
+
+    _run("test_fail", boom)
+
+    assert len(sql_log) == 1
+    assert "jobs.locked_by = %(locked_by_1)s" in sql_log[0]
+
+
+def test_release_returns_attempt(sql_log):
+    async def elsewhere(_job):
+        raise JobRelease("session 3 is not running", delay_sec=1)
+
+    _run("test_release", elsewhere)
+
+    assert len(sql_log) == 1
+    sql = sql_log[0]
+    assert "attempts=greatest(jobs.attempts - %(attempts_1)s" in sql
+    assert "jobs.locked_by = %(locked_by_1)s" in sql
+    assert "last_error" in sql
+
+
+def test_purge_finished_jobs_deletes_in_batches():
+    from src.storage.jobs import purge_finished_jobs
+
+    class _Deleted:
+        def __init__(self, n):
+            self.rowcount = n
+
+    class PurgeDB:
+        def __init__(self, counts):
+            self.counts = list(counts)
+            self.sql: list[str] = []
+            self.commits = 0
+
+        async def execute(self, stmt, params=None):
+            self.sql.append(str(stmt.compile(dialect=postgresql.dialect())))
+            return _Deleted(self.counts.pop(0))
+
+        async def commit(self):
+            self.commits += 1
+
+    db = PurgeDB([100, 100, 7])
+    n = asyncio.run(purge_finished_jobs(db, older_than_sec=3600, batch_size=100))
+
+    assert n == 207
+    assert db.commits == 3
+    sql = db.sql[0]
+    assert sql.startswith("DELETE FROM jobs WHERE jobs.id IN (SELECT jobs.id")
+    assert "jobs.status IN ('done', 'failed')" in sql
+    assert "FOR UPDATE SKIP LOCKED" in sql
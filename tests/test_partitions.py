@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from src.storage.partitions import ensure_partitions, move_rows_sql
+
+
+class _Result:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self._rows)
+
+    def scalar(self):
+        return self._rows[0] if self._rows else None
+
+
+class FakeConn:
+    """Записывает SQL; отвечает на запросы, которые делает ensure_partitions."""
+
+    def __init__(self, *, columns: list[str], stray: bool) -> None:
+        self.columns = columns
+        self.stray = stray
+        self.sql: list[str] = []
+
+    async def execute(self, stmt, params=None):
+        sql = str(stmt)
+        self.sql.append(sql)
+        if "pg_inherits" in sql:
+            return _Result([])
+        if "information_schema.columns" in sql:
+            assert "is_generated = 'NEVER'" in sql
+            return _Result(self.columns)
+        if sql.startswith("SELECT EXISTS"):
+            return _Result([self.stray])
+        return _Result([])
+
+
+def test_move_rows_sql_lists_columns_and_compiles():
+    sql = move_rows_sql("messages", "messages_default", ["id", "dialog_id", "text", "created_at"])
+
+    assert "SELECT *" not in sql
+    assert "text_tsv" not in sql
+    assert sql.startswith('INSERT INTO messages ("id", "dialog_id", "text", "created_at") SELECT "id"')
+
+    compiled = str(text(sql).compile(dialect=postgresql.dialect()))
+    assert "%(lo)s" in compiled and "%(hi)s" in compiled
+
+
+def test_ensure_partitions_moves_stray_rows_without_generated_columns():
+    conn = FakeConn(columns=["id", "dialog_id", "direction", "text", "created_at"], stray=True)
+    now = datetime(2026, 10, 16, tzinfo=timezone.utc)
+
+    created = asyncio.run(ensure_partitions(conn, "messages", months_ahead=0, now=now))
+
+    assert created == ["messages_p2026_10"]
+    inserts = [s for s in conn.sql if s.startswith("INSERT INTO messages")]
+    assert len(inserts) == 1
+    assert "SELECT *" not in inserts[0]
+    assert "text_tsv" not in inserts[0]
+    # порядок: DETACH default -> CREATE -> INSERT -> DELETE -> ATTACH default
+    ddl = [s.split()[0] + " " + s.split()[1] for s in conn.sql if not s.startswith("SELECT")]
+    assert ddl == ["ALTER TABLE", "CREATE TABLE", "INSERT INTO", "DELETE FROM", "ALTER TABLE"]
+
+
+def test_ensure_partitions_without_stray_rows_skips_move():
+    conn = FakeConn(columns=["id"], stray=False)
+    now = datetime(2026, 10, 16, tzinfo=timezone.utc)
+
+    asyncio.run(ensure_partitions(conn, "messages", months_ahead=1, now=now))
+
+    assert not any(s.startswith("INSERT") for s in conn.sql)
+    assert not any("information_schema" in s for s in conn.sql)
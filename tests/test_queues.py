@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from src.core.queues import OVERLOAD_COALESCE, InboundMessage, SessionQueue
+
+
+def _msg(loop: asyncio.AbstractEventLoop, message_id: int, text: str, *, chat_id: int = 1) -> InboundMessage:
+    return InboundMessage(chat_id=chat_id, message_id=message_id, text=text, done=loop.create_future())
+
+
+def test_coalesce_keeps_all_message_ids():
+    async def run():
+        loop = asyncio.get_running_loop()
+        q = SessionQueue(maxsize=1, overload=OVERLOAD_COALESCE)
+        for i, t in ((1, "a"), (2, "b"), (3, "c")):
+            assert await q.put(_msg(loop, i, t))
+        return await q.get_batch(timeout=1)
+
+    (batch,) = asyncio.run(run())
+
+    assert batch.message_id == 3
+    assert batch.message_ids == [1, 2, 3]
+    assert batch.text == "a\nb\nc"
+
+
+def test_coalesced_done_follows_surviving_entry():
+    async def run():
+        loop = asyncio.get_running_loop()
+        q = SessionQueue(maxsize=1, overload=OVERLOAD_COALESCE)
+        first, second = _msg(loop, 1, "a"), _msg(loop, 2, "b")
+        await q.put(first)
+        await q.put(second)
+
+        # склеенное сообщение ещё не обработано
+        await asyncio.sleep(0)
+        assert not second.done.done()
+        assert q.shed["coalesced"] == 1
+
+        (entry,) = await q.get_batch(timeout=1)
+        entry.done.set_result(None)
+        await asyncio.sleep(0)
+        return second.done.result()
+
+    assert asyncio.run(run()) is None
+
+
+def test_coalesced_done_gets_shed_reason_of_surviving_entry():
+    async def run():
+        loop = asyncio.get_running_loop()
+        q = SessionQueue(maxsize=1, overload=OVERLOAD_COALESCE)
+        first, second = _msg(loop, 1, "a", chat_id=1), _msg(loop, 2, "b", chat_id=1)
+        await q.put(first)
+        await q.put(second)
+        # другой чат при полной очереди: склеивать не с чем — вытесняется старейшая запись
+        await q.put(_msg(loop, 3, "c", chat_id=2))
+        await asyncio.sleep(0)
+        return first.done.result(), second.done.result()
+
+    assert asyncio.run(run()) == ("drop_oldest", "drop_oldest")
+
+
+def test_debounce_wait_is_capped_from_first_message():
+    async def run(max_window_sec: float):
+        q = SessionQueue(window_sec=5, max_window_sec=max_window_sec)
+        now = time.monotonic()
+        # клиент пишет чаще окна: последнее сообщение только что, первое — 11 с назад
+        await q.put(InboundMessage(chat_id=1, message_id=1, text="a", received_at=now - 11))
+        await q.put(InboundMessage(chat_id=1, message_id=2, text="b", received_at=now))
+        try:
+            return [m.message_id for m in await q.get_batch(timeout=0.05)]
+        except asyncio.TimeoutError:
+            return None
+
+    assert asyncio.run(run(0)) is None
+    assert asyncio.run(run(10)) == [1, 2]
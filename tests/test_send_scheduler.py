@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telethon.errors import FloodWaitError
+
+import src.core.send_scheduler as send_scheduler_mod
+from src.core.send_scheduler import SendScheduler
+
+
+@pytest.fixture(autouse=True)
+def fake_clock(monkeypatch):
+    """Паузы (FloodWait, backoff) без реального ожидания: sleep только двигает часы."""
+    now = {"t": 1000.0}
+    real_sleep = asyncio.sleep
+
+    async def _sleep(sec):
+        now["t"] += max(0.0, float(sec))
+        await real_sleep(0)
+
+    monkeypatch.setattr(send_scheduler_mod, "time", SimpleNamespace(monotonic=lambda: now["t"]))
+    monkeypatch.setattr(send_scheduler_mod.asyncio, "sleep", _sleep)
+    return now
+
+
+def _flood(seconds: int) -> FloodWaitError:
+    return FloodWaitError(request=None, capture=seconds)
+
+
+def _call(errors: list[BaseException]):
+    calls = {"n": 0}
+
+    async def call():
+        calls["n"] += 1
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    return call, calls
+
+
+def test_flood_wait_does_not_spend_retries():
+    s = SendScheduler(rate_per_sec=1000, burst=100, max_retries=1, max_flood_wait_sec=60)
+    call, calls = _call([_flood(30) for _ in range(5)])
+
+    assert asyncio.run(s.send(call)) == "ok"
+    assert calls["n"] == 6
+    assert s.counters["flood_wait"] == 5
+    assert s.counters["failed"] == 0
+
+
+def test_flood_wait_over_cap_raises():
+    s = SendScheduler(rate_per_sec=1000, burst=100, max_retries=5, max_flood_wait_sec=60)
+    call, calls = _call([_flood(3600)])
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(s.send(call))
+    assert calls["n"] == 1
+
+
+def test_network_errors_limited_by_max_retries():
+    s = SendScheduler(rate_per_sec=1000, burst=100, max_retries=2)
+    call, calls = _call([ConnectionError("x") for _ in range(5)])
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(s.send(call, idempotent=True))
+    assert calls["n"] == 3
+
+
+def test_idempotent_call_retried_after_network_error():
+    s = SendScheduler(rate_per_sec=1000, burst=100, max_retries=2)
+    call, calls = _call([asyncio.TimeoutError()])
+
+    assert asyncio.run(s.send(call, idempotent=True)) == "ok"
+    assert calls["n"] == 2
+    assert s.counters["retry"] == 1
+
+
+def test_new_message_not_retried_after_network_error():
+    # сообщение могло дойти до Telegram до обрыва — повтор дал бы дубль
+    s = SendScheduler(rate_per_sec=1000, burst=100, max_retries=5)
+    call, calls = _call([asyncio.TimeoutError()])
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(s.send(call))
+    assert calls["n"] == 1
+    assert s.counters["retry"] == 0
+    assert s.counters["failed"] == 1
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import asyncio
+
+from src.core import tokens
+from src.core.tokens import TOKEN_COUNT_CACHE, count_tokens
+
+
+def test_count_cache_is_keyed_by_digest():
+    text = "длинное сообщение " * 500
+    n = count_tokens(text)
+
+    keys = list(TOKEN_COUNT_CACHE._data)
+    assert text not in keys
+    assert tokens._cache_key(text) in keys
+    assert all(isinstance(k, bytes) and len(k) == 16 for k in keys)
+    assert count_tokens(text) == n
+
+
+def test_preload_encoding_runs_off_loop(monkeypatch):
+    seen = []
+    monkeypatch.setattr(tokens, "_get_encoding", lambda: seen.append(1) or None)
+
+    assert asyncio.run(tokens.preload_encoding()) is False
+    assert seen == [1]
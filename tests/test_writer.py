@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import src.storage.writer as writer_mod
+from src.models.message import Message
+from src.storage.writer import BatchWriter
+
+
+class _Result:
+    def __init__(self, ids):
+        self._ids = ids
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return list(self._ids)
+
+
+class FakeDB:
+    """Сессия BatchWriter: строка с dialog_id < 0 — нарушение FK, down=True — БД недоступна."""
+
+    def __init__(self, state: dict) -> None:
+        self.state = state
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, rows):
+        self.state["statements"] += 1
+        if self.state["down"]:
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+        if any(r["dialog_id"] < 0 for r in rows):
+            raise IntegrityError("INSERT", {}, Exception("fk violation"))
+        ids = []
+        for _ in rows:
+            self.state["next_id"] += 1
+            ids.append(self.state["next_id"])
+        return _Result(ids)
+
+    async def commit(self):
+        self.state["commits"] += 1
+
+
+@pytest.fixture
+def db_state(monkeypatch):
+    state = {"statements": 0, "commits": 0, "next_id": 0, "down": False}
+    monkeypatch.setattr(writer_mod, "get_sessionmaker", lambda: (lambda: FakeDB(state)))
+    return state
+
+
+def _row(dialog_id: int) -> dict:
+    return {"dialog_id": dialog_id, "direction": "in", "text": "t", "meta": {}}
+
+
+def test_bad_row_fails_only_its_own_future(db_state):
+    async def run():
+        w = BatchWriter(delay_ms=1, max_batch=100)
+        written: list[int] = []
+        results = await asyncio.gather(
+            *(
+                w.add(Message, _row(d), wait=True, on_written=written.append)
+                for d in (1, 2, -3, 4, 5)
+            ),
+            return_exceptions=True,
+        )
+        await asyncio.sleep(0)
+        return w, results, written
+
+    w, results, written = asyncio.run(run())
+
+    assert isinstance(results[2], IntegrityError)
+    ok = [r for i, r in enumerate(results) if i != 2]
+    assert all(isinstance(r, int) for r in ok)
+    # on_written — только для записанных строк, в порядке добавления
+    assert written == ok
+    assert w.counters["failed_flushes"] == 1
+    assert w.counters["failed_rows"] == 1
+    assert w.counters["rows"] == 4
+
+
+def test_fire_and_forget_rows_survive_neighbour_error(db_state):
+    async def run():
+        w = BatchWriter(delay_ms=1, max_batch=100)
+        written: list[int] = []
+        for d in (1, -2, 3):
+            assert await w.add(Message, _row(d), wait=False, on_written=written.append) is None
+        await w.flush()
+        await asyncio.sleep(0)
+        return w, written
+
+    w, written = asyncio.run(run())
+
+    assert len(written) == 2
+    assert w.counters["rows"] == 2
+    assert w.counters["failed_rows"] == 1
+
+
+def test_connection_error_fails_batch_without_splitting(db_state):
+    db_state["down"] = True
+
+    async def run():
+        w = BatchWriter(delay_ms=1, max_batch=100)
+        written: list[int] = []
+        results = await asyncio.gather(
+            *(w.add(Message, _row(d), wait=True, on_written=written.append) for d in range(1, 9)),
+            return_exceptions=True,
+        )
+        return w, results, written
+
+    w, results, written = asyncio.run(run())
+
+    assert all(isinstance(r, OperationalError) for r in results)
+    assert written == []
+    assert db_state["statements"] == 1
+    assert w.counters["failed_rows"] == 8